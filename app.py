@@ -2,6 +2,7 @@ import os
 
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import DeclarativeBase
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
@@ -50,6 +51,10 @@ csrf.init_app(app)
 # CSRF exempt routes (for direct login/register)
 csrf.exempt('routes.login')
 csrf.exempt('routes.register')
+# JSON scoring and sweep APIs used by integrations and scripts; they require a
+# logged-in session and a JSON content type, which cross-site forms cannot send
+csrf.exempt('routes.score_model')
+csrf.exempt('routes.create_sweep')
 
 # Setup Flask-Login
 login_manager = LoginManager()
@@ -57,11 +62,37 @@ login_manager.init_app(app)
 login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 
+def add_missing_columns():
+    # create_all() never alters existing tables, so add any nullable columns
+    # introduced since the database was first created
+    inspector = inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(
+                f'ALTER TABLE {preparer.quote(table.name)} ADD COLUMN {preparer.quote(column.name)} {column_type}'
+            ))
+    db.session.commit()
+
+def add_missing_indexes():
+    # create_all() also skips indexes declared on tables that already exist
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
 # Create database tables within app context
 with app.app_context():
     # Import models to register them with SQLAlchemy
-    from models import User, Dataset, AnomalyResult
+    from models import User, Dataset, AnomalyResult, DetectionJob, TrainedModel
     db.create_all()
+    add_missing_columns()
+    add_missing_indexes()
 
 # User loader callback for Flask-Login
 @login_manager.user_loader
@@ -72,3 +103,11 @@ def load_user(user_id):
 # Import and initialize routes
 from routes import init_routes
 init_routes(app)
+
+# Fail jobs left behind by a web process that stopped while they were queued or running
+from utils.job_queue import recover_orphaned_jobs
+with app.app_context():
+    try:
+        recover_orphaned_jobs()
+    except Exception as e:
+        logging.error(f"Error recovering orphaned detection jobs: {str(e)}")
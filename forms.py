@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from flask_wtf.file import FileField, FileRequired, FileAllowed
-from wtforms import StringField, PasswordField, SubmitField, SelectField, TextAreaField
-from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError
+from wtforms import StringField, PasswordField, SubmitField, SelectField, TextAreaField, IntegerField
+from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, Optional, NumberRange
 from models import User
 
 class LoginForm(FlaskForm):
@@ -34,6 +34,7 @@ class UploadDatasetForm(FlaskForm):
     description = TextAreaField('Description')
     time_column = StringField('Time Column Name (optional, will be auto-detected if empty)')
     value_column = StringField('Value Column Name (optional, all numeric columns will be analyzed if empty)')
+    group_column = StringField('Group Column Name (optional, e.g. a meter or site ID)')
     auto_detect = SubmitField('Auto-Detect Columns')
     submit = SubmitField('Upload')
 
@@ -42,9 +43,36 @@ class DetectionForm(FlaskForm):
     algorithm = SelectField('Algorithm', choices=[
         ('isolation_forest', 'Isolation Forest'),
         ('autoencoder', 'AutoEncoder'),
-        ('kmeans', 'K-Means Clustering')
+        ('kmeans', 'K-Means Clustering'),
+        ('streaming', 'Streaming (EWMA)'),
+        ('ensemble', 'Ensemble (IF + PCA + K-Means)'),
+        ('compare', 'Compare All Models')
     ], validators=[DataRequired()])
+    # Isolation Forest options for large datasets; empty fields keep the defaults
+    n_jobs = IntegerField('CPU Cores', validators=[Optional(), NumberRange(min=-1)])
+    fit_sample_size = IntegerField('Training Sample Size', validators=[Optional(), NumberRange(min=1000)])
+    chunk_size = IntegerField('Scoring Chunk Size', validators=[Optional(), NumberRange(min=1000)])
+    # Split long series into this many time windows detected in parallel
+    partitions = IntegerField('Time Partitions', validators=[Optional(), NumberRange(min=2, max=256)])
     submit = SubmitField('Run Detection')
+    
+    def model_params(self):
+        """
+        Job parameters from the optional fields that were filled in: constructor
+        arguments per algorithm, plus 'partitions' for partitioned execution.
+        """
+        forest_params = {
+            name: getattr(self, name).data
+            for name in ('n_jobs', 'fit_sample_size', 'chunk_size')
+            if getattr(self, name).data is not None
+        }
+        # 0 cores is not a valid joblib setting; treat it like an empty field
+        if self.n_jobs.data == 0:
+            forest_params.pop('n_jobs')
+        params = {'isolation_forest': forest_params} if forest_params else {}
+        if self.partitions.data:
+            params['partitions'] = self.partitions.data
+        return params
 
 class SettingsForm(FlaskForm):
     email = StringField('Email', validators=[DataRequired(), Email()])
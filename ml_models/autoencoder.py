@@ -1,11 +1,18 @@
 import numpy as np
 import pandas as pd
 from sklearn.preprocessing import MinMaxScaler
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
 from sklearn.metrics import precision_score, recall_score, f1_score
+from ml_models.features import (CHUNK_ROWS, FeatureSpec, cached_features, clean_columns, cleaning_stats,
+                                column_values, compute_features, feature_names, iter_feature_chunks)
+from ml_models.quantile_sketch import QuantileSketch, sketch_percentile
+
+# Datasets above this many rows are fitted with IncrementalPCA in 'auto' mode
+INCREMENTAL_MIN_ROWS = 1000000
 
 class AutoEncoderModel:
-    def __init__(self, threshold_percentile=95, n_components=3):
+    def __init__(self, threshold_percentile=95, n_components=3, cache_key=None,
+                 fit_mode='auto', batch_size=CHUNK_ROWS):
         """
         Initialize a PCA-based Autoencoder model for anomaly detection.
         
@@ -15,13 +22,82 @@ class AutoEncoderModel:
             Percentile to use for defining the anomaly threshold
         n_components : int, default=3
             Number of principal components to keep
+        cache_key : str or None
+            Identifier of the input data (e.g. dataset content hash) used to
+            reuse computed features across runs. None disables the feature cache.
+        fit_mode : str, default='auto'
+            'full' fits PCA on the whole feature matrix, 'incremental' fits the
+            scaler and IncrementalPCA over chunks of batch_size rows and scores
+            in a second streaming pass, 'auto' uses incremental above
+            INCREMENTAL_MIN_ROWS rows
+        batch_size : int, default=CHUNK_ROWS
+            Rows per chunk in incremental mode
         """
+        if fit_mode not in ('auto', 'full', 'incremental'):
+            raise ValueError(f"Unknown fit_mode '{fit_mode}'")
+        
         self.threshold_percentile = threshold_percentile
+        self.cache_key = cache_key
+        self.fit_mode = fit_mode
+        self.batch_size = batch_size
         self.n_components = n_components
         self.scaler = MinMaxScaler()
         self.model = PCA(n_components=n_components)
         self.threshold = None
+        self.score_sketch = None
+        self.feature_spec = FeatureSpec(windows=(3, 6, 12, 24), stats=('mean', 'std'))
+        self.value_column = None
+        self.feature_names = None
+        self.clean_stats = None
+        self.is_fitted = False
+        
+    def _fit_incremental(self, data, value_column):
+        """
+        Fit the scaler and IncrementalPCA chunk by chunk, then compute the
+        reconstruction error in a second streaming pass.
+        
+        Parameters:
+        -----------
+        data : numpy.ndarray
+            Cleaned values of shape (n_rows, 1)
+        value_column : str
+            Name of the value column
+            
+        Returns:
+        --------
+        mse : numpy.ndarray
+            Reconstruction error of every row
+        n_components : int
+            Number of principal components used
+        """
+        for start in range(0, len(data), self.batch_size):
+            self.scaler.partial_fit(data[start:start + self.batch_size])
+        
+        self.feature_names = feature_names([value_column], self.feature_spec)
+        n_components = max(1, min(self.n_components, len(self.feature_names)))
+        self.model = IncrementalPCA(n_components=n_components)
+        
+        def chunks():
+            for start, X in iter_feature_chunks(data, [value_column], self.feature_spec, self.batch_size,
+                                                prepare=self.scaler.transform):
+                yield start, np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0)
         
+        for _, X in chunks():
+            # Every partial fit needs at least n_components rows
+            if len(X) >= n_components:
+                self.model.partial_fit(X)
+        
+        mse = np.empty(len(data))
+        self.score_sketch = QuantileSketch()
+        for start, X in chunks():
+            X_reconstructed = self.model.inverse_transform(self.model.transform(X))
+            chunk_mse = np.mean(np.square(X - X_reconstructed), axis=1)
+            mse[start:start + len(X)] = chunk_mse
+            self.score_sketch.update(chunk_mse)
+        
+        self.is_fitted = True
+        return mse, n_components
+    
     def detect_anomalies(self, df, time_column='timestamp', value_column='value'):
         """
         Detect anomalies in the time series data using PCA reconstruction error.
@@ -56,112 +132,91 @@ class AutoEncoderModel:
                 else:
                     raise ValueError(f"No suitable numeric columns found in the dataframe")
             
-            # Clean the data - replace infinity values and handle NaNs
-            df_copy[value_column] = df_copy[value_column].replace([np.inf, -np.inf], np.nan)
+            # Clean the data - treat infinities as missing, fill with the median
+            # (more robust than mean for outliers) and clip extreme values
+            values = column_values(df_copy, [value_column])
+            self.value_column = value_column
+            self.clean_stats = cleaning_stats(values)
+            data = clean_columns(values, stats=self.clean_stats)
+            df_copy[value_column] = data[:, 0]
             
-            # Fill NaN values with median (more robust than mean for outliers)
-            median_value = df_copy[value_column].median()
-            if pd.isna(median_value): # If median is NaN (all values are NaN)
-                df_copy[value_column] = df_copy[value_column].fillna(0)
+            incremental = self.fit_mode == 'incremental' or (
+                self.fit_mode == 'auto' and len(df_copy) > INCREMENTAL_MIN_ROWS)
+            if incremental:
+                # Stream feature chunks through the scaler and IncrementalPCA so
+                # memory is bounded by the chunk size rather than the row count
+                mse, effective_n_components = self._fit_incremental(data, value_column)
             else:
-                df_copy[value_column] = df_copy[value_column].fillna(median_value)
-            
-            # Check for extreme values and clip if necessary
-            mean_val = df_copy[value_column].mean()
-            std_val = df_copy[value_column].std()
-            if not pd.isna(std_val) and std_val > 0:
-                lower_bound = mean_val - 5 * std_val
-                upper_bound = mean_val + 5 * std_val
-                df_copy[value_column] = df_copy[value_column].clip(lower_bound, upper_bound)
-            
-            # Extract and scale data with error handling
-            try:
-                data = df_copy[value_column].values.reshape(-1, 1)
-                data_scaled = self.scaler.fit_transform(data)
-            except Exception as e:
-                print(f"Error during data scaling: {str(e)}. Using normalized data.")
-                # If scaling fails, use simple normalization
-                data = df_copy[value_column].values.reshape(-1, 1)
-                data_max = np.max(np.abs(data))
-                if data_max > 0:
-                    data_scaled = data / data_max
-                else:
-                    data_scaled = data
-            
-            # Create time-based features with robust error handling
-            window_sizes = [3, 6, 12, 24]
-            features = [data_scaled]
-            
-            try:
-                for w in window_sizes:
-                    # Add rolling mean with safe handling
-                    try:
-                        roll_mean = pd.Series(data_scaled.flatten()).rolling(window=w, min_periods=1).mean().values
-                        features.append(roll_mean.reshape(-1, 1))
-                    except Exception as e:
-                        print(f"Error calculating rolling mean for window {w}: {str(e)}")
-                        # Add a fallback feature
-                        features.append(data_scaled)
-                    
-                    # Add rolling std with safe handling
-                    try:
-                        roll_std = pd.Series(data_scaled.flatten()).rolling(window=w, min_periods=1).std().fillna(0).values
-                        features.append(roll_std.reshape(-1, 1))
-                    except Exception as e:
-                        print(f"Error calculating rolling std for window {w}: {str(e)}")
-                        # Add a fallback feature (zeros)
-                        features.append(np.zeros_like(data_scaled))
-            except Exception as e:
-                print(f"Error creating window features: {str(e)}. Using only original features.")
-                features = [data_scaled]
-            
-            # Combine features, handling any NaN values
-            try:
-                X = np.hstack([f for f in features])
-                X = np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0)
-            except Exception as e:
-                print(f"Error combining features: {str(e)}. Using only original data.")
-                X = np.nan_to_num(data_scaled, nan=0.0, posinf=0.0, neginf=0.0)
-            
-            # Ensure data has enough samples for PCA
-            effective_n_components = min(self.n_components, X.shape[0] - 1, X.shape[1])
-            if effective_n_components < 1:
-                effective_n_components = 1
-            
-            # Update model if necessary
-            if effective_n_components != self.n_components:
-                print(f"Adjusting PCA components from {self.n_components} to {effective_n_components}")
-                self.model = PCA(n_components=effective_n_components)
-            
-            # Fit PCA model with error handling
-            try:
-                self.model.fit(X)
+                # Scale data with error handling
+                scaled = True
+                try:
+                    data_scaled = self.scaler.fit_transform(data)
+                except Exception as e:
+                    scaled = False
+                    print(f"Error during data scaling: {str(e)}. Using normalized data.")
+                    # If scaling fails, use simple normalization
+                    data_max = np.max(np.abs(data))
+                    if data_max > 0:
+                        data_scaled = data / data_max
+                    else:
+                        data_scaled = data
                 
-                # Transform data to reduced dimension and back to calculate reconstruction error
-                X_reduced = self.model.transform(X)
-                X_reconstructed = self.model.inverse_transform(X_reduced)
+                # Create the value and rolling mean/std features for every window in one pass
+                try:
+                    X, self.feature_names = cached_features(
+                        self.cache_key, [value_column], self.feature_spec, len(data_scaled),
+                        lambda: compute_features(data_scaled, [value_column], self.feature_spec),
+                        stage='minmax'
+                    )
+                    X = np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0)
+                except Exception as e:
+                    print(f"Error creating window features: {str(e)}. Using only original data.")
+                    X = np.nan_to_num(data_scaled, nan=0.0, posinf=0.0, neginf=0.0)
+                    self.feature_names = None
                 
-                # Calculate reconstruction error
-                mse = np.mean(np.square(X - X_reconstructed), axis=1)
-            except Exception as e:
-                print(f"Error in PCA decomposition: {str(e)}. Using simplified anomaly detection.")
-                # Fallback to a simpler approach - z-score based
-                mse = np.zeros(len(X))
-                for col_idx in range(X.shape[1]):
-                    col_data = X[:, col_idx]
-                    col_mean = np.mean(col_data)
-                    col_std = np.std(col_data)
-                    if col_std > 0:
-                        z_scores = np.abs((col_data - col_mean) / col_std)
-                        mse += z_scores
+                # Ensure data has enough samples for PCA
+                effective_n_components = min(self.n_components, X.shape[0] - 1, X.shape[1])
+                if effective_n_components < 1:
+                    effective_n_components = 1
+                
+                # Update model if necessary
+                if effective_n_components != self.n_components:
+                    print(f"Adjusting PCA components from {self.n_components} to {effective_n_components}")
+                    self.model = PCA(n_components=effective_n_components)
                 
-                # Normalize scores
-                if np.max(mse) > 0:
-                    mse = mse / np.max(mse)
+                # Fit PCA model with error handling
+                try:
+                    self.model.fit(X)
+                    
+                    # Transform data to reduced dimension and back to calculate reconstruction error
+                    X_reduced = self.model.transform(X)
+                    X_reconstructed = self.model.inverse_transform(X_reduced)
+                    
+                    # Calculate reconstruction error
+                    mse = np.mean(np.square(X - X_reconstructed), axis=1)
+                    self.is_fitted = scaled and self.feature_names is not None
+                except Exception as e:
+                    print(f"Error in PCA decomposition: {str(e)}. Using simplified anomaly detection.")
+                    # Fallback to a simpler approach - z-score based
+                    mse = np.zeros(len(X))
+                    for col_idx in range(X.shape[1]):
+                        col_data = X[:, col_idx]
+                        col_mean = np.mean(col_data)
+                        col_std = np.std(col_data)
+                        if col_std > 0:
+                            z_scores = np.abs((col_data - col_mean) / col_std)
+                            mse += z_scores
+                    
+                    # Normalize scores
+                    if np.max(mse) > 0:
+                        mse = mse / np.max(mse)
             
-            # Safely determine threshold based on percentile
+            # Safely determine threshold based on percentile, estimated from a
+            # mergeable sketch of the reconstruction errors (bounded memory)
             try:
-                self.threshold = np.percentile(mse, self.threshold_percentile)
+                if not incremental:
+                    self.score_sketch = QuantileSketch.from_values(mse)
+                self.threshold = self.score_sketch.percentile(self.threshold_percentile)
             except Exception as e:
                 print(f"Error calculating threshold: {str(e)}. Using default threshold.")
                 self.threshold = np.mean(mse) + 2 * np.std(mse)
@@ -191,7 +246,8 @@ class AutoEncoderModel:
                     'anomaly_count': int(np.sum(anomalies)),
                     'total_points': len(anomalies),
                     'threshold': float(self.threshold),
-                    'n_components': int(effective_n_components)
+                    'n_components': int(effective_n_components),
+                    'fit_mode': 'incremental' if incremental else 'full'
                 }
             except Exception as e:
                 print(f"Error calculating metrics: {str(e)}. Using basic metrics only.")
@@ -214,7 +270,7 @@ class AutoEncoderModel:
                 std_val = np.std(values)
                 if std_val > 0:
                     z_scores = np.abs((values - mean_val) / std_val)
-                    threshold = np.percentile(z_scores, 95)
+                    threshold = sketch_percentile(z_scores, 95)
                     basic_anomalies = (z_scores > threshold).astype(int)
                     result_df['anomaly_score'] = z_scores
                 else:
@@ -230,8 +286,36 @@ class AutoEncoderModel:
             metrics = {
                 'anomaly_count': int(np.sum(result_df['is_anomaly'])),
                 'total_points': len(df),
-                'threshold': float(np.percentile(result_df['anomaly_score'], 95)) if std_val > 0 else 0,
+                'threshold': float(sketch_percentile(result_df['anomaly_score'], 95)) if std_val > 0 else 0,
                 'note': 'Used emergency fallback method due to critical error'
             }
         
         return result_df, metrics
+    
+    def score(self, df):
+        """
+        Score new rows against the fitted model without refitting.
+        
+        Parameters:
+        -----------
+        df : pandas.DataFrame
+            New rows containing the value column used for fitting
+            
+        Returns:
+        --------
+        scores_df : pandas.DataFrame
+            Dataframe with 'is_anomaly' and 'anomaly_score' for each row
+        """
+        if not self.is_fitted:
+            raise ValueError("Model has not been fitted")
+        
+        data = clean_columns(column_values(df, [self.value_column]), stats=self.clean_stats)
+        X, _ = compute_features(self.scaler.transform(data), [self.value_column], self.feature_spec)
+        X = np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0)
+        
+        X_reconstructed = self.model.inverse_transform(self.model.transform(X))
+        mse = np.mean(np.square(X - X_reconstructed), axis=1)
+        return pd.DataFrame({
+            'is_anomaly': (mse > self.threshold).astype(int),
+            'anomaly_score': mse
+        }, index=df.index)
@@ -0,0 +1,263 @@
+import logging
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+from sklearn.decomposition import PCA
+from sklearn.cluster import KMeans
+from sklearn.preprocessing import StandardScaler
+from scipy.spatial.distance import cdist
+from ml_models.features import (CHUNK_ROWS, FeatureSpec, cached_features, clean_columns, cleaning_stats,
+                                column_values, compute_features, select_feature_columns)
+from ml_models.isolation_forest import LARGE_DATA_ROWS, DEFAULT_FIT_SAMPLE_SIZE
+from ml_models.quantile_sketch import QuantileSketch
+
+logger = logging.getLogger(__name__)
+
+# Scorers fitted on the shared feature matrix, in result column order
+MEMBERS = ('isolation_forest', 'pca', 'kmeans')
+
+COMBINE_METHODS = ('rank', 'max')
+
+# Quantile levels of the training scores kept to normalize member scores
+QUANTILE_LEVELS = np.linspace(0.0, 1.0, 1001)
+
+class EnsembleModel:
+    def __init__(self, combine='rank', contamination=0.05, n_estimators=100, n_components=3, n_clusters=5,
+                 window_size=24, random_state=42, cache_key=None, fit_sample_size=None, chunk_size=CHUNK_ROWS):
+        """
+        Initialize an ensemble of Isolation Forest, PCA reconstruction and
+        K-Means distance scoring over one shared feature matrix.
+
+        The rows are cleaned and the rolling features are computed and
+        scaled once; every member is fitted on that same matrix. Member
+        scores are normalized to their rank among the training scores
+        (0 to 1) and combined by averaging or taking the maximum.
+
+        Parameters:
+        -----------
+        combine : str, default='rank'
+            'rank' averages the normalized member scores, 'max' takes the
+            largest, so an anomaly seen by one member alone is flagged
+        contamination : float, default=0.05
+            Proportion of training rows flagged by the combined score
+        n_estimators : int, default=100
+            Number of trees in the forest
+        n_components : int, default=3
+            Number of principal components kept for the reconstruction
+        n_clusters : int, default=5
+            Number of K-Means clusters
+        window_size : int, default=24
+            Size of the rolling window for feature extraction; with the
+            default the features match those of the Isolation Forest model
+            and are shared with it through the feature cache
+        random_state : int, default=42
+            Random seed for reproducibility
+        cache_key : str or None
+            Identifier of the input data (e.g. dataset content hash) used to
+            reuse computed features across runs. None disables the feature cache.
+        fit_sample_size : int or None
+            Fit the members on a random subsample of this many rows when the
+            dataset is larger. None subsamples DEFAULT_FIT_SAMPLE_SIZE rows
+            only above LARGE_DATA_ROWS rows.
+        chunk_size : int, default=CHUNK_ROWS
+            Rows scored per chunk
+        """
+        if combine not in COMBINE_METHODS:
+            raise ValueError(f"Unknown combine method '{combine}'")
+
+        self.combine = combine
+        self.contamination = contamination
+        self.n_estimators = n_estimators
+        self.n_components = n_components
+        self.n_clusters = n_clusters
+        self.window_size = window_size
+        self.random_state = random_state
+        self.cache_key = cache_key
+        self.fit_sample_size = fit_sample_size
+        self.chunk_size = chunk_size
+        self.feature_spec = FeatureSpec(
+            windows=(window_size,),
+            stats=('mean', 'std', 'max', 'min'),
+            diff=True,
+            pct_change=True
+        )
+        self.scaler = StandardScaler()
+        self.members = {}
+        self.score_quantiles = {}
+        self.threshold = None
+        self.feature_columns = None
+        self.feature_names = None
+        self.value_column = None
+        self.clean_stats = None
+        self.is_fitted = False
+
+    def _fit_members(self, X):
+        # Fit every member on the scaled training rows; a member that cannot be
+        # fitted (e.g. fewer rows than clusters) is left out of the ensemble
+        self.members = {}
+        n_rows, n_features = X.shape
+        for name in MEMBERS:
+            try:
+                if name == 'isolation_forest':
+                    member = IsolationForest(n_estimators=self.n_estimators, contamination=self.contamination,
+                                             random_state=self.random_state)
+                elif name == 'pca':
+                    member = PCA(n_components=max(1, min(self.n_components, n_rows - 1, n_features)))
+                else:
+                    if n_rows <= 2:
+                        raise ValueError(f"Need more than 2 rows to cluster, got {n_rows}")
+                    member = KMeans(n_clusters=min(self.n_clusters, n_rows - 1), random_state=self.random_state)
+                self.members[name] = member.fit(X)
+            except Exception as e:
+                logger.warning(f"Ensemble member {name} could not be fitted: {str(e)}")
+
+        if not self.members:
+            raise ValueError("No ensemble member could be fitted")
+
+    def _member_scores(self, X):
+        # Raw scores of one chunk, higher meaning more anomalous
+        scores = {}
+        for name, member in self.members.items():
+            if name == 'isolation_forest':
+                scores[name] = -member.score_samples(X)
+            elif name == 'pca':
+                X_reconstructed = member.inverse_transform(member.transform(X))
+                scores[name] = np.mean(np.square(X - X_reconstructed), axis=1)
+            else:
+                scores[name] = cdist(X, member.cluster_centers_).min(axis=1)
+        return scores
+
+    def _normalize(self, name, scores):
+        # Rank of each score among the training scores, from 0 to 1
+        return np.interp(scores, self.score_quantiles[name], QUANTILE_LEVELS)
+
+    def _combine(self, normalized):
+        stacked = np.column_stack([normalized[name] for name in self.members])
+        if self.combine == 'max':
+            return stacked.max(axis=1)
+        return stacked.mean(axis=1)
+
+    def _transform(self, X):
+        return np.nan_to_num(self.scaler.transform(X), nan=0.0, posinf=0.0, neginf=0.0)
+
+    def _raw_scores(self, X):
+        # Member scores of every row, scored chunk by chunk to bound temporaries
+        raw = {name: np.empty(len(X)) for name in self.members}
+        for start in range(0, len(X), self.chunk_size):
+            chunk_scores = self._member_scores(self._transform(X[start:start + self.chunk_size]))
+            for name, scores in chunk_scores.items():
+                raw[name][start:start + len(scores)] = scores
+        return raw
+
+    def detect_anomalies(self, df, time_column=None, value_column=None):
+        """
+        Detect anomalies with all ensemble members from one feature pass.
+
+        Parameters:
+        -----------
+        df : pandas.DataFrame
+            Input dataframe with time series data
+        time_column : str or None
+            Column name of the timestamps (not used as a feature)
+        value_column : str or None
+            Column name of the energy consumption values. If None, all
+            numeric columns are used, as with the Isolation Forest model.
+
+        Returns:
+        --------
+        result_df : pandas.DataFrame
+            Dataframe with the original data, the combined anomaly score and
+            the normalized score of every member
+        metrics : dict
+            Dictionary with performance metrics
+        """
+        if value_column and value_column in df.columns:
+            feature_columns = [value_column]
+        else:
+            feature_columns = select_feature_columns(df)
+            logger.info(f"Automatically selected feature columns: {feature_columns}")
+        if not feature_columns:
+            raise ValueError("No valid feature columns found in the dataset")
+
+        # Clean, build and scale the features once for every member
+        values = column_values(df, feature_columns)
+        self.clean_stats = cleaning_stats(values)
+        X, self.feature_names = cached_features(
+            self.cache_key, feature_columns, self.feature_spec, len(df),
+            lambda: compute_features(clean_columns(values, stats=self.clean_stats),
+                                     feature_columns, self.feature_spec)
+        )
+        self.feature_columns = feature_columns
+        self.value_column = feature_columns[0]
+        self.scaler.fit(X)
+
+        sample_size = self.fit_sample_size
+        if sample_size is None and len(df) > LARGE_DATA_ROWS:
+            sample_size = DEFAULT_FIT_SAMPLE_SIZE
+        if sample_size is not None and len(df) > sample_size:
+            rng = np.random.default_rng(self.random_state)
+            fit_rows = np.sort(rng.choice(len(df), size=sample_size, replace=False))
+            self._fit_members(self._transform(X[fit_rows]))
+        else:
+            fit_rows = None
+            self._fit_members(self._transform(X))
+
+        raw = self._raw_scores(X)
+        self.score_quantiles = {name: np.quantile(scores, QUANTILE_LEVELS) for name, scores in raw.items()}
+        normalized = {name: self._normalize(name, scores) for name, scores in raw.items()}
+        combined = self._combine(normalized)
+
+        self.threshold = float(QuantileSketch.from_values(combined).quantile(1 - self.contamination))
+        anomalies = (combined > self.threshold).astype(int)
+        self.is_fitted = True
+
+        result_df = df.copy()
+        result_df['is_anomaly'] = anomalies
+        result_df['anomaly_score'] = combined
+        for name in self.members:
+            result_df[f'{name}_score'] = normalized[name]
+
+        # Share of the flagged rows each member ranks in its own top contamination share
+        flagged = anomalies == 1
+        member_agreement = {
+            name: float(np.mean(normalized[name][flagged] > 1 - self.contamination)) if flagged.any() else 0.0
+            for name in self.members
+        }
+
+        metrics = {
+            'anomaly_count': int(np.sum(anomalies)),
+            'anomaly_ratio': float(np.mean(anomalies)) if len(anomalies) else 0.0,
+            'total_points': len(df),
+            'threshold': self.threshold,
+            'combine': self.combine,
+            'members': list(self.members),
+            'member_agreement': member_agreement,
+            'fit_rows': len(fit_rows) if fit_rows is not None else len(df)
+        }
+        return result_df, metrics
+
+    def score(self, df):
+        """
+        Score new rows against the fitted members without refitting.
+
+        Parameters:
+        -----------
+        df : pandas.DataFrame
+            New rows containing the feature columns used for fitting
+
+        Returns:
+        --------
+        scores_df : pandas.DataFrame
+            Dataframe with 'is_anomaly' and 'anomaly_score' for each row
+        """
+        if not self.is_fitted:
+            raise ValueError("Model has not been fitted")
+
+        values = clean_columns(column_values(df, self.feature_columns), stats=self.clean_stats)
+        X, _ = compute_features(values, self.feature_columns, self.feature_spec)
+        raw = self._raw_scores(X)
+        combined = self._combine({name: self._normalize(name, scores) for name, scores in raw.items()})
+        return pd.DataFrame({
+            'is_anomaly': (combined > self.threshold).astype(int),
+            'anomaly_score': combined
+        }, index=df.index)
@@ -0,0 +1,134 @@
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'features')
+DEFAULT_MAX_BYTES = 1024 ** 3
+
+class FeatureCache:
+    def __init__(self, directory=None, max_bytes=None):
+        """
+        Disk-backed cache of computed feature matrices with LRU eviction.
+
+        Entries are .npy files named by key. Writes go to a temporary file that
+        is atomically renamed into place and eviction runs under a file lock,
+        so several web and worker processes can share one cache directory.
+
+        Parameters:
+        -----------
+        directory : str or None
+            Cache directory, defaults to FEATURE_CACHE_DIR or cache/features
+        max_bytes : int or None
+            Byte budget, defaults to FEATURE_CACHE_BYTES or 1 GiB
+        """
+        self.directory = directory or os.environ.get('FEATURE_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.max_bytes = int(max_bytes if max_bytes is not None
+                             else os.environ.get('FEATURE_CACHE_BYTES', DEFAULT_MAX_BYTES))
+
+    @staticmethod
+    def make_key(data_key, columns, spec, n_rows, stage=''):
+        """
+        Build a cache key from the input data identity and the feature spec.
+
+        Parameters:
+        -----------
+        data_key : str
+            Identifier of the input data, e.g. the dataset content hash
+        columns : list
+            Input columns the features are computed from
+        spec : FeatureSpec
+            Feature specification (windows, statistics, lags, ...)
+        n_rows : int
+            Number of input rows, guards against reusing keys for slices
+        stage : str
+            Extra tag for model-specific transforms applied before the features
+        """
+        payload = json.dumps({
+            'data': data_key,
+            'columns': [str(col) for col in columns],
+            'windows': spec.windows,
+            'stats': spec.stats,
+            'diff': spec.diff,
+            'pct_change': spec.pct_change,
+            'lags': spec.lags,
+            'include_value': spec.include_value,
+            'rows': int(n_rows),
+            'stage': stage
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npy')
+
+    def get(self, key):
+        """
+        Return the cached matrix for a key (memory-mapped), or None on a miss.
+        """
+        path = self._path(key)
+        try:
+            X = np.load(path, mmap_mode='r')
+            # Mark as recently used for LRU eviction
+            os.utime(path)
+            return X
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+    def put(self, key, X):
+        """
+        Store a matrix under a key and evict old entries beyond the budget.
+        """
+        X = np.ascontiguousarray(X)
+        if X.nbytes > self.max_bytes:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f'{self._path(key)}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.save(f, X, allow_pickle=False)
+            os.replace(tmp_path, self._path(key))
+            self.evict()
+        except OSError as e:
+            logger.warning(f"Could not write feature cache entry: {str(e)}")
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache fits its budget.
+        """
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.npy'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    # Readers holding a memory map keep the data until they finish
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+_default_cache = None
+
+def get_feature_cache():
+    """
+    Return the process-wide FeatureCache configured from the environment.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = FeatureCache()
+    return _default_cache
@@ -0,0 +1,441 @@
+import warnings
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from ml_models.feature_cache import get_feature_cache
+
+# Rows processed per block; bounds temporary memory and cumulative-sum error
+CHUNK_ROWS = 65536
+
+ROLLING_STATS = ('mean', 'std', 'max', 'min', 'median')
+
+# Column names recognised as ground-truth anomaly labels; never used as features
+LABEL_COLUMNS = ('is_anomaly', 'anomaly', 'label', 'ground_truth', 'is_outlier', 'outlier')
+
+class FeatureSpec:
+    def __init__(self, windows=(24,), stats=('mean', 'std'), diff=False, pct_change=False,
+                 lags=(), include_value=True):
+        """
+        Declarative description of the features computed for each column.
+
+        Parameters:
+        -----------
+        windows : tuple of int, default=(24,)
+            Rolling window sizes (pandas semantics with min_periods=1)
+        stats : tuple of str, default=('mean', 'std')
+            Rolling statistics to compute, any of ROLLING_STATS
+        diff : bool, default=False
+            Add the first difference of each column
+        pct_change : bool, default=False
+            Add the relative change of each column
+        lags : tuple of int, default=()
+            Lagged copies of each column (shifted values, zero filled)
+        include_value : bool, default=True
+            Include the column values themselves as the first feature
+        """
+        unknown = [stat for stat in stats if stat not in ROLLING_STATS]
+        if unknown:
+            raise ValueError(f"Unknown rolling statistics: {unknown}")
+
+        self.windows = tuple(int(w) for w in windows)
+        self.stats = tuple(stats)
+        self.diff = diff
+        self.pct_change = pct_change
+        self.lags = tuple(int(lag) for lag in lags)
+        self.include_value = include_value
+
+    @property
+    def max_window(self):
+        """
+        Number of preceding rows a feature can depend on, plus one.
+        """
+        return max(self.windows + tuple(lag + 1 for lag in self.lags) + (2,))
+
+    def __repr__(self):
+        return (f'<FeatureSpec windows={self.windows} stats={self.stats} diff={self.diff} '
+                f'pct_change={self.pct_change} lags={self.lags}>')
+
+def feature_names(columns, spec):
+    """
+    Names of the features produced by compute_features, in output order.
+
+    Each column contributes one contiguous block: the value, the rolling
+    statistics (window-major), then diff, pct_change and lags.
+    """
+    names = []
+    for col in columns:
+        if spec.include_value:
+            names.append(str(col))
+        for w in spec.windows:
+            for stat in spec.stats:
+                if len(spec.windows) == 1:
+                    names.append(f'{col}_rolling_{stat}')
+                else:
+                    names.append(f'{col}_rolling_{stat}_{w}')
+        if spec.diff:
+            names.append(f'{col}_diff')
+        if spec.pct_change:
+            names.append(f'{col}_pct_change')
+        for lag in spec.lags:
+            names.append(f'{col}_lag_{lag}')
+    return names
+
+def cleaning_stats(values, clip_std=5):
+    """
+    Per-column imputation and clipping statistics used by clean_columns.
+
+    Infinite values are treated as missing. Missing values are replaced by
+    the column median (0 for all-missing columns), and the clipping bounds are
+    mean +/- clip_std standard deviations of the imputed column.
+
+    Parameters:
+    -----------
+    values : numpy.ndarray
+        Array of shape (n_rows, n_columns)
+    clip_std : float, default=5
+        Clipping bound in standard deviations
+
+    Returns:
+    --------
+    stats : dict
+        'median', 'lower' and 'upper' arrays of length n_columns
+    """
+    filled = np.array(values, dtype=np.float64, copy=True)
+    if filled.ndim == 1:
+        filled = filled.reshape(-1, 1)
+    filled[~np.isfinite(filled)] = np.nan
+
+    with warnings.catch_warnings():
+        # All-missing columns produce a NaN median and are filled with 0 below
+        warnings.simplefilter('ignore', RuntimeWarning)
+        medians = np.nanmedian(filled, axis=0)
+    medians = np.where(np.isnan(medians), 0.0, medians)
+    missing = np.isnan(filled)
+    if missing.any():
+        filled[missing] = np.take(medians, np.nonzero(missing)[1])
+
+    lower = np.full(filled.shape[1], -np.inf)
+    upper = np.full(filled.shape[1], np.inf)
+    if len(filled) > 1:
+        mean = filled.mean(axis=0)
+        std = filled.std(axis=0, ddof=1)
+        valid = np.isfinite(std) & (std > 0)
+        lower = np.where(valid, mean - clip_std * std, lower)
+        upper = np.where(valid, mean + clip_std * std, upper)
+
+    return {'median': medians, 'lower': lower, 'upper': upper}
+
+def clean_columns(values, clip_std=5, stats=None):
+    """
+    Impute and clip a matrix of column values in one vectorized pass.
+
+    Parameters:
+    -----------
+    values : numpy.ndarray
+        Array of shape (n_rows, n_columns)
+    clip_std : float, default=5
+        Clipping bound in standard deviations
+    stats : dict or None
+        Statistics from cleaning_stats, e.g. those of the training data when
+        scoring new rows. None computes them from values.
+
+    Returns:
+    --------
+    cleaned : numpy.ndarray
+        Cleaned float64 array of the same shape
+    """
+    if stats is None:
+        stats = cleaning_stats(values, clip_std)
+
+    cleaned = np.array(values, dtype=np.float64, copy=True)
+    if cleaned.ndim == 1:
+        cleaned = cleaned.reshape(-1, 1)
+    missing = ~np.isfinite(cleaned)
+    if missing.any():
+        cleaned[missing] = np.take(stats['median'], np.nonzero(missing)[1])
+    np.clip(cleaned, stats['lower'], stats['upper'], out=cleaned)
+    return cleaned
+
+def _window_sums(padded, window):
+    # Sliding sums of each full window in a NaN-padded block
+    valid = ~np.isnan(padded)
+    filled = np.where(valid, padded, 0.0)
+    center = filled.sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    centered = np.where(valid, padded - center, 0.0)
+
+    zeros = np.zeros((1, padded.shape[1]))
+    cs_count = np.concatenate([zeros, np.cumsum(valid, axis=0)])
+    cs_sum = np.concatenate([zeros, np.cumsum(centered, axis=0)])
+    cs_sq = np.concatenate([zeros, np.cumsum(centered * centered, axis=0)])
+
+    count = cs_count[window:] - cs_count[:-window]
+    total = cs_sum[window:] - cs_sum[:-window]
+    total_sq = cs_sq[window:] - cs_sq[:-window]
+    return count, total, total_sq, center
+
+def _window_extreme(padded, window, func):
+    # Doubling (sparse table) reduction: O(n log w) with NaN-ignoring fmax/fmin
+    span = 1
+    acc = padded
+    while span * 2 <= window:
+        acc = func(acc[:-span], acc[span:])
+        span *= 2
+    # acc[i] covers padded[i : i + span]; combine two overlapping spans
+    n_out = len(padded) - window + 1
+    return func(acc[:n_out], acc[window - span:window - span + n_out])
+
+def _window_median(padded, window):
+    # Sorting short rows is much faster than np.median's partition; NaNs sort
+    # last, so the median of each window sits in its first `count` entries
+    ordered = np.sort(sliding_window_view(padded, window, axis=0), axis=-1)
+    if not np.isnan(padded).any():
+        return (ordered[..., (window - 1) // 2] + ordered[..., window // 2]) / 2
+    count = window - np.isnan(ordered).sum(axis=-1, keepdims=True)
+    lower = np.take_along_axis(ordered, np.maximum(count - 1, 0) // 2, axis=-1)
+    upper = np.take_along_axis(ordered, count // 2, axis=-1)
+    return ((lower + upper) / 2)[..., 0]
+
+def rolling_stats(values, window, stats):
+    """
+    Rolling statistics for every column of a matrix at once.
+
+    Matches pandas ``rolling(window, min_periods=1)`` semantics: leading
+    rows use partial windows and missing values are ignored. Windows with
+    no valid value (and std windows with fewer than two) yield 0.
+
+    Parameters:
+    -----------
+    values : numpy.ndarray
+        Array of shape (n_rows, n_columns)
+    window : int
+        Window size in rows
+    stats : tuple of str
+        Statistics to compute, any of ROLLING_STATS
+
+    Returns:
+    --------
+    result : dict
+        Mapping of statistic name to an array of shape (n_rows, n_columns)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n_rows, n_cols = values.shape
+    result = {stat: np.empty((n_rows, n_cols)) for stat in stats}
+
+    pad = np.full((window - 1, n_cols), np.nan)
+    for start in range(0, n_rows, CHUNK_ROWS):
+        end = min(start + CHUNK_ROWS, n_rows)
+        # Each block carries the window - 1 preceding rows (NaN before row 0)
+        prefix = values[max(start - window + 1, 0):start]
+        padded = np.concatenate([pad[:window - 1 - len(prefix)], prefix, values[start:end]])
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if 'mean' in stats or 'std' in stats:
+                count, total, total_sq, center = _window_sums(padded, window)
+                if 'mean' in stats:
+                    result['mean'][start:end] = np.where(count > 0, total / np.maximum(count, 1) + center, 0.0)
+                if 'std' in stats:
+                    var = (total_sq - total * total / np.maximum(count, 1)) / np.maximum(count - 1, 1)
+                    result['std'][start:end] = np.where(count > 1, np.sqrt(np.maximum(var, 0.0)), 0.0)
+            if 'max' in stats:
+                result['max'][start:end] = np.nan_to_num(_window_extreme(padded, window, np.fmax), nan=0.0)
+            if 'min' in stats:
+                result['min'][start:end] = np.nan_to_num(_window_extreme(padded, window, np.fmin), nan=0.0)
+            if 'median' in stats:
+                result['median'][start:end] = np.nan_to_num(_window_median(padded, window), nan=0.0)
+
+    return result
+
+def _shift(values, periods):
+    shifted = np.zeros_like(values)
+    if periods < len(values):
+        shifted[periods:] = values[:-periods]
+    return shifted
+
+def compute_features(values, columns, spec):
+    """
+    Compute the feature matrix declared by a FeatureSpec.
+
+    All columns and windows are processed together as matrix operations; the
+    only Python-level loops run over windows and row blocks.
+
+    Parameters:
+    -----------
+    values : numpy.ndarray
+        Array of shape (n_rows, n_columns), usually from clean_columns
+    columns : list
+        Names of the input columns
+    spec : FeatureSpec
+        Features to compute
+
+    Returns:
+    --------
+    X : numpy.ndarray
+        C-contiguous float64 matrix of shape (n_rows, n_features)
+    names : list
+        Feature names in column order
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    n_rows, n_cols = values.shape
+    names = feature_names(columns, spec)
+
+    per_column = len(names) // max(n_cols, 1)
+    X = np.empty((n_rows, n_cols, per_column))
+    slot = 0
+
+    if spec.include_value:
+        X[:, :, slot] = values
+        slot += 1
+
+    for w in spec.windows:
+        stats = rolling_stats(values, w, spec.stats)
+        for stat in spec.stats:
+            X[:, :, slot] = stats[stat]
+            slot += 1
+
+    if spec.diff or spec.pct_change:
+        previous = _shift(values, 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if spec.diff:
+                diff = values - previous
+                diff[:1] = 0.0
+                X[:, :, slot] = diff
+                slot += 1
+            if spec.pct_change:
+                change = values / previous - 1.0
+                change[:1] = 0.0
+                X[:, :, slot] = np.where(np.isfinite(change), change, 0.0)
+                slot += 1
+
+    for lag in spec.lags:
+        X[:, :, slot] = _shift(values, lag)
+        slot += 1
+
+    # (rows, columns, features) -> (rows, columns * features) keeps each column's block together
+    return np.ascontiguousarray(X.reshape(n_rows, n_cols * per_column)), names
+
+def iter_feature_chunks(values, columns, spec, chunk_rows=CHUNK_ROWS, prepare=None):
+    """
+    Compute the compute_features matrix block by block.
+
+    Each block is computed with the spec.max_window - 1 preceding rows as
+    context, so the yielded rows equal the matching rows of the full matrix
+    while memory stays bounded by the chunk size.
+
+    Parameters:
+    -----------
+    values : numpy.ndarray
+        Array of shape (n_rows, n_columns); may be a memory map
+    columns : list
+        Names of the input columns
+    spec : FeatureSpec
+        Features to compute
+    chunk_rows : int, default=CHUNK_ROWS
+        Rows per yielded block
+    prepare : callable or None
+        Row-wise transform applied to each block before computing features,
+        e.g. cleaning with stored statistics or a fitted scaler
+
+    Yields:
+    -------
+    start : int
+        Index of the first row of the block
+    X : numpy.ndarray
+        Features of rows start to start + len(X)
+    """
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    context = spec.max_window - 1
+    for start in range(0, len(values), chunk_rows):
+        end = min(start + chunk_rows, len(values))
+        lo = max(start - context, 0)
+        block = values[lo:end]
+        if prepare is not None:
+            block = prepare(block)
+        X, _ = compute_features(block, columns, spec)
+        yield start, X[start - lo:]
+
+def cached_features(cache_key, columns, spec, n_rows, compute, stage=''):
+    """
+    Return a feature matrix from the feature cache, computing it on a miss.
+
+    Parameters:
+    -----------
+    cache_key : str or None
+        Identifier of the input data (e.g. the dataset content hash). None
+        disables caching and always calls compute.
+    columns : list
+        Names of the input columns
+    spec : FeatureSpec
+        Features to compute
+    n_rows : int
+        Number of input rows
+    compute : callable
+        Zero-argument function returning (X, names) as compute_features does
+    stage : str, default=''
+        Tag for model-specific transforms applied before compute_features
+
+    Returns:
+    --------
+    X : numpy.ndarray
+        Feature matrix; cached matrices are read-only memory maps
+    names : list
+        Feature names in column order
+    """
+    if cache_key is None:
+        return compute()
+
+    cache = get_feature_cache()
+    key = cache.make_key(cache_key, columns, spec, n_rows, stage)
+    names = feature_names(columns, spec)
+    X = cache.get(key)
+    if X is not None and X.shape == (n_rows, len(names)):
+        return X, names
+
+    X, names = compute()
+    cache.put(key, X)
+    return X, names
+
+def detect_label_column(df):
+    """
+    Return the ground-truth anomaly label column of a dataframe, or None.
+
+    A label column has one of the names in LABEL_COLUMNS (any case) and
+    only holds 0/1 or boolean values, ignoring missing entries.
+    """
+    for col in df.columns:
+        if str(col).lower() not in LABEL_COLUMNS:
+            continue
+        values = pd.to_numeric(df[col], errors='coerce')
+        present = values.dropna()
+        if len(present) and values.notna().sum() == df[col].notna().sum() and present.isin([0, 1]).all():
+            return col
+    return None
+
+def select_feature_columns(df, exclude_patterns=('date', 'time', 'timestamp', 'id', 'index')):
+    """
+    Numeric columns of a dataframe that are not timestamps, identifiers or
+    ground-truth labels.
+    """
+    numeric_cols = df.select_dtypes(include=['number']).columns
+    return [col for col in numeric_cols if str(col).lower() not in LABEL_COLUMNS and not any(
+        pattern in str(col).lower() for pattern in exclude_patterns)]
+
+def default_value_column(df):
+    """
+    Value column used when none is given: the first feature column that is
+    not the ground-truth label column, or None if there is none.
+    """
+    label_column = detect_label_column(df)
+    columns = [col for col in select_feature_columns(df) if col != label_column]
+    return columns[0] if columns else None
+
+def column_values(df, columns):
+    """
+    Extract columns as a float64 matrix, coercing non-numeric entries to NaN.
+    """
+    return np.column_stack([
+        pd.to_numeric(df[col], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        for col in columns
+    ]) if columns else np.empty((len(df), 0))
@@ -1,14 +1,26 @@
 import numpy as np
 import pandas as pd
 import logging
+from joblib import parallel_config
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import precision_score, recall_score, f1_score
+from ml_models.features import (CHUNK_ROWS, FeatureSpec, cached_features, clean_columns, cleaning_stats,
+                                column_values, compute_features, feature_names, iter_feature_chunks,
+                                select_feature_columns)
+from ml_models.quantile_sketch import QuantileSketch
 
 logger = logging.getLogger(__name__)
 
+# Datasets above this many rows are fitted on a subsample unless a sample size is given
+LARGE_DATA_ROWS = 1000000
+
+# Default training sample size for large datasets
+DEFAULT_FIT_SAMPLE_SIZE = 250000
+
 class IsolationForestModel:
-    def __init__(self, contamination=0.05, random_state=42):
+    def __init__(self, contamination=0.05, random_state=42, cache_key=None,
+                 n_jobs=None, fit_sample_size=None, chunk_size=CHUNK_ROWS, n_estimators=100):
         """
         Initialize Isolation Forest model for anomaly detection.
         
@@ -18,17 +30,73 @@ class IsolationForestModel:
             The proportion of outliers in the dataset
         random_state : int, default=42
             Random seed for reproducibility
+        cache_key : str or None
+            Identifier of the input data (e.g. dataset content hash) used to
+            reuse computed features across runs. None disables the feature cache.
+        n_jobs : int or None
+            Cores used to build and score the trees (-1 for all). None uses all
+            cores in large-data mode and one core otherwise.
+        fit_sample_size : int or None
+            Fit on a random subsample of this many rows when the dataset is
+            larger (large-data mode). None subsamples DEFAULT_FIT_SAMPLE_SIZE
+            rows only above LARGE_DATA_ROWS rows.
+        chunk_size : int, default=CHUNK_ROWS
+            Rows scored per chunk; in large-data mode features are also built
+            per chunk so memory does not grow with the row count
+        n_estimators : int, default=100
+            Number of trees in the forest
         """
         self.contamination = contamination
+        self.n_estimators = n_estimators
         self.random_state = random_state
+        self.cache_key = cache_key
+        self.n_jobs = n_jobs
+        self.fit_sample_size = fit_sample_size
+        self.chunk_size = chunk_size
         self.model = IsolationForest(
             contamination=contamination,
             random_state=random_state,
-            n_estimators=100,
-            max_samples='auto'
+            n_estimators=n_estimators,
+            max_samples='auto',
+            n_jobs=n_jobs
         )
         self.scaler = StandardScaler()
+        self.feature_spec = None
+        self.feature_columns = None
+        self.feature_names = None
+        self.clean_stats = None
+        self.feature_sketches = {}
+        self.is_fitted = False
+        
+    def _resolve_feature_columns(self, df, feature_columns):
+        # Auto-detect feature columns if not specified
+        if feature_columns is None:
+            # Exclude typical timestamp or ID columns
+            feature_columns = select_feature_columns(df)
+            logger.info(f"Automatically selected feature columns: {feature_columns}")
+        
+        if not feature_columns:
+            raise ValueError("No valid feature columns found in the dataset")
         
+        for col in feature_columns:
+            if col not in df.columns:
+                logger.warning(f"Column {col} not found in dataframe. Skipping.")
+        feature_columns = [col for col in feature_columns if col in df.columns]
+        
+        if not feature_columns:
+            raise ValueError("No valid feature columns found in the dataset")
+        return feature_columns
+    
+    def _make_feature_spec(self, n_rows):
+        # Rolling, diff and pct_change features with a window scaled to short series
+        window_size = min(24, n_rows // 10) if n_rows > 30 else 3
+        return FeatureSpec(
+            windows=(window_size,),
+            stats=('mean', 'std', 'max', 'min'),
+            diff=True,
+            pct_change=True
+        )
+    
     def preprocess(self, df, feature_columns=None):
         """
         Preprocess the data for Isolation Forest with multi-column support.
@@ -48,72 +116,22 @@ class IsolationForestModel:
         feature_names : list
             Names of all features used (original and derived)
         """
-        # Make a copy to avoid modifying the original
-        df_copy = df.copy()
+        feature_columns = self._resolve_feature_columns(df, feature_columns)
         
-        # Replace infinity values and NaNs
-        df_copy = df_copy.replace([np.inf, -np.inf], np.nan)
-        
-        # Auto-detect feature columns if not specified
-        if feature_columns is None:
-            # Exclude typical timestamp or ID columns
-            exclude_patterns = ['date', 'time', 'timestamp', 'id', 'index']
-            numeric_cols = df_copy.select_dtypes(include=['number']).columns
-            
-            feature_columns = [col for col in numeric_cols if not any(
-                pattern in col.lower() for pattern in exclude_patterns)]
-            
-            logger.info(f"Automatically selected feature columns: {feature_columns}")
-        
-        if not feature_columns:
-            raise ValueError("No valid feature columns found in the dataset")
-        
-        # Create a dataframe to hold all features
-        X = pd.DataFrame(index=df_copy.index)
-        
-        # Process each feature column
-        for col in feature_columns:
-            if col not in df_copy.columns:
-                logger.warning(f"Column {col} not found in dataframe. Skipping.")
-                continue
-                
-            # Add original feature and handle NaN values
-            X[col] = df_copy[col].fillna(df_copy[col].median() if not df_copy[col].isna().all() else 0)
-            
-            # Clip extreme values to prevent overflow
-            col_mean = X[col].mean()
-            col_std = X[col].std()
-            if not np.isnan(col_mean) and not np.isnan(col_std) and col_std != 0:
-                # Clip to +/- 5 standard deviations
-                lower_bound = col_mean - 5 * col_std
-                upper_bound = col_mean + 5 * col_std
-                X[col] = X[col].clip(lower_bound, upper_bound)
-            
-            # Add rolling statistics as features with error handling
-            try:
-                window_size = min(24, len(df_copy) // 10) if len(df_copy) > 30 else 3
-                
-                # Safely compute rolling statistics
-                X[f'{col}_rolling_mean'] = df_copy[col].rolling(window=window_size, min_periods=1).mean().fillna(0)
-                X[f'{col}_rolling_std'] = df_copy[col].rolling(window=window_size, min_periods=1).std().fillna(0)
-                X[f'{col}_rolling_max'] = df_copy[col].rolling(window=window_size, min_periods=1).max().fillna(0)
-                X[f'{col}_rolling_min'] = df_copy[col].rolling(window=window_size, min_periods=1).min().fillna(0)
-                
-                # Add additional features with safety checks
-                X[f'{col}_diff'] = df_copy[col].diff().fillna(0)
-                # Handle potential division by zero in pct_change
-                pct_change = df_copy[col].pct_change()
-                X[f'{col}_pct_change'] = pct_change.replace([np.inf, -np.inf], np.nan).fillna(0)
-                
-            except Exception as e:
-                logger.warning(f"Error processing column {col}: {str(e)}. Using basic features only.")
-                
-        # Check for and handle any remaining NaN or infinity values
-        X = X.fillna(0)
-        X = X.replace([np.inf, -np.inf], 0)
+        # Impute and clip every column at once, then build all rolling,
+        # diff and pct_change features in a single batched pass
+        self.feature_spec = self._make_feature_spec(len(df))
+        values = column_values(df, feature_columns)
+        self.clean_stats = cleaning_stats(values)
+        X, feature_names = cached_features(
+            self.cache_key, feature_columns, self.feature_spec, len(df),
+            lambda: compute_features(clean_columns(values, stats=self.clean_stats),
+                                     feature_columns, self.feature_spec)
+        )
+        self.feature_columns = feature_columns
+        self.feature_names = feature_names
         
         # Scale all features with error handling
-        feature_names = X.columns.tolist()
         try:
             X_scaled = self.scaler.fit_transform(X)
             # Double-check for any NaN or infinity values after scaling
@@ -121,10 +139,67 @@ class IsolationForestModel:
         except Exception as e:
             logger.error(f"Error during feature scaling: {str(e)}")
             # Fall back to numpy array without scaling if scaling fails
-            X_scaled = np.nan_to_num(X.values, nan=0.0, posinf=0.0, neginf=0.0)
+            X_scaled = np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0)
+            self.scaler = None
         
         return X_scaled, feature_names, feature_columns
     
+    def _score_chunks(self, chunks):
+        # Negated decision function per chunk; the trees are walked in
+        # parallel threads when n_jobs allows it
+        scores = []
+        with parallel_config(backend='threading', n_jobs=self.model.n_jobs):
+            for _, X in chunks:
+                scores.append(-self.model.decision_function(X))
+        return np.concatenate(scores) if scores else np.empty(0)
+    
+    def _fit_sampled(self, df, feature_columns, sample_size):
+        """
+        Fit on a random subsample and score all rows chunk by chunk.
+        
+        Features are built per chunk, so only one chunk of the feature matrix
+        and the training sample are held in memory at any time.
+        
+        Returns:
+        --------
+        anomaly_scores : numpy.ndarray
+            Score of every row (positive for anomalies)
+        feature_columns : list
+            Input columns used as features
+        """
+        feature_columns = self._resolve_feature_columns(df, feature_columns)
+        self.feature_spec = self._make_feature_spec(len(df))
+        values = column_values(df, feature_columns)
+        self.clean_stats = cleaning_stats(values)
+        self.feature_columns = feature_columns
+        
+        def chunks():
+            for start, X in iter_feature_chunks(values, feature_columns, self.feature_spec, self.chunk_size,
+                                                prepare=lambda block: clean_columns(block, stats=self.clean_stats)):
+                yield start, X
+        
+        # First pass: scaling statistics and the rows of the training sample
+        rng = np.random.default_rng(self.random_state)
+        sample_idx = np.sort(rng.choice(len(values), size=sample_size, replace=False))
+        sample = []
+        for start, X in chunks():
+            self.scaler.partial_fit(X)
+            lo, hi = np.searchsorted(sample_idx, [start, start + len(X)])
+            sample.append(X[sample_idx[lo:hi] - start])
+        
+        X_sample = np.nan_to_num(self.scaler.transform(np.concatenate(sample)), nan=0.0, posinf=0.0, neginf=0.0)
+        self.model.fit(X_sample)
+        self.is_fitted = True
+        self.feature_names = feature_names(feature_columns, self.feature_spec)
+        del sample, X_sample
+        
+        # Second pass: score every row
+        anomaly_scores = self._score_chunks(
+            (start, np.nan_to_num(self.scaler.transform(X), nan=0.0, posinf=0.0, neginf=0.0))
+            for start, X in chunks()
+        )
+        return anomaly_scores, feature_columns
+    
     def detect_anomalies(self, df, time_column=None, value_column=None):
         """
         Detect anomalies in the time series data across multiple columns.
@@ -157,19 +232,30 @@ class IsolationForestModel:
         # If value_column is specified, use only that column, otherwise use all suitable numeric columns
         feature_columns = [value_column] if value_column else None
         
-        # Preprocess the data
-        X, feature_names, original_features = self.preprocess(df, feature_columns)
+        sample_size = self.fit_sample_size
+        if sample_size is None and len(df) > LARGE_DATA_ROWS:
+            sample_size = DEFAULT_FIT_SAMPLE_SIZE
+        large_data = sample_size is not None and len(df) > sample_size
+        if self.n_jobs is None:
+            self.model.set_params(n_jobs=-1 if large_data else None)
         
-        # Fit the model and predict
-        self.model.fit(X)
-        predictions = self.model.predict(X)
-        
-        # Convert predictions to binary labels (1 for anomalies, 0 for normal)
-        # In Isolation Forest, -1 is anomaly, 1 is normal
-        anomalies = np.where(predictions == -1, 1, 0)
+        if large_data:
+            # Stream feature chunks: fit on a subsample, then score chunk by chunk
+            anomaly_scores, original_features = self._fit_sampled(df, feature_columns, sample_size)
+        else:
+            # Preprocess the data
+            X, feature_names, original_features = self.preprocess(df, feature_columns)
+            
+            # Fit the model and score every point once
+            self.model.fit(X)
+            self.is_fitted = True
+            anomaly_scores = self._score_chunks(
+                (start, X[start:start + self.chunk_size]) for start in range(0, len(X), self.chunk_size)
+            )
         
-        # Calculate anomaly scores
-        anomaly_scores = -self.model.decision_function(X)
+        # predict() labels points with a negative decision function as anomalies,
+        # so the labels follow from the scores (1 for anomalies, 0 for normal)
+        anomalies = (anomaly_scores > 0).astype(int)
         
         # Create result dataframe
         result_df = df.copy()
@@ -179,6 +265,7 @@ class IsolationForestModel:
         # Identify which features contribute most to anomalies
         feature_importance = {}
         anomaly_details = {}
+        self.feature_sketches = {}
         
         # For each original feature, determine its contribution to anomalies
         for feature in original_features:
@@ -188,8 +275,9 @@ class IsolationForestModel:
             # Get feature values
             feature_values = df[feature].values
             
-            # Calculate feature-specific anomaly threshold
-            threshold = np.percentile(feature_values, 95)
+            # Calculate feature-specific anomaly threshold from a mergeable sketch
+            self.feature_sketches[feature] = QuantileSketch.from_values(feature_values)
+            threshold = self.feature_sketches[feature].percentile(95)
             feature_anomalies = np.where(feature_values > threshold, 1, 0)
             
             # Add feature-specific anomaly flags
@@ -219,8 +307,42 @@ class IsolationForestModel:
             'anomaly_count': int(np.sum(anomalies)),
             'anomaly_ratio': float(np.mean(anomalies)),
             'total_points': len(df),
+            'fit_rows': int(sample_size) if large_data else len(df),
             'feature_importance': feature_importance,
             'anomaly_details': anomaly_details
         }
         
         return result_df, metrics
+    
+    def score(self, df):
+        """
+        Score new rows against the fitted model without refitting.
+        
+        The cleaning statistics and scaler of the training data are reused, so
+        scores are comparable with those of the original detection run.
+        
+        Parameters:
+        -----------
+        df : pandas.DataFrame
+            New rows containing the feature columns used for fitting
+            
+        Returns:
+        --------
+        scores_df : pandas.DataFrame
+            Dataframe with 'is_anomaly' and 'anomaly_score' for each row
+        """
+        if not self.is_fitted:
+            raise ValueError("Model has not been fitted")
+        
+        values = clean_columns(column_values(df, self.feature_columns), stats=self.clean_stats)
+        X, _ = compute_features(values, self.feature_columns, self.feature_spec)
+        if self.scaler is not None:
+            X = self.scaler.transform(X)
+        X = np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0)
+        
+        # predict() flags points with a negative decision function as anomalies
+        anomaly_scores = -self.model.decision_function(X)
+        return pd.DataFrame({
+            'is_anomaly': (anomaly_scores > 0).astype(int),
+            'anomaly_score': anomaly_scores
+        }, index=df.index)
@@ -1,12 +1,22 @@
 import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import precision_score, recall_score, f1_score
 from scipy.spatial.distance import cdist
+from ml_models.features import (CHUNK_ROWS, FeatureSpec, cached_features, clean_columns, cleaning_stats,
+                                column_values, compute_features, feature_names, iter_feature_chunks)
+from ml_models.quantile_sketch import sketch_percentile
+
+# Datasets above this many rows are clustered with MiniBatch K-Means in 'auto' mode
+MINIBATCH_MIN_ROWS = 1000000
+
+# Rows per MiniBatchKMeans update step
+MINIBATCH_STEP = 4096
 
 class KMeansModel:
-    def __init__(self, n_clusters=5, window_size=24, threshold_factor=1.5, random_state=42):
+    def __init__(self, n_clusters=5, window_size=24, threshold_factor=1.5, random_state=42, cache_key=None,
+                 fit_mode='auto', batch_size=CHUNK_ROWS, per_cluster_threshold=False):
         """
         Initialize K-Means Clustering model for anomaly detection.
         
@@ -20,8 +30,28 @@ class KMeansModel:
             Factor to multiply with the max average distance to determine anomalies
         random_state : int, default=42
             Random seed for reproducibility
+        cache_key : str or None
+            Identifier of the input data (e.g. dataset content hash) used to
+            reuse computed features across runs. None disables the feature cache.
+        fit_mode : str, default='auto'
+            'full' fits KMeans on the whole feature matrix, 'minibatch' streams
+            chunks of batch_size rows through MiniBatchKMeans so the feature
+            matrix is never materialized, 'auto' uses minibatch above
+            MINIBATCH_MIN_ROWS rows
+        batch_size : int, default=CHUNK_ROWS
+            Rows per chunk in minibatch mode
+        per_cluster_threshold : bool, default=False
+            Flag points against threshold_factor times the mean distance of
+            their own cluster instead of the largest mean distance of any cluster
         """
+        if fit_mode not in ('auto', 'full', 'minibatch'):
+            raise ValueError(f"Unknown fit_mode '{fit_mode}'")
+        
         self.n_clusters = n_clusters
+        self.cache_key = cache_key
+        self.fit_mode = fit_mode
+        self.batch_size = batch_size
+        self.per_cluster_threshold = per_cluster_threshold
         self.window_size = window_size
         self.threshold_factor = threshold_factor
         self.random_state = random_state
@@ -29,6 +59,16 @@ class KMeansModel:
         self.scaler = StandardScaler()
         self.cluster_centers = None
         self.threshold = None
+        self.cluster_thresholds = None
+        self.value_column = None
+        self.feature_names = None
+        self.clean_stats = None
+        self.is_fitted = False
+        self.feature_spec = FeatureSpec(
+            windows=(window_size,),
+            stats=('mean', 'std', 'median', 'max', 'min'),
+            diff=True
+        )
         
     def extract_features(self, df, value_column):
         """
@@ -46,67 +86,94 @@ class KMeansModel:
         features : pandas.DataFrame
             Dataframe with extracted features
         """
-        # Make a copy to avoid modifying the original
-        df_copy = df.copy()
-        
-        # Replace any infinity values with NaN
-        df_copy = df_copy.replace([np.inf, -np.inf], np.nan)
-        
-        # Handle missing values in the value column
-        if value_column in df_copy.columns:
-            # Use median for imputation (more robust than mean)
-            median_value = df_copy[value_column].median()
-            if pd.isna(median_value):  # If median is NaN (all values are NaN)
-                df_copy[value_column] = df_copy[value_column].fillna(0)
-            else:
-                df_copy[value_column] = df_copy[value_column].fillna(median_value)
-                
-            # Clip extreme values to prevent outliers from skewing the model
-            # Use 5 standard deviations as a reasonable bound
-            mean_val = df_copy[value_column].mean()
-            std_val = df_copy[value_column].std()
-            
-            if not pd.isna(std_val) and std_val > 0:
-                lower_bound = mean_val - 5 * std_val
-                upper_bound = mean_val + 5 * std_val
-                df_copy[value_column] = df_copy[value_column].clip(lower_bound, upper_bound)
-        else:
+        if value_column not in df.columns:
             raise ValueError(f"Value column '{value_column}' not found in the dataframe")
         
-        # Extract time-based features
-        features = pd.DataFrame()
+        # Impute missing values with the median (more robust than mean) and clip
+        # extreme values to 5 standard deviations so outliers don't skew the model
+        values = column_values(df, [value_column])
+        self.value_column = value_column
+        self.clean_stats = cleaning_stats(values)
         
-        try:
-            # Add the cleaned value
-            features['value'] = df_copy[value_column]
-            
-            # Add rolling window statistics with error handling
-            features['rolling_mean'] = df_copy[value_column].rolling(window=self.window_size, min_periods=1).mean().fillna(0)
-            features['rolling_std'] = df_copy[value_column].rolling(window=self.window_size, min_periods=1).std().fillna(0)
-            features['rolling_median'] = df_copy[value_column].rolling(window=self.window_size, min_periods=1).median().fillna(0)
-            features['rolling_max'] = df_copy[value_column].rolling(window=self.window_size, min_periods=1).max().fillna(0)
-            features['rolling_min'] = df_copy[value_column].rolling(window=self.window_size, min_periods=1).min().fillna(0)
-            
-            # Add rate of change with careful handling of potential infinity issues
-            diff = df_copy[value_column].diff()
-            features['rate_of_change'] = diff.replace([np.inf, -np.inf], np.nan).fillna(0)
-            
-        except Exception as e:
-            # Log the error and provide graceful fallback
-            print(f"Error extracting features: {str(e)}. Using basic features only.")
-            features['value'] = df_copy[value_column]
-            features['rolling_mean'] = features['value']
-            features['rolling_std'] = 0
-            features['rolling_median'] = features['value']
-            features['rolling_max'] = features['value']
-            features['rolling_min'] = features['value']
-            features['rate_of_change'] = 0
+        def compute():
+            values_clean = clean_columns(values, stats=self.clean_stats)
+            try:
+                # Value, rolling window statistics and rate of change in one batched pass
+                return compute_features(values_clean, [value_column], self.feature_spec)
+            except Exception as e:
+                # Log the error and provide graceful fallback
+                print(f"Error extracting features: {str(e)}. Using basic features only.")
+                names = feature_names([value_column], self.feature_spec)
+                return np.repeat(values_clean, len(names), axis=1), names
+        
+        X, names = cached_features(self.cache_key, [value_column], self.feature_spec, len(df), compute)
+        self.feature_names = names
+        features = pd.DataFrame(X, columns=names, index=df.index)
         
         # Final safety check - replace any remaining NaN or Inf
         features = features.replace([np.inf, -np.inf], np.nan).fillna(0)
         
         return features
     
+    def _fit_minibatch(self, df, value_column):
+        """
+        Fit the scaler and MiniBatchKMeans over feature chunks.
+        
+        Makes three streaming passes (scaler statistics, cluster centers, then
+        assignments), each holding only one chunk of features in memory.
+        
+        Returns:
+        --------
+        cluster_labels : numpy.ndarray
+            Nearest cluster of every row
+        distances : numpy.ndarray
+            Distance of every row to its cluster center
+        """
+        if value_column not in df.columns:
+            raise ValueError(f"Value column '{value_column}' not found in the dataframe")
+        
+        values = column_values(df, [value_column])
+        self.value_column = value_column
+        self.clean_stats = cleaning_stats(values)
+        self.feature_names = feature_names([value_column], self.feature_spec)
+        
+        def chunks():
+            for start, X in iter_feature_chunks(values, [value_column], self.feature_spec, self.batch_size,
+                                                prepare=lambda block: clean_columns(block, stats=self.clean_stats)):
+                yield start, np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0)
+        
+        for _, X in chunks():
+            self.scaler.partial_fit(X)
+        
+        # Several minibatch updates per chunk keep the centers moving smoothly
+        self.model = MiniBatchKMeans(n_clusters=self.n_clusters, random_state=self.random_state,
+                                     batch_size=MINIBATCH_STEP)
+        for _, X in chunks():
+            X_scaled = np.nan_to_num(self.scaler.transform(X), nan=0.0)
+            for step in range(0, len(X_scaled), MINIBATCH_STEP):
+                batch = X_scaled[step:step + MINIBATCH_STEP]
+                if len(batch) >= self.n_clusters:
+                    self.model.partial_fit(batch)
+        self.cluster_centers = self.model.cluster_centers_
+        
+        cluster_labels = np.empty(len(values), dtype=np.int64)
+        distances = np.empty(len(values))
+        for start, X in chunks():
+            X_scaled = np.nan_to_num(self.scaler.transform(X), nan=0.0)
+            center_distances = cdist(X_scaled, self.cluster_centers)
+            labels = np.argmin(center_distances, axis=1)
+            cluster_labels[start:start + len(X)] = labels
+            distances[start:start + len(X)] = center_distances[np.arange(len(X)), labels]
+        
+        return cluster_labels, distances
+    
+    def _cluster_mean_distances(self, distances, cluster_labels):
+        # Mean distance of the points assigned to each center (0 for empty clusters)
+        n_centers = len(self.cluster_centers)
+        counts = np.bincount(cluster_labels, minlength=n_centers)
+        sums = np.bincount(cluster_labels, weights=distances, minlength=n_centers)
+        return np.where(counts > 0, sums / np.maximum(counts, 1), 0.0)
+    
     def detect_anomalies(self, df, time_column='timestamp', value_column='value'):
         """
         Detect anomalies in the time series data using K-Means clustering.
@@ -131,110 +198,116 @@ class KMeansModel:
             # Make a copy of the input dataframe to avoid modifying it
             df_copy = df.copy()
             
-            # Extract features with error handling
-            features = self.extract_features(df_copy, value_column)
-            
-            # Ensure there are no NaN or infinity values
-            features = features.replace([np.inf, -np.inf], np.nan).fillna(0)
-            
-            # Scale features with error handling
-            try:
-                features_scaled = self.scaler.fit_transform(features)
-                # Double-check for any NaNs after scaling
-                features_scaled = np.nan_to_num(features_scaled, nan=0.0)
-            except Exception as e:
-                print(f"Error during feature scaling: {str(e)}. Using unscaled features.")
-                # If scaling fails, use unscaled but normalized features
-                features_vals = features.values
-                features_scaled = np.nan_to_num(features_vals, nan=0.0)
-                # Simple normalization as fallback
-                col_max = np.max(np.abs(features_scaled), axis=0)
-                col_max[col_max == 0] = 1.0  # Avoid division by zero
-                features_scaled = features_scaled / col_max
-            
-            # Fit K-Means model with error handling
-            try:
-                # Adjust n_clusters if we have fewer samples than clusters
-                effective_n_clusters = min(self.n_clusters, len(features_scaled) - 1)
-                if effective_n_clusters < 2:
-                    effective_n_clusters = 2  # At least 2 clusters needed
-                
-                if effective_n_clusters != self.n_clusters:
-                    temp_model = KMeans(n_clusters=effective_n_clusters, random_state=self.random_state)
-                    temp_model.fit(features_scaled)
-                    self.cluster_centers = temp_model.cluster_centers_
-                    cluster_labels = temp_model.predict(features_scaled)
-                else:
-                    self.model.fit(features_scaled)
-                    self.cluster_centers = self.model.cluster_centers_
-                    cluster_labels = self.model.predict(features_scaled)
-            except Exception as e:
-                print(f"Error fitting KMeans model: {str(e)}. Using simplified approach.")
-                # Fallback to a simpler approach - use percentile-based anomaly detection
-                anomalies = np.zeros(len(features_scaled))
-                anomaly_scores = np.zeros(len(features_scaled))
-                
-                # Compute anomaly score based on distance from mean for each feature
-                for col_idx in range(features_scaled.shape[1]):
-                    col_data = features_scaled[:, col_idx]
-                    col_mean = np.mean(col_data)
-                    col_std = np.std(col_data)
-                    if col_std > 0:
-                        z_scores = np.abs((col_data - col_mean) / col_std)
-                        anomaly_scores += z_scores
-                
-                # Normalize scores
-                if np.max(anomaly_scores) > 0:
-                    anomaly_scores = anomaly_scores / np.max(anomaly_scores)
-                
-                # Tag anomalies (top 5%)
-                threshold = np.percentile(anomaly_scores, 95)
-                anomalies = (anomaly_scores > threshold).astype(int)
+            minibatch = self.fit_mode == 'minibatch' or (
+                self.fit_mode == 'auto' and len(df_copy) > MINIBATCH_MIN_ROWS)
+            if minibatch:
+                # Stream feature chunks through MiniBatchKMeans so the full
+                # feature matrix is never held in memory
+                cluster_labels, distances = self._fit_minibatch(df_copy, value_column)
+                scaled = True
+            else:
+                # Extract features with error handling
+                features = self.extract_features(df_copy, value_column)
                 
-                # Create result dataframe
-                result_df = df_copy.copy()
-                result_df['is_anomaly'] = anomalies
-                result_df['anomaly_score'] = anomaly_scores
-                result_df['cluster'] = 0  # All assigned to the same cluster in fallback
+                # Ensure there are no NaN or infinity values
+                features = features.replace([np.inf, -np.inf], np.nan).fillna(0)
                 
-                # Calculate metrics
-                metrics = {
-                    'anomaly_count': int(np.sum(anomalies)),
-                    'anomaly_ratio': float(np.mean(anomalies)),
-                    'total_points': len(df_copy),
-                    'threshold': float(threshold),
-                    'clusters': 1,  # Fallback used no clustering
-                    'note': 'Used fallback detection method due to KMeans fitting error'
-                }
+                # Scale features with error handling
+                scaled = True
+                try:
+                    features_scaled = self.scaler.fit_transform(features.to_numpy())
+                    # Double-check for any NaNs after scaling
+                    features_scaled = np.nan_to_num(features_scaled, nan=0.0)
+                except Exception as e:
+                    scaled = False
+                    print(f"Error during feature scaling: {str(e)}. Using unscaled features.")
+                    # If scaling fails, use unscaled but normalized features
+                    features_vals = features.values
+                    features_scaled = np.nan_to_num(features_vals, nan=0.0)
+                    # Simple normalization as fallback
+                    col_max = np.max(np.abs(features_scaled), axis=0)
+                    col_max[col_max == 0] = 1.0  # Avoid division by zero
+                    features_scaled = features_scaled / col_max
                 
-                return result_df, metrics
-            
-            # Calculate distance to cluster center for each point
-            distances = np.zeros(len(features_scaled))
-            for i in range(len(features_scaled)):
+                # Fit K-Means model with error handling
                 try:
-                    distances[i] = np.linalg.norm(features_scaled[i] - self.cluster_centers[cluster_labels[i]])
+                    # Adjust n_clusters if we have fewer samples than clusters
+                    effective_n_clusters = min(self.n_clusters, len(features_scaled) - 1)
+                    if effective_n_clusters < 2:
+                        effective_n_clusters = 2  # At least 2 clusters needed
+                    
+                    if effective_n_clusters != self.n_clusters:
+                        temp_model = KMeans(n_clusters=effective_n_clusters, random_state=self.random_state)
+                        temp_model.fit(features_scaled)
+                        self.cluster_centers = temp_model.cluster_centers_
+                        cluster_labels = temp_model.predict(features_scaled)
+                    else:
+                        self.model.fit(features_scaled)
+                        self.cluster_centers = self.model.cluster_centers_
+                        cluster_labels = self.model.predict(features_scaled)
                 except Exception as e:
-                    print(f"Error calculating distance for point {i}: {str(e)}. Using default value.")
-                    distances[i] = 0.0
+                    print(f"Error fitting KMeans model: {str(e)}. Using simplified approach.")
+                    # Fallback to a simpler approach - use percentile-based anomaly detection
+                    anomalies = np.zeros(len(features_scaled))
+                    anomaly_scores = np.zeros(len(features_scaled))
+                    
+                    # Compute anomaly score based on distance from mean for each feature
+                    for col_idx in range(features_scaled.shape[1]):
+                        col_data = features_scaled[:, col_idx]
+                        col_mean = np.mean(col_data)
+                        col_std = np.std(col_data)
+                        if col_std > 0:
+                            z_scores = np.abs((col_data - col_mean) / col_std)
+                            anomaly_scores += z_scores
+                    
+                    # Normalize scores
+                    if np.max(anomaly_scores) > 0:
+                        anomaly_scores = anomaly_scores / np.max(anomaly_scores)
+                    
+                    # Tag anomalies (top 5%)
+                    threshold = sketch_percentile(anomaly_scores, 95)
+                    anomalies = (anomaly_scores > threshold).astype(int)
+                    
+                    # Create result dataframe
+                    result_df = df_copy.copy()
+                    result_df['is_anomaly'] = anomalies
+                    result_df['anomaly_score'] = anomaly_scores
+                    result_df['cluster'] = 0  # All assigned to the same cluster in fallback
+                    
+                    # Calculate metrics
+                    metrics = {
+                        'anomaly_count': int(np.sum(anomalies)),
+                        'anomaly_ratio': float(np.mean(anomalies)),
+                        'total_points': len(df_copy),
+                        'threshold': float(threshold),
+                        'clusters': 1,  # Fallback used no clustering
+                        'note': 'Used fallback detection method due to KMeans fitting error'
+                    }
+                    
+                    return result_df, metrics
+                
+                # Distance of every point to its assigned center in one vectorized pass
+                distances = np.linalg.norm(features_scaled - self.cluster_centers[cluster_labels], axis=1)
             
-            # Determine threshold for anomalies with robustness
-            avg_distances = []
-            for i in range(len(self.cluster_centers)):
-                cluster_points = distances[cluster_labels == i]
-                if len(cluster_points) > 0:
-                    avg_distances.append(np.mean(cluster_points))
-                else:
-                    avg_distances.append(0.0)
+            # Mean distance per cluster from a single bincount pass
+            avg_distances = self._cluster_mean_distances(distances, cluster_labels)
             
-            if len(avg_distances) > 0 and max(avg_distances) > 0:
-                self.threshold = self.threshold_factor * max(avg_distances)
+            if len(avg_distances) > 0 and avg_distances.max() > 0:
+                self.threshold = self.threshold_factor * avg_distances.max()
             else:
                 # Fallback threshold based on percentile of all distances
-                self.threshold = np.percentile(distances, 95)
+                self.threshold = sketch_percentile(distances, 95)
             
             # Flag anomalies
-            anomalies = (distances > self.threshold).astype(int)
+            if self.per_cluster_threshold:
+                # Empty or zero-spread clusters fall back to the global threshold
+                self.cluster_thresholds = np.where(avg_distances > 0,
+                                                   self.threshold_factor * avg_distances,
+                                                   self.threshold)
+                anomalies = (distances > self.cluster_thresholds[cluster_labels]).astype(int)
+            else:
+                anomalies = (distances > self.threshold).astype(int)
+            self.is_fitted = scaled
             
             # Create result dataframe
             result_df = df_copy.copy()
@@ -259,8 +332,11 @@ class KMeansModel:
                     'anomaly_count': int(np.sum(anomalies)),
                     'total_points': len(df_copy),
                     'threshold': float(self.threshold),
-                    'clusters': int(len(self.cluster_centers))
+                    'clusters': int(len(self.cluster_centers)),
+                    'fit_mode': 'minibatch' if minibatch else 'full'
                 }
+                if self.cluster_thresholds is not None:
+                    metrics['cluster_thresholds'] = [float(t) for t in self.cluster_thresholds]
             except Exception as e:
                 print(f"Error calculating metrics: {str(e)}. Using basic metrics only.")
                 metrics = {
@@ -283,7 +359,7 @@ class KMeansModel:
                     basic_scores = np.abs((values - mean_val) / std_val)
             
             # Mark top 5% as anomalies
-            threshold = np.percentile(basic_scores, 95)
+            threshold = sketch_percentile(basic_scores, 95)
             basic_anomalies = (basic_scores > threshold).astype(int)
             
             result_df['is_anomaly'] = basic_anomalies
@@ -299,3 +375,36 @@ class KMeansModel:
             }
         
         return result_df, metrics
+    
+    def score(self, df):
+        """
+        Score new rows against the fitted clusters without refitting.
+        
+        Parameters:
+        -----------
+        df : pandas.DataFrame
+            New rows containing the value column used for fitting
+            
+        Returns:
+        --------
+        scores_df : pandas.DataFrame
+            Dataframe with 'is_anomaly', 'anomaly_score' and 'cluster' for each row
+        """
+        if not self.is_fitted:
+            raise ValueError("Model has not been fitted")
+        
+        values = clean_columns(column_values(df, [self.value_column]), stats=self.clean_stats)
+        X, _ = compute_features(values, [self.value_column], self.feature_spec)
+        X = np.nan_to_num(self.scaler.transform(np.nan_to_num(X, nan=0.0, posinf=0.0, neginf=0.0)), nan=0.0)
+        
+        # Assign each row to its nearest center, as KMeans.predict does
+        center_distances = cdist(X, self.cluster_centers)
+        clusters = np.argmin(center_distances, axis=1)
+        distances = center_distances[np.arange(len(X)), clusters]
+        cluster_thresholds = getattr(self, 'cluster_thresholds', None)
+        threshold = cluster_thresholds[clusters] if cluster_thresholds is not None else self.threshold
+        return pd.DataFrame({
+            'is_anomaly': (distances > threshold).astype(int),
+            'anomaly_score': distances,
+            'cluster': clusters
+        }, index=df.index)
@@ -0,0 +1,182 @@
+import numpy as np
+from ml_models.features import CHUNK_ROWS
+
+# Items kept at the top level; rank error is roughly 1.7 / k of the row count
+DEFAULT_K = 2048
+
+# Each lower level keeps this fraction of the capacity of the level above it
+CAPACITY_DECAY = 2.0 / 3.0
+
+# Smallest capacity of any level
+MIN_CAPACITY = 8
+
+class QuantileSketch:
+    def __init__(self, k=DEFAULT_K, seed=0):
+        """
+        Mergeable KLL quantile sketch of a stream of values.
+
+        Values enter level 0. When a level exceeds its capacity it is sorted
+        and every other item (randomly the odd or even ones) moves up one
+        level, where each item stands for twice as many values. Memory stays
+        around 3 * k items however many values are added, and two sketches
+        of disjoint data merge into a sketch of the union, so chunked and
+        parallel runs can combine partial results. While fewer than k values
+        have been added the sketch is exact and quantile() matches
+        np.percentile.
+
+        Parameters:
+        -----------
+        k : int, default=DEFAULT_K
+            Capacity of the top level; larger is more accurate
+        seed : int, default=0
+            Seed of the compaction coin flips, for reproducible thresholds
+        """
+        if k < MIN_CAPACITY:
+            raise ValueError(f"k must be at least {MIN_CAPACITY}")
+
+        self.k = int(k)
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @classmethod
+    def from_values(cls, values, **kwargs):
+        """
+        Build a sketch of an array of values.
+        """
+        sketch = cls(**kwargs)
+        sketch.update(values)
+        return sketch
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(MIN_CAPACITY, int(np.ceil(self.k * CAPACITY_DECAY ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+                # An odd item out stays behind so the total weight is preserved
+                keep = items[len(items) - len(items) % 2:]
+                items = items[:len(items) - len(items) % 2]
+                promoted = items[self._rng.integers(2)::2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = keep
+            level += 1
+
+    def update(self, values):
+        """
+        Add values to the sketch. Non-finite values are ignored.
+
+        Parameters:
+        -----------
+        values : array-like
+            Values to add, of any shape
+        """
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return self
+
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        # Add in blocks so a large array never sits unsorted in level 0
+        for start in range(0, len(values), CHUNK_ROWS):
+            block = values[start:start + CHUNK_ROWS]
+            self.levels[0] = np.concatenate([self.levels[0], block])
+            self.n += len(block)
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """
+        Fold another sketch into this one.
+
+        Parameters:
+        -----------
+        other : QuantileSketch
+            Sketch of values disjoint from the ones already added
+
+        Returns:
+        --------
+        self : QuantileSketch
+            The merged sketch
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantile(self, q):
+        """
+        Estimate quantiles with linear interpolation between ranks.
+
+        Parameters:
+        -----------
+        q : float or array-like
+            Quantiles in [0, 1]
+
+        Returns:
+        --------
+        value : float or numpy.ndarray
+            Estimated quantiles, NaN if the sketch is empty
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if np.any((q < 0) | (q > 1)):
+            raise ValueError("Quantiles must be in the range [0, 1]")
+        if self.n == 0:
+            return np.full(q.shape, np.nan) if q.ndim else np.nan
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items = items[order]
+        weights = weights[order]
+
+        # An item of weight w covers w consecutive ranks; place it at their middle
+        positions = np.cumsum(weights) - (weights + 1) / 2
+        estimate = np.interp(q * (self.n - 1), positions, items)
+        estimate = np.where(q <= 0, self.min, np.where(q >= 1, self.max, estimate))
+        return estimate if q.ndim else float(estimate)
+
+    def percentile(self, q):
+        """
+        Estimate percentiles, like np.percentile with q in [0, 100].
+        """
+        return self.quantile(np.asarray(q, dtype=np.float64) / 100)
+
+    def __len__(self):
+        return self.n
+
+    def __repr__(self):
+        return f'<QuantileSketch k={self.k} n={self.n} items={sum(len(level) for level in self.levels)}>'
+
+def sketch_percentile(values, q, k=DEFAULT_K):
+    """
+    Percentile of an array computed through a QuantileSketch.
+
+    Parameters:
+    -----------
+    values : array-like
+        Values; non-finite entries are ignored
+    q : float or array-like
+        Percentiles in [0, 100]
+    k : int, default=DEFAULT_K
+        Sketch accuracy parameter
+
+    Returns:
+    --------
+    value : float or numpy.ndarray
+        Estimated percentiles
+    """
+    return QuantileSketch.from_values(values, k=k).percentile(q)
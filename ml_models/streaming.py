@@ -0,0 +1,281 @@
+import copy
+import logging
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+from ml_models.features import column_values, select_feature_columns
+
+logger = logging.getLogger(__name__)
+
+# Scale factor turning a mean absolute deviation into a standard deviation (normal data)
+MAD_TO_STD = np.sqrt(np.pi / 2)
+
+# Lower bound on the scale so flat series do not divide by zero
+MIN_SCALE = 1e-9
+
+SEASONS = {
+    None: 1,
+    'hour': 24,
+    'hour_of_week': 168
+}
+
+class StreamingDetector:
+    def __init__(self, alpha=0.05, z_threshold=4.0, warmup=10, season='hour', cache_key=None):
+        """
+        Initialize an online EWMA detector with a seasonal baseline.
+
+        Each seasonal slot (e.g. hour of day) keeps an exponentially weighted
+        mean and mean absolute deviation of the readings that fell into it.
+        A reading is scored by its robust z-score against the state of its
+        slot before the reading arrived, then folded into that state, so
+        every update costs O(1) time and the state is O(slots) in size.
+
+        Parameters:
+        -----------
+        alpha : float, default=0.05
+            Smoothing factor of the moving mean and deviation
+        z_threshold : float, default=4.0
+            Robust z-score above which a reading is flagged
+        warmup : int, default=10
+            Readings a slot must have seen before it can flag anomalies
+        season : str or None, default='hour'
+            Seasonal slots: 'hour' (24 per day), 'hour_of_week' (168) or None
+        cache_key : str or None
+            Accepted for a uniform model interface; no features are cached
+        """
+        if season not in SEASONS:
+            raise ValueError(f"Unknown season '{season}'")
+
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self.season = season
+        self.cache_key = cache_key
+        self.threshold = z_threshold
+        self.time_column = None
+        self.value_column = None
+        self.feature_names = None
+        self.is_fitted = False
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all observed readings.
+        """
+        n_slots = SEASONS[self.season]
+        self.mean = np.zeros(n_slots)
+        self.dev = np.zeros(n_slots)
+        self.count = np.zeros(n_slots, dtype=np.int64)
+
+    def _slots(self, timestamps):
+        # Seasonal slot of each timestamp; -1 marks unparseable times
+        times = pd.DatetimeIndex(pd.to_datetime(timestamps, errors='coerce'))
+        slots = np.asarray(times.hour, dtype=np.float64)
+        if self.season == 'hour_of_week':
+            slots = slots + 24 * np.asarray(times.dayofweek, dtype=np.float64)
+        return np.where(np.isnan(slots), -1, slots).astype(np.int64)
+
+    def _slot(self, timestamp):
+        # Scalar version of _slots for single readings
+        try:
+            time = pd.Timestamp(timestamp)
+        except (TypeError, ValueError):
+            return -1
+        if pd.isna(time):
+            return -1
+        if self.season == 'hour_of_week':
+            return time.hour + 24 * time.dayofweek
+        return time.hour
+
+    def _score_slot(self, slot, x):
+        # Vectorized equivalent of calling update() for every reading of one slot
+        n = len(x)
+        keep = 1.0 - self.alpha
+        c0 = self.count[slot]
+        m0 = self.mean[slot] if c0 > 0 else x[0]
+
+        means = lfilter([self.alpha], [1.0, -keep], x, zi=[keep * m0])[0]
+        mean_prev = np.concatenate([[m0], means[:-1]])
+        deviations = np.abs(x - mean_prev)
+
+        # Readings seen before each one; the very first reading has no deviation
+        count_prev = c0 + np.arange(n)
+        has_dev = count_prev >= 1
+        devs = np.full(n, self.dev[slot])
+        if has_dev.any():
+            devs[has_dev] = lfilter([self.alpha], [1.0, -keep], deviations[has_dev],
+                                    zi=[keep * self.dev[slot]])[0]
+        dev_prev = np.concatenate([[self.dev[slot]], devs[:-1]])
+
+        # Bias-corrected deviation, since the moving average starts at zero
+        n_dev_prev = np.maximum(count_prev - 1, 0)
+        correction = 1.0 - keep ** n_dev_prev
+        scale = MAD_TO_STD * dev_prev / np.where(correction > 0, correction, 1.0)
+        ready = (count_prev >= self.warmup) & (n_dev_prev > 0)
+        scores = np.where(ready, deviations / np.maximum(scale, MIN_SCALE), 0.0)
+
+        self.mean[slot] = means[-1]
+        self.dev[slot] = devs[-1]
+        self.count[slot] = c0 + n
+        return scores
+
+    def _score_batch(self, values, slots):
+        # Group readings by slot (keeping time order) and run each group at once
+        scores = np.zeros(len(values))
+        valid = np.isfinite(values) & (slots >= 0)
+        index = np.flatnonzero(valid)
+        if len(index) == 0:
+            return scores
+
+        order = index[np.argsort(slots[index], kind='stable')]
+        bounds = np.flatnonzero(np.diff(slots[order])) + 1
+        for group in np.split(order, bounds):
+            scores[group] = self._score_slot(slots[group[0]], values[group])
+        return scores
+
+    def _resolve_columns(self, df, time_column, value_column):
+        if time_column is None:
+            for col in df.columns:
+                if any(time_pattern in str(col).lower() for time_pattern in ['time', 'date', 'timestamp']):
+                    time_column = col
+                    logger.info(f"Auto-detected time column: {time_column}")
+                    break
+        if time_column not in df.columns:
+            time_column = None
+
+        if value_column is None or value_column not in df.columns:
+            candidates = select_feature_columns(df)
+            if not candidates:
+                raise ValueError("No suitable numeric columns found in the dataframe")
+            value_column = candidates[0]
+            logger.info(f"Using '{value_column}' as the value column")
+        return time_column, value_column
+
+    def detect_anomalies(self, df, time_column=None, value_column=None):
+        """
+        Detect anomalies by streaming the rows through a fresh detector state.
+
+        Parameters:
+        -----------
+        df : pandas.DataFrame
+            Input dataframe with time series data, in time order
+        time_column : str or None
+            Column name of the timestamps. If None, it will be auto-detected.
+        value_column : str or None
+            Column name of the energy consumption values. If None, the first
+            numeric column is used.
+
+        Returns:
+        --------
+        result_df : pandas.DataFrame
+            Dataframe with the original data and anomaly predictions
+        metrics : dict
+            Dictionary with performance metrics
+        """
+        time_column, value_column = self._resolve_columns(df, time_column, value_column)
+        self.time_column = time_column if self.season is not None else None
+        self.value_column = value_column
+        self.feature_names = [value_column]
+
+        self.reset()
+        values = column_values(df, [value_column])[:, 0]
+        if self.time_column is not None:
+            slots = self._slots(df[self.time_column])
+        else:
+            slots = np.zeros(len(df), dtype=np.int64)
+        scores = self._score_batch(values, slots)
+        anomalies = (scores > self.z_threshold).astype(int)
+        self.is_fitted = True
+
+        result_df = df.copy()
+        result_df['is_anomaly'] = anomalies
+        result_df['anomaly_score'] = scores
+
+        metrics = {
+            'anomaly_count': int(np.sum(anomalies)),
+            'anomaly_ratio': float(np.mean(anomalies)) if len(anomalies) else 0.0,
+            'total_points': len(df),
+            'threshold': float(self.z_threshold),
+            'season': self.season,
+            'seasonal_slots': int(np.count_nonzero(self.count))
+        }
+
+        return result_df, metrics
+
+    def update(self, row):
+        """
+        Score one reading, then fold it into the detector state.
+
+        Parameters:
+        -----------
+        row : dict or pandas.Series
+            Reading with the value column and, for seasonal detectors, the
+            time column used when the detector was fitted
+
+        Returns:
+        --------
+        result : dict
+            'anomaly_score' and 'is_anomaly' of the reading
+        """
+        if self.value_column is None:
+            raise ValueError("Detector has no value column; run detect_anomalies first")
+
+        try:
+            x = float(row[self.value_column])
+        except (TypeError, ValueError):
+            x = np.nan
+        slot = 0
+        if self.time_column is not None:
+            slot = self._slot(row[self.time_column])
+        if not np.isfinite(x) or slot < 0:
+            return {'anomaly_score': 0.0, 'is_anomaly': 0}
+
+        keep = 1.0 - self.alpha
+        count = int(self.count[slot])
+        if count == 0:
+            self.mean[slot] = x
+            self.count[slot] = 1
+            return {'anomaly_score': 0.0, 'is_anomaly': 0}
+
+        mean = float(self.mean[slot])
+        dev = float(self.dev[slot])
+        deviation = abs(x - mean)
+        score = 0.0
+        n_dev = count - 1
+        if count >= self.warmup and n_dev > 0:
+            scale = MAD_TO_STD * dev / (1.0 - keep ** n_dev)
+            score = deviation / max(scale, MIN_SCALE)
+
+        self.mean[slot] = self.alpha * x + keep * mean
+        self.dev[slot] = self.alpha * deviation + keep * dev
+        self.count[slot] = count + 1
+        return {'anomaly_score': float(score), 'is_anomaly': int(score > self.z_threshold)}
+
+    def score(self, df):
+        """
+        Score new rows continuing from the current state, without changing it.
+
+        Parameters:
+        -----------
+        df : pandas.DataFrame
+            New rows in time order
+
+        Returns:
+        --------
+        scores_df : pandas.DataFrame
+            Dataframe with 'is_anomaly' and 'anomaly_score' for each row
+        """
+        if not self.is_fitted:
+            raise ValueError("Model has not been fitted")
+
+        detector = copy.deepcopy(self)
+        values = column_values(df, [self.value_column])[:, 0]
+        if self.time_column is not None:
+            slots = detector._slots(df[self.time_column])
+        else:
+            slots = np.zeros(len(df), dtype=np.int64)
+        scores = detector._score_batch(values, slots)
+        return pd.DataFrame({
+            'is_anomaly': (scores > self.z_threshold).astype(int),
+            'anomaly_score': scores
+        }, index=df.index)
@@ -1,3 +1,5 @@
+import os
+import socket
 from datetime import datetime
 from app import db
 from flask_login import UserMixin
@@ -29,9 +31,14 @@ class Dataset(db.Model):
     row_count = db.Column(db.Integer)
     time_column = db.Column(db.String(100))
     value_column = db.Column(db.String(100))
+    # Meter/site ID column; when set, every group is detected separately
+    group_column = db.Column(db.String(100))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     results = db.relationship('AnomalyResult', backref='dataset', lazy=True)
     
+    # Dashboard aggregates: uploads per day of a user
+    __table_args__ = (db.Index('ix_dataset_user_upload_date', 'user_id', 'upload_date'),)
+    
     def __repr__(self):
         return f'<Dataset {self.filename}>'
 
@@ -42,8 +49,84 @@ class AnomalyResult(db.Model):
     anomaly_count = db.Column(db.Integer)
     result_path = db.Column(db.String(255), nullable=False)
     metrics = db.Column(db.JSON)
+    # Aggregates computed at detection time (see utils.visualizer.summarize_result)
+    summary = db.Column(db.JSON)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     dataset_id = db.Column(db.Integer, db.ForeignKey('dataset.id'), nullable=False)
+    job_id = db.Column(db.Integer, db.ForeignKey('detection_job.id'))
+    
+    # Dashboard aggregates (results per algorithm, latest result of each) and recent results
+    __table_args__ = (db.Index('ix_anomaly_result_user_algorithm_date', 'user_id', 'algorithm', 'creation_date'),
+                      db.Index('ix_anomaly_result_user_date', 'user_id', 'creation_date'))
     
     def __repr__(self):
         return f'<AnomalyResult {self.algorithm} - {self.creation_date}>'
+
+def process_owner():
+    """
+    Host and process ID of the current process, recorded on the jobs it queues.
+    """
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+class DetectionJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    algorithm = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    params = db.Column(db.JSON)
+    # Job-level output that is not a detection result, e.g. a sweep's ranked table
+    output = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    creation_date = db.Column(db.DateTime, default=datetime.utcnow)
+    started_date = db.Column(db.DateTime)
+    finished_date = db.Column(db.DateTime)
+    # Web process whose worker pool runs the job (see process_owner)
+    owner = db.Column(db.String(255), default=process_owner)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    dataset_id = db.Column(db.Integer, db.ForeignKey('dataset.id'), nullable=False)
+    dataset = db.relationship('Dataset')
+    results = db.relationship('AnomalyResult', backref='job', lazy=True)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'algorithm': self.algorithm,
+            'status': self.status,
+            'params': self.params,
+            'output': self.output,
+            'error': self.error,
+            'dataset_id': self.dataset_id,
+            'result_ids': [r.id for r in self.results],
+            'creation_date': self.creation_date.isoformat() if self.creation_date else None,
+            'started_date': self.started_date.isoformat() if self.started_date else None,
+            'finished_date': self.finished_date.isoformat() if self.finished_date else None
+        }
+    
+    def __repr__(self):
+        return f'<DetectionJob {self.id} {self.algorithm} - {self.status}>'
+
+class TrainedModel(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    algorithm = db.Column(db.String(50), nullable=False)
+    model_path = db.Column(db.String(255), nullable=False)
+    feature_names = db.Column(db.JSON)
+    threshold = db.Column(db.Float)
+    creation_date = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    dataset_id = db.Column(db.Integer, db.ForeignKey('dataset.id'), nullable=False)
+    result_id = db.Column(db.Integer, db.ForeignKey('anomaly_result.id'))
+    dataset = db.relationship('Dataset')
+    result = db.relationship('AnomalyResult', backref=db.backref('trained_model', uselist=False))
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'algorithm': self.algorithm,
+            'feature_names': self.feature_names,
+            'threshold': self.threshold,
+            'dataset_id': self.dataset_id,
+            'result_id': self.result_id,
+            'creation_date': self.creation_date.isoformat() if self.creation_date else None
+        }
+    
+    def __repr__(self):
+        return f'<TrainedModel {self.id} {self.algorithm}>'
@@ -1,22 +1,41 @@
 import os
+import gzip
+import numpy as np
 import pandas as pd
 import json
 import logging
-from datetime import datetime
 from flask import render_template, redirect, url_for, flash, request, jsonify, session
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from app import app, db
-from models import User, Dataset, AnomalyResult
+from models import User, Dataset, AnomalyResult, DetectionJob, TrainedModel
 from forms import LoginForm, RegistrationForm, UploadDatasetForm, DetectionForm, SettingsForm
-from ml_models.isolation_forest import IsolationForestModel
-from ml_models.autoencoder import AutoEncoderModel
-from ml_models.kmeans import KMeansModel
-from utils.data_processor import preprocess_data, save_processed_data
-from utils.visualizer import generate_overview_charts
+from utils.visualizer import generate_overview_charts, invalidate_overview
+from utils.job_queue import enqueue_detection_job, mark_job_failed, JOB_QUEUED, SWEEP
+from utils.sweep import expand_grid
+from utils.grouped import detect_group_column
+from utils.dataset_store import (write_store, read_rows, list_columns, detect_time_column,
+                                 format_timestamps)
+from utils.model_registry import load_model, input_columns
+from utils.downsample import downsample_indices, DOWNSAMPLE_METHODS
+from utils.response_cache import get_response_cache, is_compressed
 
 logger = logging.getLogger(__name__)
 
+# Rows sampled from an upload when auto-detecting its columns
+AUTO_DETECT_ROWS = 1000
+
+# Rows returned per /api/result page unless a limit is given, and the largest allowed limit
+RESULT_PAGE_ROWS = 50000
+MAX_RESULT_PAGE_ROWS = 500000
+
+# Largest point count a chart may request from /api/result
+MAX_CHART_POINTS = 20000
+
+# Part of the /api/result cache keys; bump when the payload format changes so
+# cached responses of the old format are not served
+RESULT_PAYLOAD_VERSION = 1
+
 def init_routes(app):
     # Get Started page (entry point)
     @app.route('/')
@@ -160,16 +179,16 @@ def init_routes(app):
     @app.route('/dashboard')
     @login_required
     def dashboard():
-        # Get datasets and results for the current user
-        datasets = Dataset.query.filter_by(user_id=current_user.id).all()
-        results = AnomalyResult.query.filter_by(user_id=current_user.id).all()
+        # Counts and chart data are aggregated in the database; only the
+        # latest results listed on the page are loaded
+        recent_results = AnomalyResult.query.filter_by(user_id=current_user.id).order_by(
+            AnomalyResult.creation_date.desc()).limit(5).all()
         
         # Generate overview data
-        overview_data = generate_overview_charts(datasets, results)
+        overview_data = generate_overview_charts(current_user.id)
         
         return render_template('dashboard.html', 
-                              datasets=datasets, 
-                              results=results,
+                              results=recent_results,
                               overview_data=json.dumps(overview_data))
 
     # Upload Data page
@@ -192,18 +211,15 @@ def init_routes(app):
                     temp_path = os.path.join(temp_dir, filename)
                     file.save(temp_path)
                     
-                    # Read the CSV and auto-detect columns
-                    df = pd.read_csv(temp_path)
+                    # Read a sample of the CSV to auto-detect columns; dtypes of
+                    # the first rows are enough and large files stay cheap
+                    df = pd.read_csv(temp_path, nrows=AUTO_DETECT_ROWS)
                     
                     # Display a preview of the data
                     preview_data = df.head(5).to_html(classes='table table-striped table-sm')
                     
                     # Detect time column
-                    time_column = None
-                    for col in df.columns:
-                        if any(time_pattern in col.lower() for time_pattern in ['time', 'date', 'timestamp']):
-                            time_column = col
-                            break
+                    time_column = detect_time_column(df.columns)
                     
                     # Detect numeric columns (excluding time-related columns)
                     exclude_patterns = ['date', 'time', 'timestamp', 'id', 'index']
@@ -222,6 +238,12 @@ def init_routes(app):
                     # For value column, suggest the first numeric column that's not time-related
                     if numeric_cols:
                         form.value_column.data = numeric_cols[0]
+                    
+                    # Multi-meter exports carry a meter/site ID column to group by
+                    group_column = detect_group_column(df)
+                    detected_columns['group_column'] = group_column
+                    if group_column:
+                        form.group_column.data = group_column
                         
                     # Keep the file in session for the next submission
                     if not os.path.exists(os.path.join(temp_dir, 'session')):
@@ -275,6 +297,14 @@ def init_routes(app):
                     flash(f'Warning: Value column "{value_column}" not found in the dataset. All numeric columns will be used during analysis.', 'warning')
                     value_column = None
                 
+                group_column = form.group_column.data or None
+                if group_column and group_column not in df.columns:
+                    flash(f'Warning: Group column "{group_column}" not found in the dataset. All rows will be analyzed as one series.', 'warning')
+                    group_column = None
+                
+                # Convert the CSV once into the columnar store used by every reader
+                write_store(df, file_path, time_column=time_column or detect_time_column(df.columns))
+                
                 # Create dataset record
                 dataset = Dataset(
                     filename=filename,
@@ -283,11 +313,13 @@ def init_routes(app):
                     row_count=row_count,
                     time_column=time_column,
                     value_column=value_column,
+                    group_column=group_column,
                     user_id=current_user.id
                 )
                 
                 db.session.add(dataset)
                 db.session.commit()
+                invalidate_overview(current_user.id)
                 
                 # Clear session data
                 if 'temp_file_path' in session:
@@ -319,6 +351,7 @@ def init_routes(app):
         form.dataset.choices = [(d.id, d.filename) for d in datasets]
         
         if form.validate_on_submit():
+            job = None
             try:
                 dataset_id = form.dataset.data
                 algorithm = form.algorithm.data
@@ -326,75 +359,56 @@ def init_routes(app):
                 # Get the dataset
                 dataset = Dataset.query.get_or_404(dataset_id)
                 
-                # Read the data from CSV
-                df = pd.read_csv(dataset.file_path)
-                
-                # Minimal processing - let the algorithm handle most preprocessing
-                # This allows using all numeric columns for multi-column anomaly detection
-                
-                # Run the selected algorithm
-                if algorithm == 'isolation_forest':
-                    model = IsolationForestModel()
-                elif algorithm == 'autoencoder':
-                    model = AutoEncoderModel()
-                elif algorithm == 'kmeans':
-                    model = KMeansModel()
-                
-                logger.info(f"Running {algorithm} on dataset {dataset.filename} (ID: {dataset.id})")
-                
-                # Get time and value columns (if specified in the dataset)
-                time_col = dataset.time_column
-                value_col = dataset.value_column
-                
-                # Use advanced anomaly detection with auto-detection capabilities
-                logger.info(f"Using time_column: {time_col}, value_column: {value_col}")
-                anomalies, metrics = model.detect_anomalies(df, time_column=time_col, value_column=value_col)
-                
-                # Save complete result (including all detected anomalies for each feature)
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                result_filename = f"{algorithm}_{timestamp}.csv"
-                result_dir = os.path.join(app.root_path, 'results', str(current_user.id))
-                os.makedirs(result_dir, exist_ok=True)
-                
-                result_path = os.path.join(result_dir, result_filename)
-                anomalies.to_csv(result_path, index=False)
-                
-                # Log feature importance if available
-                if 'feature_importance' in metrics:
-                    feature_importance = metrics['feature_importance']
-                    sorted_features = sorted(feature_importance.items(), key=lambda x: x[1], reverse=True)
-                    logger.info(f"Feature importance: {sorted_features}")
-                
-                # Create result record with enhanced metrics
-                anomaly_count = int(anomalies['is_anomaly'].sum())
-                result = AnomalyResult(
+                # Queue the detection so the request returns immediately;
+                # the model runs in a background worker process
+                job = DetectionJob(
                     algorithm=algorithm,
-                    anomaly_count=anomaly_count,
-                    result_path=result_path,
-                    metrics=metrics,
+                    status=JOB_QUEUED,
+                    params=form.model_params(),
                     user_id=current_user.id,
-                    dataset_id=dataset_id
+                    dataset_id=dataset.id
                 )
-                
-                db.session.add(result)
+                db.session.add(job)
                 db.session.commit()
                 
-                # Provide more detailed success message
-                importance_msg = ""
-                if 'feature_importance' in metrics and metrics['feature_importance']:
-                    # Get the most important feature
-                    top_feature = sorted_features[0][0] if sorted_features else None
-                    if top_feature:
-                        importance_msg = f" The most significant anomaly contributor was {top_feature}."
+                enqueue_detection_job(job)
+                logger.info(f"Queued {algorithm} job {job.id} on dataset {dataset.filename} (ID: {dataset.id})")
                 
-                flash(f'Anomaly detection completed successfully using {algorithm}! Found {anomaly_count} anomalies in {len(df)} records.{importance_msg}', 'success')
-                return redirect(url_for('results', result_id=result.id))
+                flash(f'Detection job queued using {algorithm}. Results will open automatically when it finishes.', 'info')
+                return redirect(url_for('detection', job_id=job.id))
                 
             except Exception as e:
-                logger.error(f"Error running detection: {str(e)}")
+                logger.error(f"Error queueing detection: {str(e)}")
+                db.session.rollback()
+                # A job that never reached the pool would otherwise stay queued forever
+                if job is not None and job.id is not None:
+                    mark_job_failed(job.id, f'Could not queue job: {str(e)}')
                 flash(f'Error running detection: {str(e)}', 'danger')
         
-        return render_template('detection.html', form=form)
+        # Job being tracked on this page, if any
+        job = None
+        job_id = request.args.get('job_id', type=int)
+        if job_id:
+            job = DetectionJob.query.filter_by(id=job_id, user_id=current_user.id).first()
+        
+        return render_template('detection.html', form=form, datasets=datasets, job=job)
+
+    # AJAX endpoint to poll the status of a detection job
+    @app.route('/api/jobs/<int:job_id>')
+    @login_required
+    def get_job_status(job_id):
+        job = DetectionJob.query.get_or_404(job_id)
+        
+        if job.user_id != current_user.id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        job_data = job.to_dict()
+        if len(job.results) == 1:
+            job_data['result_url'] = url_for('results', result_id=job.results[0].id)
+        elif job.results:
+            job_data['result_url'] = url_for('results', job_id=job.id)
+        
+        return jsonify(job_data)
 
     # Results page
     @app.route('/results')
@@ -410,12 +424,23 @@ def init_routes(app):
                 return redirect(url_for('results'))
             
             results = [result]
+        elif request.args.get('job_id'):
+            # Results produced together by one job, e.g. a model comparison
+            results = AnomalyResult.query.filter_by(
+                user_id=current_user.id,
+                job_id=request.args.get('job_id', type=int)
+            ).order_by(AnomalyResult.algorithm).all()
         else:
             results = AnomalyResult.query.filter_by(user_id=current_user.id).order_by(AnomalyResult.creation_date.desc()).all()
         
         return render_template('results.html', results=results, selected_id=result_id)
 
-    # AJAX endpoint to get result data for visualization
+    # AJAX endpoint to get result data for visualization. Optional query
+    # parameters select what is read: start/end (inclusive time bounds),
+    # offset/limit or cursor (the "next_cursor" of the previous page) and
+    # columns (comma-separated feature columns to include). points=N
+    # downsamples the selected rows to about N points with method=lttb
+    # (default) or minmax, always keeping the anomalous points
     @app.route('/api/result/<int:result_id>')
     @login_required
     def get_result_data(result_id):
@@ -424,31 +449,116 @@ def init_routes(app):
         if result.user_id != current_user.id:
             return jsonify({'error': 'Unauthorized'}), 403
         
-        # Load the result data
-        df = pd.read_csv(result.result_path)
+        # Results never change once saved, so the serialized payload is cached
+        # per result and query, and browsers revalidate it by ETag
+        cache = get_response_cache()
+        etag = cache.make_key(RESULT_PAYLOAD_VERSION, result.id, result.creation_date, result.result_path,
+                              args=request.args)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            body = cache.get(etag)
+            if body is None:
+                response = result_data_response(result)
+                if isinstance(response, tuple):
+                    # Errors are not cached
+                    return response
+                body = cache.put(etag, response.get_data())
+            
+            response = app.response_class(mimetype='application/json')
+            if is_compressed(body) and request.accept_encodings['gzip']:
+                response.set_data(body)
+                response.headers['Content-Encoding'] = 'gzip'
+            else:
+                response.set_data(gzip.decompress(body) if is_compressed(body) else body)
+        
+        response.set_etag(etag)
+        response.last_modified = result.creation_date
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.vary.add('Accept-Encoding')
+        return response.make_conditional(request)
+    
+    def result_data_response(result):
+        # Build the /api/result JSON response for the current request
+        points = request.args.get('points', type=int)
+        method = request.args.get('method', 'lttb')
+        if points is not None and not 3 <= points <= MAX_CHART_POINTS:
+            return jsonify({'error': f'"points" must be between 3 and {MAX_CHART_POINTS}'}), 400
+        if method not in DOWNSAMPLE_METHODS:
+            return jsonify({'error': f'"method" must be one of {list(DOWNSAMPLE_METHODS)}'}), 400
+        
+        # Downsampled requests cover the whole range unless a limit is given,
+        # since the payload is bounded by the point count
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', None if points else RESULT_PAGE_ROWS, type=int)
+        cursor = request.args.get('cursor', type=int)
+        if offset < 0 or (limit is not None and limit < 1) or (cursor is not None and cursor < 0):
+            return jsonify({'error': '"offset" and "cursor" must be non-negative and "limit" positive'}), 400
+        if limit is not None:
+            limit = min(limit, MAX_RESULT_PAGE_ROWS)
+        start = request.args.get('start') or None
+        end = request.args.get('end') or None
         
         # Prepare data for visualizations - handle both single and multi-column cases
         time_series_data = {}
         dataset = result.dataset
+        result_columns = list_columns(result.result_path)
         
         # Auto-detect time column if not specified
         time_column = dataset.time_column
         if not time_column:
             # Find a time-related column
-            for col in df.columns:
-                if any(time_pattern in col.lower() for time_pattern in ['time', 'date', 'timestamp']):
-                    time_column = col
-                    break
+            time_column = detect_time_column(result_columns)
             # If still not found, use the index
-            if not time_column and 'index' in df.columns:
+            if not time_column and 'index' in result_columns:
                 time_column = 'index'
         
+        # Load only the columns the charts use, narrowed to the requested ones
+        projection = None
+        if request.args.get('columns'):
+            projection = [col.strip() for col in request.args['columns'].split(',') if col.strip()]
+            unknown = [col for col in projection if col not in result_columns]
+            if unknown:
+                return jsonify({'error': f'Unknown columns: {unknown}'}), 400
+        feature_keys = [col for col in result_columns
+                        if col.endswith('_anomaly') and col.replace('_anomaly', '') in result_columns
+                        and (projection is None or col.replace('_anomaly', '') in projection)]
+        wanted = {time_column, 'is_anomaly'}
+        if projection is None or dataset.value_column in projection:
+            wanted.add(dataset.value_column)
+        wanted.update(feature_keys)
+        wanted.update(col.replace('_anomaly', '') for col in feature_keys)
+        try:
+            df, page = read_rows(result.result_path, columns=wanted, time_column=time_column,
+                                 start=start, end=end, offset=offset, limit=limit, cursor=cursor)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid time range: {str(e)}'}), 400
+        page.update({'limit': limit, 'start': start, 'end': end})
+        
+        if points is not None and len(df) > points:
+            # Plot the value column, or the first feature column for multi-column results
+            value_column = dataset.value_column
+            plotted = value_column if value_column in df.columns else next(
+                (col.replace('_anomaly', '') for col in feature_keys), None)
+            flag_columns = ['is_anomaly'] + [col for col in feature_keys if col in df.columns]
+            keep = np.any([df[col].to_numpy() == 1 for col in flag_columns], axis=0)
+            x = None
+            if time_column in df.columns and pd.api.types.is_datetime64_any_dtype(df[time_column]) \
+                    and df[time_column].is_monotonic_increasing:
+                x = df[time_column].to_numpy().view(np.int64)
+            positions = downsample_indices(df[plotted].to_numpy() if plotted else None, points, x=x,
+                                           keep=keep, method=method)
+            page['downsampled'] = {'method': method, 'points': points, 'rows': len(df)}
+            df = df.iloc[positions]
+            page['returned'] = len(df)
+        
         # If we have a time column, use it for timestamps
         if time_column and time_column in df.columns:
-            time_series_data['timestamps'] = df[time_column].tolist()
+            time_series_data['timestamps'] = format_timestamps(df[time_column])
         else:
-            # Generate sequential timestamps
-            time_series_data['timestamps'] = list(range(len(df)))
+            # Generate sequential timestamps from the row positions
+            time_series_data['timestamps'] = df.index.tolist()
         
         # Get main anomaly data
         time_series_data['anomalies'] = df['is_anomaly'].tolist()
@@ -493,9 +603,130 @@ def init_routes(app):
             'anomaly_details': anomaly_details,
             'metrics': result.metrics,
             'anomaly_count': result.anomaly_count,
-            'algorithm': result.algorithm
+            'algorithm': result.algorithm,
+            'page': page
         })
 
+    # JSON list of the fitted models available for scoring
+    @app.route('/api/models')
+    @login_required
+    def list_models():
+        query = TrainedModel.query.filter_by(user_id=current_user.id)
+        dataset_id = request.args.get('dataset_id', type=int)
+        if dataset_id is not None:
+            query = query.filter_by(dataset_id=dataset_id)
+        
+        models = query.order_by(TrainedModel.creation_date.desc()).all()
+        return jsonify({'models': [model.to_dict() for model in models]})
+
+    # Score new readings against a stored model without refitting.
+    # Accepts {"rows": [{column: value, ...}, ...]} or {"columns": {column: [values]}};
+    # an optional "context" gives the number of leading rows that only provide
+    # history for the rolling windows and are not scored
+    @app.route('/api/models/<int:model_id>/score', methods=['POST'])
+    @login_required
+    def score_model(model_id):
+        trained_model = TrainedModel.query.get_or_404(model_id)
+        
+        if trained_model.user_id != current_user.id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'Expected a JSON object with "rows" or "columns"'}), 400
+        
+        try:
+            if 'columns' in payload:
+                df = pd.DataFrame(payload['columns'])
+            else:
+                df = pd.DataFrame.from_records(payload.get('rows') or [])
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'Invalid input rows: {str(e)}'}), 400
+        
+        context = payload.get('context', 0)
+        # bool is a subclass of int, so {"context": true} must be rejected explicitly
+        if isinstance(context, bool) or not isinstance(context, int) or context < 0:
+            return jsonify({'error': '"context" must be a non-negative integer'}), 400
+        if len(df) <= context:
+            return jsonify({'error': 'No rows to score'}), 400
+        
+        try:
+            model = load_model(trained_model)
+        except Exception as e:
+            logger.error(f"Error loading model {model_id}: {str(e)}")
+            return jsonify({'error': 'Stored model could not be loaded'}), 500
+        
+        missing = [col for col in input_columns(model) if col not in df.columns]
+        if missing:
+            return jsonify({'error': f'Missing columns: {missing}'}), 400
+        
+        # Readings must be numbers; the models would otherwise silently turn
+        # text or nulls into values and flag them (or not) as anomalies
+        invalid = {}
+        for col in input_columns(model):
+            if col == getattr(model, 'time_column', None):
+                continue
+            values = pd.to_numeric(df[col], errors='coerce')
+            bad = values.isna() | df[col].map(lambda v: isinstance(v, bool))
+            if bad.any():
+                invalid[col] = [int(i) for i in bad[bad].index[:10]]
+            df[col] = values
+        if invalid:
+            return jsonify({'error': f'Non-numeric or missing values (column: row indices): {invalid}'}), 400
+        
+        # Rolling features only see the submitted rows, so callers send
+        # preceding readings as context for full-window statistics
+        scores = model.score(df).iloc[context:]
+        response = {'model_id': trained_model.id, 'algorithm': trained_model.algorithm, 'count': len(scores)}
+        for col in scores.columns:
+            response[col] = scores[col].tolist()
+        return jsonify(response)
+
+    # Queue a parameter sweep: {"dataset_id": 1, "algorithm": "kmeans",
+    # "grid": {"n_clusters": [3, 5, 8], "threshold_factor": [1.5, 2.0]}}.
+    # Poll /api/jobs/<id>; the ranked table is returned as the job "output"
+    # and the best configuration is stored as a regular result and model
+    @app.route('/api/sweeps', methods=['POST'])
+    @login_required
+    def create_sweep():
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('grid'), dict):
+            return jsonify({'error': 'Expected a JSON object with "dataset_id", "algorithm" and "grid"'}), 400
+        
+        dataset = db.session.get(Dataset, payload.get('dataset_id')) if isinstance(payload.get('dataset_id'), int) else None
+        if dataset is None:
+            return jsonify({'error': 'Dataset not found'}), 404
+        if dataset.user_id != current_user.id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        algorithm = payload.get('algorithm')
+        try:
+            configs = expand_grid(algorithm, payload['grid'])
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        
+        job = DetectionJob(
+            algorithm=SWEEP,
+            status=JOB_QUEUED,
+            params={'algorithm': algorithm, 'grid': payload['grid']},
+            user_id=current_user.id,
+            dataset_id=dataset.id
+        )
+        db.session.add(job)
+        db.session.commit()
+        
+        try:
+            enqueue_detection_job(job)
+        except Exception as e:
+            logger.error(f"Error queueing sweep job {job.id}: {str(e)}")
+            mark_job_failed(job.id, f'Could not queue job: {str(e)}')
+            return jsonify({'error': f'Could not queue sweep: {str(e)}'}), 500
+        logger.info(f"Queued {algorithm} sweep job {job.id} with {len(configs)} configurations on dataset {dataset.id}")
+        
+        job_data = job.to_dict()
+        job_data['status_url'] = url_for('get_job_status', job_id=job.id)
+        return jsonify(job_data), 202
+
     # Model Insights page
     @app.route('/model-insights')
     @login_required
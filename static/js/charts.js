@@ -25,6 +25,10 @@ if (typeof Chart !== 'undefined') {
 // Store chart instances for later reference
 const chartInstances = {};
 
+// Points requested for time series charts; the server downsamples longer
+// results to about this many points plus every anomaly
+const CHART_POINTS = 2000;
+
 /**
  * Initialize charts on the page
  */
@@ -323,7 +327,7 @@ function initializeResultCharts() {
     const resultId = resultIdElement.value;
     
     // Fetch result data
-    fetch(`/api/result/${resultId}`)
+    fetch(`/api/result/${resultId}?points=${CHART_POINTS}`)
         .then(response => {
             if (!response.ok) {
                 throw new Error(`HTTP error ${response.status}`);
@@ -45,12 +45,14 @@ function setupDetectionForm() {
         algorithmSelect.addEventListener('change', function() {
             const algorithm = this.value;
             updateAlgorithmInfo(algorithm);
+            updateAlgorithmOptions(algorithm);
             updateAlgorithmVisualization(algorithm);
         });
         
         // Trigger change on page load
         if (algorithmSelect.value) {
             updateAlgorithmInfo(algorithmSelect.value);
+            updateAlgorithmOptions(algorithmSelect.value);
             updateAlgorithmVisualization(algorithmSelect.value);
         }
     }
@@ -116,6 +118,17 @@ function updateAlgorithmInfo(algorithm) {
     }
 }
 
+/**
+ * Show only the option blocks that apply to the selected algorithm
+ * @param {string} algorithm - The selected algorithm value
+ */
+function updateAlgorithmOptions(algorithm) {
+    document.querySelectorAll('.algorithm-options').forEach(block => {
+        const algorithms = block.getAttribute('data-algorithms').split(' ');
+        block.style.display = algorithms.includes(algorithm) ? 'block' : 'none';
+    });
+}
+
 /**
  * Update dataset preview when selection changes
  * @param {string} datasetId - The selected dataset ID
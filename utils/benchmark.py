@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Dataset grids; every algorithm runs on every (rows, columns) pair
+PRESETS = {
+    'quick': {'rows': [1000, 10000], 'columns': [1, 10]},
+    'standard': {'rows': [1000, 10000, 100000, 1000000], 'columns': [1, 10, 100]},
+    'full': {'rows': [1000, 10000, 100000, 1000000, 10000000], 'columns': [1, 10, 100]}
+}
+
+DEFAULT_ALGORITHMS = ['isolation_forest', 'autoencoder', 'kmeans', 'streaming', 'ensemble']
+
+# Cases above this many values (rows x columns) are skipped unless raised
+DEFAULT_MAX_CELLS = 250000000
+
+# Allowed slowdown / memory growth against the baseline before a case fails
+DEFAULT_TOLERANCE = 0.25
+
+# Differences below these are treated as noise whatever the ratio
+MIN_SECONDS_SLACK = 0.05
+MIN_RSS_SLACK_MB = 20
+
+# Rows scored through model.score() in the 'score' stage
+SCORE_ROWS = 10000
+
+def make_frame(n_rows, n_columns, seed=42):
+    """
+    Build a wide synthetic dataset with one consumption column per meter.
+
+    Parameters:
+    -----------
+    n_rows : int
+        Number of timestamps
+    n_columns : int
+        Number of meter columns
+    seed : int, default=42
+        Generator seed
+
+    Returns:
+    --------
+    df : pandas.DataFrame
+        'timestamp' followed by columns 'meter_0' ... 'meter_<n_columns - 1>'
+    """
+    from utils.synthetic_data import SyntheticEnergyData
+
+    generator = SyntheticEnergyData(n_rows * n_columns, n_meters=n_columns, seed=seed)
+    timestamps = np.empty(n_rows, dtype='datetime64[ns]')
+    values = np.empty((n_rows, n_columns))
+    # Readings are time-major, so each chunk reshapes straight into wide rows
+    offset = 0
+    for chunk in generator.iter_chunks():
+        steps = len(chunk) // n_columns
+        timestamps[offset:offset + steps] = chunk['timestamp'].to_numpy()[::n_columns]
+        values[offset:offset + steps] = chunk['consumption'].to_numpy().reshape(steps, n_columns)
+        offset += steps
+
+    df = pd.DataFrame(values, columns=[f"meter_{idx}" for idx in range(n_columns)])
+    df.insert(0, 'timestamp', timestamps)
+    return df
+
+def _rss_mb():
+    # Current resident set size from /proc (Linux)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def run_isolated(function, *args):
+    """
+    Call a picklable function in a fresh spawned process and return its result.
+
+    A spawned single-use worker starts from a clean interpreter, so the peak
+    RSS it reports does not include memory left behind by earlier runs.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, *args).result()
+
+def peak_rss_mb():
+    """
+    Peak resident set size of the current process in MB.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_case(algorithm, n_rows, n_columns, seed=42):
+    """
+    Run one detector on one synthetic dataset and time each stage.
+
+    Meant to run in a fresh process so the peak RSS belongs to this case only.
+
+    Stages:
+    - generate: building the synthetic dataset
+    - detect: detect_anomalies (feature extraction, fitting and scoring)
+    - score: model.score() on up to SCORE_ROWS rows, as the scoring API does
+    - save: serializing the fitted model with joblib
+
+    Returns:
+    --------
+    result : dict
+        Stage times in seconds, peak and starting RSS in MB, rows per second
+        of the detect stage and the anomaly count
+    """
+    import joblib
+    from utils.job_queue import MODEL_CLASSES
+
+    rss_start = _rss_mb()
+    stages = {}
+
+    start = time.perf_counter()
+    df = make_frame(n_rows, n_columns, seed=seed)
+    stages['generate'] = time.perf_counter() - start
+
+    model = MODEL_CLASSES[algorithm]()
+    # Single-column detectors use the first meter; multi-column detectors use all of them
+    multi_column = algorithm in ('isolation_forest', 'ensemble')
+    value_column = None if multi_column and n_columns > 1 else 'meter_0'
+    start = time.perf_counter()
+    result_df, metrics = model.detect_anomalies(df, time_column='timestamp', value_column=value_column)
+    stages['detect'] = time.perf_counter() - start
+
+    if getattr(model, 'is_fitted', False):
+        start = time.perf_counter()
+        model.score(df.iloc[:SCORE_ROWS])
+        stages['score'] = time.perf_counter() - start
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            start = time.perf_counter()
+            joblib.dump(model, os.path.join(tmp_dir, 'model.joblib'))
+            stages['save'] = time.perf_counter() - start
+
+    return {
+        'stages': {name: round(seconds, 4) for name, seconds in stages.items()},
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'start_rss_mb': round(rss_start, 1) if rss_start is not None else None,
+        'rows_per_second': round(n_rows / stages['detect'], 1) if stages['detect'] > 0 else None,
+        'anomaly_count': int(metrics.get('anomaly_count', int(result_df['is_anomaly'].sum())))
+    }
+
+def run_benchmarks(algorithms, rows, columns, repeat=1, seed=42, max_cells=DEFAULT_MAX_CELLS, log=print):
+    """
+    Run every algorithm on every dataset size.
+
+    Parameters:
+    -----------
+    algorithms : list of str
+        Keys of utils.job_queue.MODEL_CLASSES
+    rows : list of int
+        Dataset row counts
+    columns : list of int
+        Dataset column counts
+    repeat : int, default=1
+        Runs per case; the fastest run is kept
+    seed : int, default=42
+        Synthetic data seed
+    max_cells : int, default=DEFAULT_MAX_CELLS
+        Cases with more rows x columns are recorded as skipped
+    log : callable
+        Progress output
+
+    Returns:
+    --------
+    report : dict
+        Environment description and one entry per case under 'results'
+    """
+    import sklearn
+
+    results = []
+    for n_columns in columns:
+        for n_rows in rows:
+            for algorithm in algorithms:
+                case = {'algorithm': algorithm, 'rows': n_rows, 'columns': n_columns}
+                if n_rows * n_columns > max_cells:
+                    case['status'] = 'skipped'
+                    results.append(case)
+                    log(f"{algorithm:>16} {n_rows:>10} x {n_columns:<4} skipped (over {max_cells} cells)")
+                    continue
+
+                runs = []
+                try:
+                    for _ in range(repeat):
+                        runs.append(run_isolated(run_case, algorithm, n_rows, n_columns, seed))
+                except Exception as e:
+                    case['status'] = 'failed'
+                    case['error'] = f"{type(e).__name__}: {e}"
+                    results.append(case)
+                    log(f"{algorithm:>16} {n_rows:>10} x {n_columns:<4} FAILED {case['error']}")
+                    continue
+
+                best = min(runs, key=lambda run: run['stages']['detect'])
+                case.update(best)
+                case['status'] = 'ok'
+                results.append(case)
+                log(f"{algorithm:>16} {n_rows:>10} x {n_columns:<4} detect {best['stages']['detect']:9.3f}s "
+                    f"{best['rows_per_second']:>12.0f} rows/s  peak {best['peak_rss_mb']:8.1f} MB")
+
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'scikit-learn': sklearn.__version__
+        },
+        'seed': seed,
+        'results': results
+    }
+
+def compare_to_baseline(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Find cases that got slower or use more memory than in the baseline.
+
+    A case regresses when any stage time or the peak RSS exceeds the baseline
+    by more than the tolerance (and by more than a small absolute slack), or
+    when it fails although it passed in the baseline. Cases missing from
+    either report are ignored.
+
+    Returns:
+    --------
+    regressions : list of str
+        Human-readable descriptions, empty if there are none
+    """
+    previous = {(case['algorithm'], case['rows'], case['columns']): case for case in baseline.get('results', [])}
+    regressions = []
+    for case in report['results']:
+        key = (case['algorithm'], case['rows'], case['columns'])
+        old = previous.get(key)
+        if old is None or old.get('status') != 'ok':
+            continue
+        label = f"{case['algorithm']} {case['rows']} rows x {case['columns']} columns"
+        if case.get('status') != 'ok':
+            regressions.append(f"{label}: {case.get('status')} ({case.get('error', '')}), baseline passed")
+            continue
+
+        for stage, seconds in case['stages'].items():
+            old_seconds = old['stages'].get(stage)
+            if old_seconds is None:
+                continue
+            if seconds > old_seconds * (1 + tolerance) and seconds - old_seconds > MIN_SECONDS_SLACK:
+                regressions.append(f"{label}: {stage} took {seconds:.3f}s, baseline {old_seconds:.3f}s "
+                                   f"({seconds / old_seconds - 1:+.0%})")
+
+        rss, old_rss = case['peak_rss_mb'], old.get('peak_rss_mb')
+        if old_rss and rss > old_rss * (1 + tolerance) and rss - old_rss > MIN_RSS_SLACK_MB:
+            regressions.append(f"{label}: peak RSS {rss:.1f} MB, baseline {old_rss:.1f} MB "
+                               f"({rss / old_rss - 1:+.0%})")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the anomaly detectors on synthetic data.')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='quick', help='Dataset size grid')
+    parser.add_argument('--rows', type=int, nargs='+', help='Row counts (overrides the preset)')
+    parser.add_argument('--columns', type=int, nargs='+', help='Column counts (overrides the preset)')
+    parser.add_argument('--algorithms', nargs='+', default=DEFAULT_ALGORITHMS, help='Detectors to run')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per case, the fastest is kept')
+    parser.add_argument('--seed', type=int, default=42, help='Synthetic data seed')
+    parser.add_argument('--max-cells', type=int, default=DEFAULT_MAX_CELLS, help='Skip larger rows x columns')
+    parser.add_argument('--output', default='benchmark_results.json', help='Where to write the results')
+    parser.add_argument('--baseline', help='Baseline results to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed relative slowdown or memory growth')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Also write the results to the --baseline path')
+    args = parser.parse_args(argv)
+
+    from utils.job_queue import MODEL_CLASSES
+    unknown = [algorithm for algorithm in args.algorithms if algorithm not in MODEL_CLASSES]
+    if unknown:
+        parser.error(f"Unknown algorithms: {unknown}")
+
+    report = run_benchmarks(args.algorithms,
+                            args.rows or PRESETS[args.preset]['rows'],
+                            args.columns or PRESETS[args.preset]['columns'],
+                            repeat=args.repeat, seed=args.seed, max_cells=args.max_cells)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    failed = [case for case in report['results'] if case['status'] == 'failed']
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, tolerance=args.tolerance)
+        if regressions:
+            print(f"\nPERFORMANCE REGRESSION: {len(regressions)} check(s) exceeded the baseline "
+                  f"by more than {args.tolerance:.0%}", file=sys.stderr)
+            for regression in regressions:
+                print(f"  {regression}", file=sys.stderr)
+            return 1
+        print(f"No regressions against {args.baseline}")
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
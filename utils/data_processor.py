@@ -2,6 +2,7 @@ import os
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from ml_models.features import FeatureSpec, compute_features
 
 def preprocess_data(df, time_column, value_column):
     """
@@ -123,19 +124,18 @@ def preprocess_data(df, time_column, value_column):
     except Exception as e:
         print(f"Error extracting time features: {str(e)}. Skipping time feature extraction.")
     
-    # Add lagged features with error handling
+    # Add lagged features and rolling statistics in one batched pass
     try:
-        for lag in [1, 6, 12, 24]:
-            processed_df[f'lag_{lag}'] = processed_df[value_column].shift(lag).fillna(0)
+        spec = FeatureSpec(windows=(24,), stats=('mean', 'std'), lags=(1, 6, 12, 24), include_value=False)
+        values = pd.to_numeric(processed_df[value_column], errors='coerce').to_numpy(dtype=float).reshape(-1, 1)
+        X, names = compute_features(values, [value_column], spec)
+        features = dict(zip(names, X.T))
+        for lag in spec.lags:
+            processed_df[f'lag_{lag}'] = features[f'{value_column}_lag_{lag}']
+        processed_df['rolling_mean_24h'] = features[f'{value_column}_rolling_mean']
+        processed_df['rolling_std_24h'] = features[f'{value_column}_rolling_std']
     except Exception as e:
-        print(f"Error creating lag features: {str(e)}. Skipping lag features.")
-    
-    # Add rolling statistics with error handling
-    try:
-        processed_df['rolling_mean_24h'] = processed_df[value_column].rolling(window=24, min_periods=1).mean().fillna(0)
-        processed_df['rolling_std_24h'] = processed_df[value_column].rolling(window=24, min_periods=1).std().fillna(0)
-    except Exception as e:
-        print(f"Error calculating rolling statistics: {str(e)}. Skipping rolling statistics.")
+        print(f"Error creating lag and rolling features: {str(e)}. Skipping them.")
         
     # Final check for any remaining infinities or NaNs across the entire dataframe
     processed_df = processed_df.replace([np.inf, -np.inf], np.nan)
@@ -208,18 +208,28 @@ def generate_sample_data(n_samples=1000, anomaly_percentage=5):
     n_anomalies = int(n_samples * anomaly_percentage / 100)
     anomaly_indices = np.random.choice(range(n_samples), n_anomalies, replace=False)
     
-    # Introduce different types of anomalies
-    for idx in anomaly_indices:
-        anomaly_type = np.random.choice(['spike', 'dip', 'level_shift'])
-        
-        if anomaly_type == 'spike':
-            df.loc[idx, 'energy_consumption'] += np.random.uniform(40, 100)
-        elif anomaly_type == 'dip':
-            df.loc[idx, 'energy_consumption'] -= np.random.uniform(30, 50)
-        elif anomaly_type == 'level_shift':
-            shift_length = np.random.randint(5, 15)
-            shift_value = np.random.uniform(30, 50) * np.random.choice([-1, 1])
-            end_idx = min(idx + shift_length, n_samples - 1)
-            df.loc[idx:end_idx, 'energy_consumption'] += shift_value
+    # Introduce different types of anomalies, as offsets accumulated in one
+    # difference array instead of a dataframe write per anomaly
+    anomaly_types = np.random.choice(['spike', 'dip', 'level_shift'], n_anomalies)
+    offsets = np.zeros(n_samples + 1)
+    
+    spikes = anomaly_indices[anomaly_types == 'spike']
+    spike_values = np.random.uniform(40, 100, len(spikes))
+    np.add.at(offsets, spikes, spike_values)
+    np.add.at(offsets, spikes + 1, -spike_values)
+    
+    dips = anomaly_indices[anomaly_types == 'dip']
+    dip_values = np.random.uniform(30, 50, len(dips))
+    np.add.at(offsets, dips, -dip_values)
+    np.add.at(offsets, dips + 1, dip_values)
+    
+    shifts = anomaly_indices[anomaly_types == 'level_shift']
+    shift_lengths = np.random.randint(5, 15, len(shifts))
+    shift_values = np.random.uniform(30, 50, len(shifts)) * np.random.choice([-1, 1], len(shifts))
+    end_indices = np.minimum(shifts + shift_lengths, n_samples - 1)
+    np.add.at(offsets, shifts, shift_values)
+    np.add.at(offsets, end_indices + 1, -shift_values)
+    
+    df['energy_consumption'] += np.cumsum(offsets)[:n_samples]
     
     return df
@@ -0,0 +1,513 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the columnar store directory kept next to a CSV file
+STORE_SUFFIX = '.cols'
+STORE_VERSION = 1
+META_FILENAME = 'meta.json'
+
+TIME_PATTERNS = ['time', 'date', 'timestamp']
+
+# Detector outputs that are always stored with a result, even when the
+# dataset has a column of the same name (e.g. an 'is_anomaly' label)
+RESULT_COLUMNS = ('is_anomaly', 'anomaly_score', 'cluster')
+
+def detect_time_column(columns):
+    """
+    Return the first column whose name looks like a timestamp, or None.
+    """
+    for col in columns:
+        if any(time_pattern in str(col).lower() for time_pattern in TIME_PATTERNS):
+            return col
+    return None
+
+def store_path(path):
+    """
+    Return the columnar store directory for a CSV path.
+
+    Paths that already point at a store are returned unchanged.
+    """
+    if path.endswith(STORE_SUFFIX):
+        return path
+    return path + STORE_SUFFIX
+
+def has_store(path):
+    """
+    Check whether a columnar store exists for the given path.
+    """
+    return os.path.exists(os.path.join(store_path(path), META_FILENAME))
+
+def _column_array(series, is_time):
+    # Timestamps are parsed once here so readers never parse text again
+    if is_time and not pd.api.types.is_datetime64_any_dtype(series):
+        parsed = pd.to_datetime(series, errors='coerce')
+        if parsed.notna().any():
+            series = parsed
+
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.to_numpy(dtype='datetime64[ns]')
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return series.to_numpy()
+    # Text columns are stored as fixed-width unicode so they can be memory-mapped
+    return series.fillna('').astype(str).to_numpy(dtype=str)
+
+def is_sorted(values):
+    """
+    Check whether a column is in non-decreasing order without missing values.
+
+    Works block by block, so memory-mapped columns are never loaded at once.
+    """
+    if values.dtype.kind not in 'iufM':
+        return False
+    previous = None
+    for start in range(0, len(values), 1 << 20):
+        block = np.asarray(values[start:start + (1 << 20)])
+        if block.dtype.kind in 'fM' and np.isnan(block).any():
+            return False
+        if previous is not None and block[0] < previous:
+            return False
+        if (block[1:] < block[:-1]).any():
+            return False
+        if len(block):
+            previous = block[-1]
+    return True
+
+def write_store(df, path, time_column=None, source=None):
+    """
+    Write a dataframe as a columnar store of one .npy file per column.
+
+    The store is built in a temporary directory and moved into place, so
+    concurrent readers never see a partially written store. A hash of the
+    stored contents is recorded in the metadata to identify the data.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Dataframe to store
+    path : str
+        CSV path the store belongs to, or the store directory itself
+    time_column : str or None
+        Column to store as parsed datetime64 values
+    source : str or None
+        Store whose rows this table extends, e.g. the dataset of a detection
+        result. Readers join its columns in lazily, so they are not copied.
+
+    Returns:
+    --------
+    str
+        Path of the store directory
+    """
+    target = store_path(path)
+    tmp_dir = f"{target}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    columns = []
+    digest = hashlib.sha256()
+    for idx, col in enumerate(df.columns):
+        values = _column_array(df[col], col == time_column)
+        filename = f"c{idx:04d}.npy"
+        np.save(os.path.join(tmp_dir, filename), values, allow_pickle=False)
+        columns.append({'name': str(col), 'file': filename, 'dtype': values.dtype.str})
+        if col == time_column:
+            columns[-1]['sorted'] = is_sorted(values)
+        digest.update(f"{col}:{values.dtype.str}:".encode())
+        digest.update(np.ascontiguousarray(values).view(np.uint8).data)
+
+    meta = {
+        'version': STORE_VERSION,
+        'row_count': int(len(df)),
+        'time_column': time_column,
+        'content_hash': digest.hexdigest(),
+        'columns': columns
+    }
+    if source is not None:
+        # The hash pins the exact source rows the stored columns belong to
+        meta['source'] = {'path': store_path(source), 'content_hash': content_hash(source)}
+    with open(os.path.join(tmp_dir, META_FILENAME), 'w') as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+    return target
+
+def compact_frame(df):
+    """
+    Downcast detector outputs to the smallest dtypes that hold them.
+
+    0/1 flags become uint8, other integers int32 where they fit and floats
+    float32. Timestamps and text are left unchanged.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Output columns of a detection run
+
+    Returns:
+    --------
+    df : pandas.DataFrame
+        Dataframe with the same columns and compact dtypes
+    """
+    compact = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            series = series.astype(np.uint8)
+        elif pd.api.types.is_integer_dtype(series) and len(series):
+            low, high = series.min(), series.max()
+            if low >= 0 and high <= 1:
+                series = series.astype(np.uint8)
+            elif low >= np.iinfo(np.int32).min and high <= np.iinfo(np.int32).max:
+                series = series.astype(np.int32)
+        elif pd.api.types.is_float_dtype(series):
+            series = series.astype(np.float32)
+        compact[col] = series.to_numpy()
+    return pd.DataFrame(compact, index=df.index, copy=False)
+
+def write_result_store(anomalies, path, source, time_column=None):
+    """
+    Store the per-row outputs of a detection run next to its dataset store.
+
+    Only the columns the detector added (flags, scores, cluster ids, ground
+    truth) are written, in compact dtypes; columns the dataset already has
+    are read from the dataset store when the result is loaded. Falls back to
+    storing the whole table when the rows do not line up with the source.
+
+    Parameters:
+    -----------
+    anomalies : pandas.DataFrame
+        Detection output, one row per dataset row in dataset order
+    path : str
+        Result path (the store directory is path + STORE_SUFFIX)
+    source : str
+        Path of the dataset the detection ran on
+    time_column : str or None
+        Timestamp column, recorded in the metadata
+
+    Returns:
+    --------
+    str
+        Path of the store directory
+    """
+    if not has_store(source) or read_meta(source)['row_count'] != len(anomalies):
+        logger.warning(f"Result rows do not match {source}; storing the full result table")
+        return write_store(anomalies, path, time_column=time_column)
+
+    source_columns = set(list_columns(source))
+    outputs = [col for col in anomalies.columns if col not in source_columns or col in RESULT_COLUMNS]
+    return write_store(compact_frame(anomalies[outputs]), path, time_column=time_column, source=source)
+
+def write_store_chunks(chunks, path, n_rows, time_column=None, dtypes=None):
+    """
+    Write a columnar store from dataframe chunks without holding the table.
+
+    Each column is written into a memory-mapped .npy file of n_rows
+    entries as the chunks arrive. With the same column dtypes the resulting
+    store, including its content hash, is identical to the one write_store
+    produces for the whole table.
+
+    Parameters:
+    -----------
+    chunks : iterable of pandas.DataFrame
+        Consecutive chunks with the same columns, n_rows rows in total
+    path : str
+        CSV path the store belongs to, or the store directory itself
+    n_rows : int
+        Total number of rows
+    time_column : str or None
+        Column to store as parsed datetime64 values
+    dtypes : dict or None
+        Column dtypes overriding the ones of the first chunk, e.g. the width
+        of text columns whose longest value may appear in a later chunk
+
+    Returns:
+    --------
+    str
+        Path of the store directory
+    """
+    target = store_path(path)
+    tmp_dir = f"{target}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        _write_chunk_columns(chunks, tmp_dir, n_rows, time_column, dtypes or {})
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+    return target
+
+def _write_chunk_columns(chunks, tmp_dir, n_rows, time_column, dtypes):
+    columns = None
+    arrays = None
+    offset = 0
+    for chunk in chunks:
+        if columns is None:
+            columns = [str(col) for col in chunk.columns]
+            arrays = []
+            for idx, col in enumerate(chunk.columns):
+                dtype = np.dtype(dtypes.get(col) or _column_array(chunk[col].iloc[:1], col == time_column).dtype)
+                arrays.append(np.lib.format.open_memmap(os.path.join(tmp_dir, f"c{idx:04d}.npy"),
+                                                        mode='w+', dtype=dtype, shape=(n_rows,)))
+        if offset + len(chunk) > n_rows:
+            raise ValueError(f"Chunks contain more than {n_rows} rows")
+        for col, array in zip(chunk.columns, arrays):
+            values = _column_array(chunk[col], col == time_column)
+            if values.dtype.kind == 'U' and values.dtype.itemsize > array.dtype.itemsize:
+                raise ValueError(f"Column '{col}' has text longer than its stored width")
+            array[offset:offset + len(chunk)] = values
+        offset += len(chunk)
+
+    if columns is None or offset != n_rows:
+        raise ValueError(f"Expected {n_rows} rows, got {offset}")
+
+    # Hash column by column, in the same order and layout as write_store
+    digest = hashlib.sha256()
+    meta_columns = []
+    for idx, (col, array) in enumerate(zip(columns, arrays)):
+        array.flush()
+        meta_columns.append({'name': col, 'file': f"c{idx:04d}.npy", 'dtype': array.dtype.str})
+        if col == time_column:
+            meta_columns[-1]['sorted'] = is_sorted(array)
+        digest.update(f"{col}:{array.dtype.str}:".encode())
+        for start in range(0, n_rows, 1 << 20):
+            digest.update(np.ascontiguousarray(array[start:start + (1 << 20)]).view(np.uint8).data)
+    del arrays
+
+    meta = {
+        'version': STORE_VERSION,
+        'row_count': int(n_rows),
+        'time_column': time_column,
+        'content_hash': digest.hexdigest(),
+        'columns': meta_columns
+    }
+    with open(os.path.join(tmp_dir, META_FILENAME), 'w') as f:
+        json.dump(meta, f)
+
+def read_meta(path):
+    """
+    Load the metadata of a columnar store.
+    """
+    with open(os.path.join(store_path(path), META_FILENAME)) as f:
+        return json.load(f)
+
+def content_hash(path):
+    """
+    Return the content hash recorded for a stored table, or None.
+
+    Stores written before hashes were recorded, and plain CSV files, have no hash.
+    """
+    if not has_store(path):
+        return None
+    return read_meta(path).get('content_hash')
+
+def _column_entries(directory):
+    # Column metadata with the file 'path' of every column of a store, with the
+    # columns of its source store first; stored columns take precedence
+    meta = read_meta(directory)
+    entries = [dict(col, path=os.path.join(directory, col['file'])) for col in meta['columns']]
+    source = meta.get('source')
+    if source is None:
+        return entries
+
+    if not has_store(source['path']) or content_hash(source['path']) != source['content_hash']:
+        logger.warning(f"Source data of {directory} has changed or was removed; reading stored columns only")
+        return entries
+    stored = {entry['name'] for entry in entries}
+    return [entry for entry in _column_entries(source['path']) if entry['name'] not in stored] + entries
+
+def list_columns(path):
+    """
+    Return the column names of a stored table without loading any data.
+    """
+    if has_store(path):
+        return [entry['name'] for entry in _column_entries(store_path(path))]
+    return pd.read_csv(path, nrows=0).columns.tolist()
+
+def read_frame(path, columns=None):
+    """
+    Read a table from its columnar store, falling back to the CSV file.
+
+    Stores written with a source (detection results) are joined with the
+    columns of their source store, which are memory-mapped like their own.
+
+    Parameters:
+    -----------
+    path : str
+        CSV path or store directory
+    columns : list or None
+        Columns to load. Unknown names are ignored; None loads every column.
+
+    Returns:
+    --------
+    df : pandas.DataFrame
+        Dataframe with the requested columns in stored order
+    """
+    if not has_store(path):
+        if columns is None:
+            return pd.read_csv(path)
+        available = set(pd.read_csv(path, nrows=0).columns)
+        return pd.read_csv(path, usecols=[col for col in columns if col in available])
+
+    wanted = None if columns is None else set(columns)
+
+    data = {}
+    for entry in _column_entries(store_path(path)):
+        if wanted is not None and entry['name'] not in wanted:
+            continue
+        # Memory-mapped loads only touch the pages that are actually used
+        data[entry['name']] = np.load(entry['path'], mmap_mode='r')
+
+    return pd.DataFrame(data, copy=False)
+
+def _time_bound(times, value):
+    # Convert a query bound to the dtype of the stored time column
+    if times.dtype.kind == 'M':
+        return np.datetime64(pd.Timestamp(value).tz_localize(None), 'ns')
+    return float(value)
+
+def read_rows(path, columns=None, time_column=None, start=None, end=None, offset=0, limit=None, cursor=None):
+    """
+    Read a slice of rows of a stored table, touching only the rows returned.
+
+    Rows are selected by an optional time range, then a cursor and
+    offset/limit page within that range. On a time column recorded as
+    sorted the range is found by binary search and the page is a contiguous
+    slice of the memory-mapped columns; otherwise the time column alone is
+    scanned to find the matching rows.
+
+    Parameters:
+    -----------
+    path : str
+        CSV path or store directory
+    columns : list or None
+        Columns to load. Unknown names are ignored; None loads every column.
+    time_column : str or None
+        Column the start and end bounds apply to
+    start, end : str, datetime or number, optional
+        Inclusive time bounds
+    offset : int, default=0
+        Rows of the range to skip (after the cursor)
+    limit : int or None
+        Maximum number of rows to return; None returns the rest of the range
+    cursor : int or None
+        Row position to continue from, as returned in 'next_cursor'
+
+    Returns:
+    --------
+    df : pandas.DataFrame
+        Requested rows, indexed by their row position in the table
+    page : dict
+        'total' rows in the range, 'offset', 'returned' and 'next_cursor'
+        (None on the last page)
+    """
+    if not has_store(path):
+        # Plain CSV files have no index; filter the loaded table instead
+        wanted = None if columns is None else list(set(columns) | {time_column} - {None})
+        df = read_frame(path, columns=wanted)
+        entries = {col: {'path': None, 'array': _column_array(df[col], col == time_column)} for col in df.columns}
+        n_rows = len(df)
+        time_sorted = False
+    else:
+        entries = {entry['name']: entry for entry in _column_entries(store_path(path))}
+        n_rows = int(read_meta(path)['row_count'])
+        time_sorted = None
+
+    def column(name):
+        entry = entries[name]
+        if 'array' not in entry:
+            entry['array'] = np.load(entry['path'], mmap_mode='r')
+        return entry['array']
+
+    lo, hi = 0, n_rows
+    positions = None
+    if start is not None or end is not None:
+        if time_column not in entries:
+            raise ValueError("The result has no time column to filter on")
+        times = column(time_column)
+        if time_sorted is None:
+            time_sorted = entries[time_column].get('sorted')
+            if time_sorted is None:
+                # Stores written before sortedness was recorded
+                time_sorted = is_sorted(times)
+        if time_sorted:
+            if start is not None:
+                lo = int(np.searchsorted(times, _time_bound(times, start), side='left'))
+            if end is not None:
+                hi = int(np.searchsorted(times, _time_bound(times, end), side='right'))
+        else:
+            mask = np.ones(n_rows, dtype=bool)
+            if start is not None:
+                mask &= np.asarray(times >= _time_bound(times, start))
+            if end is not None:
+                mask &= np.asarray(times <= _time_bound(times, end))
+            positions = np.flatnonzero(mask)
+
+    if positions is None:
+        lo = max(lo, int(cursor or 0))
+        hi = max(hi, lo)
+        total = hi - lo
+        first = min(lo + offset, hi)
+        last = hi if limit is None else min(first + limit, hi)
+        selection = slice(first, last)
+        index = np.arange(first, last)
+        more = last < hi
+    else:
+        if cursor is not None:
+            positions = positions[positions >= int(cursor)]
+        total = len(positions)
+        index = positions[offset:] if limit is None else positions[offset:offset + limit]
+        selection = index
+        more = offset + len(index) < total
+
+    wanted = entries if columns is None else [name for name in entries if name in set(columns)]
+    data = {name: column(name)[selection] for name in wanted}
+    df = pd.DataFrame(data, index=index, copy=False)
+    page = {
+        'total': int(total),
+        'offset': int(offset),
+        'returned': len(df),
+        'next_cursor': int(index[-1]) + 1 if more and len(index) else None
+    }
+    return df, page
+
+def convert_csv(csv_path, time_column=None):
+    """
+    Convert an uploaded CSV file into its columnar store.
+
+    Parameters:
+    -----------
+    csv_path : str
+        Path of the uploaded CSV file
+    time_column : str or None
+        Timestamp column; auto-detected from the column names if None
+
+    Returns:
+    --------
+    df : pandas.DataFrame
+        The parsed dataframe
+    """
+    df = pd.read_csv(csv_path)
+    if time_column is None or time_column not in df.columns:
+        time_column = detect_time_column(df.columns)
+
+    write_store(df, csv_path, time_column=time_column)
+    logger.info(f"Converted {csv_path} to columnar store ({len(df)} rows)")
+    return df
+
+def format_timestamps(series):
+    """
+    Format a time column as strings for JSON payloads.
+    """
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series.dt.strftime('%Y-%m-%d %H:%M:%S').fillna('').tolist()
+    return series.tolist()
@@ -0,0 +1,153 @@
+import numpy as np
+
+DOWNSAMPLE_METHODS = ('lttb', 'minmax')
+
+# Candidate points processed per block when scoring buckets; bounds the
+# temporary (buckets x bucket width) matrices on long series
+BLOCK_POINTS = 1 << 20
+
+def _bucket_edges(start, stop, n_buckets):
+    # Near-equal half-open buckets covering positions start..stop-1
+    edges = np.linspace(start, stop, n_buckets + 1).astype(np.int64)
+    return edges[:-1], edges[1:]
+
+def _bucket_blocks(starts, ends):
+    # Groups of consecutive buckets whose padded matrix stays within BLOCK_POINTS
+    width = int((ends - starts).max())
+    per_block = max(1, BLOCK_POINTS // max(width, 1))
+    for lo in range(0, len(starts), per_block):
+        block_starts, block_ends = starts[lo:lo + per_block], ends[lo:lo + per_block]
+        # Every bucket is padded to the common width with its own last position
+        positions = block_starts[:, None] + np.arange(width)[None, :]
+        valid = positions < block_ends[:, None]
+        yield lo, np.where(valid, positions, block_ends[:, None] - 1), valid
+
+def _finite(y):
+    y = np.asarray(y, dtype=np.float64)
+    finite = np.isfinite(y)
+    if finite.all():
+        return y
+    fill = y[finite].mean() if finite.any() else 0.0
+    return np.where(finite, y, fill)
+
+def lttb_indices(x, y, n_out):
+    """
+    Positions of the points kept by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept; the points between them are
+    split into n_out - 2 buckets and from each bucket the point forming the
+    largest triangle with its neighbours is kept. The neighbours are the
+    means of the previous and next buckets, which lets all buckets be
+    scored at once with NumPy instead of one after another.
+
+    Parameters:
+    -----------
+    x : numpy.ndarray
+        Increasing x coordinates (e.g. timestamps as numbers)
+    y : numpy.ndarray
+        Values; missing values are replaced by the mean
+    n_out : int
+        Number of points to keep
+
+    Returns:
+    --------
+    positions : numpy.ndarray
+        Sorted positions of the kept points
+    """
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # Offsets from the first point keep the cumulative sums precise for epoch timestamps
+    x = np.asarray(x, dtype=np.float64)
+    x = x - x[0]
+    y = _finite(y)
+    starts, ends = _bucket_edges(1, n - 1, n_out - 2)
+    sizes = ends - starts
+
+    cum_x = np.concatenate([[0.0], np.cumsum(x)])
+    cum_y = np.concatenate([[0.0], np.cumsum(y)])
+    mean_x = (cum_x[ends] - cum_x[starts]) / sizes
+    mean_y = (cum_y[ends] - cum_y[starts]) / sizes
+
+    # Previous bucket mean (the first point for the first bucket) and next
+    # bucket mean (the last point for the last bucket)
+    ax = np.concatenate([[x[0]], mean_x[:-1]])
+    ay = np.concatenate([[y[0]], mean_y[:-1]])
+    cx = np.concatenate([mean_x[1:], [x[-1]]])
+    cy = np.concatenate([mean_y[1:], [y[-1]]])
+
+    picked = np.empty(len(starts), dtype=np.int64)
+    for lo, positions, valid in _bucket_blocks(starts, ends):
+        hi = lo + len(positions)
+        # Twice the triangle area; the constant factor does not change the argmax
+        area = np.abs((ax[lo:hi] - cx[lo:hi])[:, None] * (y[positions] - ay[lo:hi, None])
+                      - (ax[lo:hi, None] - x[positions]) * (cy[lo:hi] - ay[lo:hi])[:, None])
+        area[~valid] = -1.0
+        picked[lo:hi] = positions[np.arange(len(positions)), np.argmax(area, axis=1)]
+
+    return np.concatenate([[0], picked, [n - 1]])
+
+def minmax_indices(y, n_out):
+    """
+    Positions of the smallest and largest value of each of n_out // 2 buckets.
+
+    Keeps every peak and dip of the series, which suits spiky consumption
+    data where a single extreme reading matters more than the line shape.
+
+    Returns:
+    --------
+    positions : numpy.ndarray
+        Sorted, unique positions of the kept points
+    """
+    n = len(y)
+    n_buckets = n_out // 2
+    if n_out >= n or n_buckets < 1:
+        return np.arange(n)
+
+    y = _finite(y)
+    starts, ends = _bucket_edges(0, n, n_buckets)
+    picked = []
+    for _, positions, valid in _bucket_blocks(starts, ends):
+        values = y[positions]
+        rows = np.arange(len(positions))
+        picked.append(positions[rows, np.argmin(np.where(valid, values, np.inf), axis=1)])
+        picked.append(positions[rows, np.argmax(np.where(valid, values, -np.inf), axis=1)])
+    return np.unique(np.concatenate(picked))
+
+def downsample_indices(y, n_out, x=None, keep=None, method='lttb'):
+    """
+    Positions of a chart-sized subset of a series that keeps marked points.
+
+    Parameters:
+    -----------
+    y : numpy.ndarray
+        Values of the series, or None to pick evenly spaced points
+    n_out : int
+        Target number of points, not counting the kept points
+    x : numpy.ndarray or None
+        Increasing x coordinates; None uses the positions
+    keep : numpy.ndarray or None
+        Boolean mask of points that are always returned, e.g. anomalies
+    method : str, default='lttb'
+        'lttb' (Largest-Triangle-Three-Buckets) or 'minmax'
+
+    Returns:
+    --------
+    positions : numpy.ndarray
+        Sorted, unique positions of the points to plot
+    """
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+
+    n = len(y) if y is not None else len(keep)
+    if y is None:
+        positions = np.unique(np.linspace(0, n - 1, min(n_out, n)).astype(np.int64)) if n else np.arange(0)
+    elif method == 'minmax':
+        positions = minmax_indices(y, n_out)
+    else:
+        positions = lttb_indices(np.arange(n) if x is None else x, y, n_out)
+
+    if keep is not None and np.any(keep):
+        positions = np.union1d(positions, np.flatnonzero(keep))
+    return positions
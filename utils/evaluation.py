@@ -0,0 +1,234 @@
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.metrics import precision_score, recall_score, f1_score
+
+# Result column holding the ground-truth labels next to the predicted is_anomaly
+GROUND_TRUTH_COLUMN = 'true_anomaly'
+
+# Parameter sets tried for each detector by default
+DEFAULT_GRID = {
+    'isolation_forest': [{'contamination': contamination} for contamination in (0.01, 0.05, 0.1)],
+    'autoencoder': [{'threshold_percentile': percentile} for percentile in (90, 95, 99)],
+    'kmeans': [{'threshold_factor': factor} for factor in (1.5, 2.0, 3.0)],
+    'streaming': [{'z_threshold': z_threshold} for z_threshold in (3.0, 4.0, 5.0)],
+    'ensemble': [{'combine': combine} for combine in ('rank', 'max')]
+}
+
+# Ways to rank the candidates that meet the accuracy bar
+COST_KEYS = {
+    'time': ('seconds', 'peak_rss_mb'),
+    'memory': ('peak_rss_mb', 'seconds')
+}
+
+def label_metrics(labels, predictions):
+    """
+    Precision, recall and F1 of predicted anomalies against ground truth.
+
+    Rows without a label are left out.
+
+    Parameters:
+    -----------
+    labels : array-like
+        Ground-truth labels (1 for anomalies, 0 for normal, NaN if unknown)
+    predictions : array-like
+        Predicted labels
+
+    Returns:
+    --------
+    metrics : dict
+        'precision', 'recall', 'f1_score', 'labelled_points' and
+        'metrics_source' ('ground_truth')
+    """
+    labels = pd.to_numeric(pd.Series(np.asarray(labels)), errors='coerce').to_numpy(dtype=np.float64)
+    predictions = np.asarray(predictions)
+    known = ~np.isnan(labels)
+    y_true = labels[known].astype(int)
+    y_pred = predictions[known].astype(int)
+    return {
+        'precision': float(precision_score(y_true, y_pred, zero_division=0)),
+        'recall': float(recall_score(y_true, y_pred, zero_division=0)),
+        'f1_score': float(f1_score(y_true, y_pred, zero_division=0)),
+        'labelled_points': int(known.sum()),
+        'metrics_source': 'ground_truth'
+    }
+
+def evaluate_candidate(df, algorithm, params, time_column=None, value_column=None):
+    """
+    Run one detector with one parameter set and score it against the labels.
+
+    Meant to run in a fresh process (see utils.benchmark.run_isolated) so the
+    peak RSS belongs to this run only.
+
+    Returns:
+    --------
+    entry : dict
+        Accuracy metrics, runtime in seconds, rows per second and peak RSS in MB
+    """
+    from utils.job_queue import run_detection
+    from utils.benchmark import peak_rss_mb
+
+    start = time.perf_counter()
+    anomalies, metrics, _ = run_detection(df, algorithm, time_column=time_column,
+                                          value_column=value_column, params=params)
+    seconds = time.perf_counter() - start
+
+    entry = {
+        'precision': metrics.get('precision'),
+        'recall': metrics.get('recall'),
+        'f1_score': metrics.get('f1_score'),
+        'anomaly_count': int(anomalies['is_anomaly'].sum()),
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(len(df) / seconds, 1) if seconds > 0 else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+    if is_fallback(metrics):
+        entry['note'] = metrics['note']
+    return entry
+
+def is_fallback(metrics):
+    """
+    Whether a detector fell back to its emergency outlier rule instead of
+    running the model (reported in metrics['note']).
+    """
+    return 'fallback' in str(metrics.get('note', '')).lower()
+
+def select_cheapest(entries, min_f1, cost='time'):
+    """
+    Pick the cheapest candidate whose F1 meets the accuracy bar.
+
+    Parameters:
+    -----------
+    entries : list of dict
+        Leaderboard entries
+    min_f1 : float
+        Required F1 score
+    cost : str, default='time'
+        'time' ranks by runtime then memory, 'memory' by memory then runtime
+
+    Returns:
+    --------
+    entry : dict or None
+        The selected entry, None if no candidate meets the bar
+    """
+    qualified = [entry for entry in entries
+                 if entry.get('status') == 'ok' and (entry.get('f1_score') or 0) >= min_f1]
+    if not qualified:
+        return None
+    return min(qualified, key=lambda entry: tuple(entry[key] for key in COST_KEYS[cost]))
+
+def evaluate(df, candidates=None, time_column=None, value_column=None, min_f1=0.5, cost='time',
+             isolate=True, log=print):
+    """
+    Score every detector and parameter set on accuracy and cost.
+
+    The dataframe must carry a ground-truth label column (see
+    ml_models.features.detect_label_column). Each candidate runs through the
+    same run_detection path as detection jobs, so the label column is kept
+    out of the features.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Labelled input data
+    candidates : list of (str, dict) or None
+        (algorithm, constructor arguments) pairs; None uses DEFAULT_GRID
+    time_column : str or None
+        Column name of the timestamps
+    value_column : str or None
+        Column name of the energy consumption values; None uses
+        ml_models.features.default_value_column
+    min_f1 : float, default=0.5
+        Accuracy bar used to select a detector
+    cost : str, default='time'
+        Cost ranking, a key of COST_KEYS
+    isolate : bool, default=True
+        Run every candidate in a fresh process so peak memory is per candidate
+    log : callable
+        Progress output
+
+    Returns:
+    --------
+    report : dict
+        'leaderboard' sorted by F1 (best first) and the 'selected' entry
+    """
+    from ml_models.features import detect_label_column, default_value_column
+    from utils.benchmark import run_isolated
+
+    label_column = detect_label_column(df)
+    if label_column is None:
+        raise ValueError("No ground-truth label column found in the data")
+    if value_column is None:
+        value_column = default_value_column(df)
+        log(f"Using value column '{value_column}'")
+    if cost not in COST_KEYS:
+        raise ValueError(f"Unknown cost '{cost}'")
+
+    if candidates is None:
+        candidates = [(algorithm, params) for algorithm, grid in DEFAULT_GRID.items() for params in grid]
+
+    entries = []
+    for algorithm, params in candidates:
+        entry = {'algorithm': algorithm, 'params': params}
+        try:
+            args = (df, algorithm, params, time_column, value_column)
+            entry.update(run_isolated(evaluate_candidate, *args) if isolate else evaluate_candidate(*args))
+            if 'note' in entry:
+                # The fallback rule is not the candidate being evaluated
+                raise RuntimeError(entry.pop('note'))
+            entry['status'] = 'ok'
+            log(f"{algorithm:>16} {json.dumps(params):<34} F1 {entry['f1_score']:.3f}  "
+                f"{entry['seconds']:8.3f}s  {entry['peak_rss_mb']:8.1f} MB")
+        except Exception as e:
+            entry['status'] = 'failed'
+            entry['error'] = f"{type(e).__name__}: {e}"
+            log(f"{algorithm:>16} {json.dumps(params):<34} FAILED {entry['error']}")
+        entries.append(entry)
+
+    leaderboard = sorted(entries, key=lambda entry: (entry['status'] != 'ok', -(entry.get('f1_score') or 0),
+                                                     entry.get('seconds') or 0))
+    return {
+        'label_column': label_column,
+        'rows': len(df),
+        'anomaly_ratio': float(pd.to_numeric(df[label_column], errors='coerce').mean()),
+        'min_f1': min_f1,
+        'cost': cost,
+        'leaderboard': leaderboard,
+        'selected': select_cheapest(leaderboard, min_f1, cost=cost)
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Rank the detectors on labelled data by accuracy and cost.')
+    parser.add_argument('path', help='Labelled CSV file or columnar store')
+    parser.add_argument('--time-column', help='Timestamp column (auto-detected if omitted)')
+    parser.add_argument('--value-column', help='Value column (auto-detected if omitted)')
+    parser.add_argument('--min-f1', type=float, default=0.5, help='F1 a detector must reach to be selected')
+    parser.add_argument('--cost', choices=sorted(COST_KEYS), default='time', help='Cost to minimise')
+    parser.add_argument('--algorithms', nargs='+', default=list(DEFAULT_GRID), help='Detectors to evaluate')
+    parser.add_argument('--output', default='leaderboard.json', help='Where to write the leaderboard')
+    args = parser.parse_args(argv)
+
+    from utils.dataset_store import read_frame, detect_time_column
+
+    df = read_frame(args.path)
+    time_column = args.time_column or detect_time_column(df.columns)
+    candidates = [(algorithm, params) for algorithm in args.algorithms for params in DEFAULT_GRID.get(algorithm, [{}])]
+    report = evaluate(df, candidates=candidates, time_column=time_column, value_column=args.value_column,
+                      min_f1=args.min_f1, cost=args.cost)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Leaderboard written to {args.output}")
+
+    selected = report['selected']
+    if selected is None:
+        print(f"No detector reached F1 {args.min_f1}", file=sys.stderr)
+        return 1
+    print(f"Cheapest detector with F1 >= {args.min_f1}: {selected['algorithm']} {json.dumps(selected['params'])} "
+          f"(F1 {selected['f1_score']:.3f}, {selected['seconds']:.3f}s, {selected['peak_rss_mb']:.1f} MB)")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
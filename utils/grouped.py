@@ -0,0 +1,174 @@
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Name fragments of columns that identify a meter, site or building
+GROUP_COLUMN_PATTERNS = ['meter', 'site', 'building', 'device', 'sensor', 'station']
+
+# A group column repeats its values; more distinct values than this share of
+# the rows means the column is a row identifier rather than a group key
+MAX_GROUP_RATIO = 0.5
+
+def detect_group_column(df):
+    """
+    Suggest a column that identifies the meter or site of every row.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Sample of the dataset
+
+    Returns:
+    --------
+    group_column : str or None
+        First column whose name looks like a meter/site ID and whose values
+        repeat, None if there is no such column
+    """
+    for column in df.columns:
+        name = str(column).lower()
+        if not any(pattern in name for pattern in GROUP_COLUMN_PATTERNS):
+            continue
+        if pd.api.types.is_float_dtype(df[column]):
+            # Readings such as 'meter_reading' are measurements, not keys
+            continue
+        n_groups = df[column].nunique()
+        if 1 < n_groups <= max(2, len(df) * MAX_GROUP_RATIO):
+            return column
+    return None
+
+def group_cache_key(cache_key, group_column, group):
+    """
+    Feature cache key of one group, derived from the dataset content hash.
+    """
+    if cache_key is None:
+        return None
+    return hashlib.sha256(f"{cache_key}:{group_column}={group}".encode()).hexdigest()
+
+def _detect_group(df, algorithm, time_column, value_column, cache_key, params):
+    # Runs in a worker: fit this group's own model and keep only the summary,
+    # so the fitted model is not sent back to the parent process
+    from utils.job_queue import run_detection
+
+    anomalies, metrics, model = run_detection(df, algorithm, time_column=time_column, value_column=value_column,
+                                              cache_key=cache_key, params=params)
+    threshold = getattr(model, 'threshold', None)
+    summary = {
+        'threshold': float(threshold) if threshold is not None else metrics.get('threshold'),
+        'anomaly_count': int(anomalies['is_anomaly'].sum())
+    }
+    for key in ('precision', 'recall', 'f1_score', 'metrics_source', 'label_column'):
+        if key in metrics:
+            summary[key] = metrics[key]
+    return anomalies, summary
+
+def run_grouped(df, algorithm, group_column, time_column=None, value_column=None, cache_key=None, params=None,
+                max_workers=None):
+    """
+    Run detection separately for every meter or site of a multi-meter dataset.
+
+    Rows are split on the group column and each group is detected in its own
+    worker process with its own model and threshold, so rolling features and
+    baselines never mix readings of different meters. The group results are
+    put back into the original row order and returned as one dataframe whose
+    group column indexes the rows of each group.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Input dataframe with time series data, each group in time order
+    algorithm : str
+        One of the keys of utils.job_queue.MODEL_CLASSES
+    group_column : str
+        Column holding the meter/site ID
+    time_column : str or None
+        Column name of the timestamps
+    value_column : str or None
+        Column name of the energy consumption values
+    cache_key : str or None
+        Content hash of the dataset; each group caches its features under a
+        key derived from it
+    params : dict or None
+        Extra model constructor arguments, shared by every group
+    max_workers : int or None
+        Pool size, defaults to utils.job_queue.nested_pool_size()
+
+    Returns:
+    --------
+    anomalies : pandas.DataFrame
+        Dataframe with the original data and anomaly predictions
+    metrics : dict
+        Metrics over all rows, with per-group details under 'groups'
+    model : None
+        Every group fits its own model, so no single model is returned
+    """
+    from utils.job_queue import nested_pool_size
+    from utils.evaluation import GROUND_TRUTH_COLUMN, label_metrics
+    from ml_models.features import detect_label_column
+
+    if group_column not in df.columns:
+        raise ValueError(f"Group column '{group_column}' not found in the dataset")
+    if value_column == group_column:
+        value_column = None
+
+    positions = df.groupby(group_column, sort=False, dropna=False).indices
+    if max_workers is None:
+        max_workers = nested_pool_size()
+
+    frame = df.drop(columns=[group_column])
+    with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(positions)))) as executor:
+        futures = {
+            group: executor.submit(_detect_group, frame.iloc[rows].reset_index(drop=True), algorithm,
+                                   time_column, value_column, group_cache_key(cache_key, group_column, group),
+                                   params)
+            for group, rows in positions.items()
+        }
+
+        parts = []
+        groups = []
+        for group, future in futures.items():
+            rows = positions[group]
+            info = {'group': group if not isinstance(group, np.generic) else group.item(), 'rows': len(rows)}
+            try:
+                part, summary = future.result()
+                info.update(summary)
+            except Exception as e:
+                # One meter with too little or broken data must not fail the whole job
+                logger.error(f"Detection for {group_column}={group} failed: {str(e)}")
+                part = frame.iloc[rows].reset_index(drop=True)
+                label_column = detect_label_column(part)
+                if label_column is not None:
+                    part[GROUND_TRUTH_COLUMN] = part.pop(label_column)
+                part['is_anomaly'] = 0
+                info['anomaly_count'] = 0
+                info['error'] = str(e) or e.__class__.__name__
+            part.index = rows
+            parts.append(part)
+            groups.append(info)
+
+    anomalies = pd.concat(parts).sort_index()
+    anomalies['is_anomaly'] = anomalies['is_anomaly'].fillna(0).astype(int)
+    anomalies.insert(min(df.columns.get_loc(group_column), len(anomalies.columns)), group_column,
+                     df[group_column].to_numpy())
+    anomalies = anomalies.reset_index(drop=True)
+
+    flags = anomalies['is_anomaly'].to_numpy()
+    metrics = {
+        'anomaly_count': int(flags.sum()),
+        'anomaly_ratio': float(flags.mean()) if len(flags) else 0.0,
+        'total_points': len(anomalies),
+        'group_column': group_column,
+        'group_count': len(groups),
+        'failed_groups': sum(1 for info in groups if 'error' in info),
+        'groups': groups
+    }
+    if GROUND_TRUTH_COLUMN in anomalies.columns:
+        metrics.update(label_metrics(anomalies[GROUND_TRUTH_COLUMN], flags))
+        metrics['label_column'] = next((info['label_column'] for info in groups if 'label_column' in info), None)
+
+    logger.info(f"Detected {algorithm} on {len(groups)} groups of '{group_column}', "
+                f"{metrics['failed_groups']} failed")
+    return anomalies, metrics, None
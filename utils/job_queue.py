@@ -0,0 +1,454 @@
+import os
+import socket
+import logging
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from ml_models.isolation_forest import IsolationForestModel
+from ml_models.autoencoder import AutoEncoderModel
+from ml_models.kmeans import KMeansModel
+from ml_models.streaming import StreamingDetector
+from ml_models.ensemble import EnsembleModel
+from utils.dataset_store import (read_frame, write_result_store, convert_csv, has_store, detect_time_column,
+                                 content_hash)
+from utils.model_registry import save_model
+from utils.evaluation import GROUND_TRUTH_COLUMN, label_metrics
+from ml_models.features import detect_label_column
+from utils.sweep import run_sweep
+from utils.partitioned import run_partitioned
+from utils.grouped import run_grouped
+from utils.visualizer import summarize_result, invalidate_overview
+
+logger = logging.getLogger(__name__)
+
+# Job states stored in DetectionJob.status
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+MODEL_CLASSES = {
+    'isolation_forest': IsolationForestModel,
+    'autoencoder': AutoEncoderModel,
+    'kmeans': KMeansModel,
+    'streaming': StreamingDetector,
+    'ensemble': EnsembleModel
+}
+
+# Pseudo-algorithm that runs every model in MODEL_CLASSES on the same data
+COMPARE = 'compare'
+
+# Pseudo-algorithm that fits one model for every configuration of a parameter
+# grid (job params: {'algorithm': ..., 'grid': {...}}) and keeps the best one
+SWEEP = 'sweep'
+
+_executor = None
+
+# True in the processes of the job pool, whose nested pools share the CPUs
+_in_job_worker = False
+
+def detection_workers():
+    return int(os.environ.get('DETECTION_WORKERS', os.cpu_count() or 1))
+
+def nested_pool_size():
+    """
+    Default size of the process pools started by compare, partitioned, grouped
+    and sweep runs.
+
+    Those runs execute inside a job pool worker, and up to DETECTION_WORKERS
+    of them may each start a pool at the same time. Inside a job worker the
+    CPUs are therefore split among the job workers, so all nested pools
+    together start about as many processes as there are CPUs. Elsewhere (e.g.
+    the command-line tools) the pool has DETECTION_WORKERS processes or one
+    per CPU.
+    """
+    if _in_job_worker:
+        return max(1, (os.cpu_count() or 1) // detection_workers())
+    return detection_workers()
+
+def get_executor():
+    """
+    Return the process pool used to run detection jobs, creating it on first use.
+
+    The pool size is read from the DETECTION_WORKERS environment variable and
+    defaults to the number of CPUs. Each web worker process owns its own pool;
+    the jobs it queues record it as their owner (DetectionJob.owner) so they
+    can be recovered if the process stops (see recover_orphaned_jobs).
+
+    Returns:
+    --------
+    executor : concurrent.futures.ProcessPoolExecutor
+        Pool of local worker processes
+    """
+    global _executor
+    if _executor is None:
+        max_workers = detection_workers()
+        _executor = ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker)
+        logger.info(f"Started detection worker pool with {max_workers} processes")
+    return _executor
+
+def _init_worker():
+    global _in_job_worker
+    _in_job_worker = True
+
+    # Connections inherited from the parent process must not be reused in the child
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+def enqueue_detection_job(job):
+    """
+    Submit a queued DetectionJob to the worker pool.
+
+    Parameters:
+    -----------
+    job : DetectionJob
+        Committed job record in the 'queued' state
+    """
+    global _executor
+    try:
+        future = get_executor().submit(run_detection_job, job.id)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool and retry once
+        logger.warning("Detection worker pool is broken, restarting it")
+        _executor = None
+        future = get_executor().submit(run_detection_job, job.id)
+
+    future.add_done_callback(lambda f, job_id=job.id, user_id=job.user_id: _on_job_finished(job_id, user_id, f))
+
+def _on_job_finished(job_id, user_id, future):
+    # Runs in the web process that queued the job: the new result must show up
+    # in the dashboard overview right away
+    invalidate_overview(user_id)
+
+    # Jobs record their own outcome; this only catches workers that died mid-run
+    exc = future.exception()
+    if exc is None:
+        return
+
+    logger.error(f"Detection job {job_id} crashed: {str(exc)}")
+    _mark_job(job_id, JOB_FAILED, error=str(exc) or exc.__class__.__name__)
+
+def mark_job_failed(job_id, error):
+    """
+    Record that a job failed outside its worker, e.g. because it could not be queued.
+    """
+    _mark_job(job_id, JOB_FAILED, error=error)
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but belongs to another user
+        return True
+    return True
+
+def recover_orphaned_jobs():
+    """
+    Fail jobs left queued or running by a web process that has stopped.
+
+    A job only runs in the worker pool of the process that queued it, so the
+    jobs of a recycled or redeployed web worker would otherwise never finish.
+    Owners on other hosts cannot be checked and are left alone; jobs queued
+    before owners were recorded are failed. Must be called inside an
+    application context, at startup.
+
+    Returns:
+    --------
+    count : int
+        Number of jobs marked as failed
+    """
+    from app import db
+    from models import DetectionJob
+
+    host = socket.gethostname()
+    orphaned = []
+    for job in DetectionJob.query.filter(DetectionJob.status.in_((JOB_QUEUED, JOB_RUNNING))):
+        if job.owner:
+            owner_host, _, pid = job.owner.rpartition(':')
+            if owner_host != host or not pid.isdigit() or _process_alive(int(pid)):
+                continue
+        job.status = JOB_FAILED
+        job.finished_date = datetime.utcnow()
+        job.error = 'Interrupted: the web process running this job stopped before it finished'
+        orphaned.append(job.id)
+
+    if orphaned:
+        db.session.commit()
+        logger.warning(f"Marked orphaned detection jobs as failed: {orphaned}")
+    return len(orphaned)
+
+def _mark_job(job_id, status, error=None):
+    from app import app, db
+    from models import DetectionJob
+
+    with app.app_context():
+        job = db.session.get(DetectionJob, job_id)
+        if job is None or job.status in (JOB_DONE, JOB_FAILED):
+            return
+        job.status = status
+        if status == JOB_RUNNING:
+            job.started_date = datetime.utcnow()
+        else:
+            job.finished_date = datetime.utcnow()
+        if error is not None:
+            job.error = error
+        db.session.commit()
+
+def run_detection(df, algorithm, time_column=None, value_column=None, cache_key=None, params=None):
+    """
+    Run a detection algorithm on a dataframe.
+
+    A ground-truth label column (see detect_label_column) is kept out of the
+    model input. Its values are returned in the GROUND_TRUTH_COLUMN column and
+    precision, recall and F1 are computed against them instead of the
+    models' synthetic labels.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Input dataframe with time series data
+    algorithm : str
+        One of the keys of MODEL_CLASSES
+    time_column : str or None
+        Column name of the timestamps
+    value_column : str or None
+        Column name of the energy consumption values
+    cache_key : str or None
+        Content hash of the dataset, enables the feature cache
+    params : dict or None
+        Extra model constructor arguments
+
+    Returns:
+    --------
+    anomalies : pandas.DataFrame
+        Dataframe with the original data and anomaly predictions
+    metrics : dict
+        Dictionary with performance metrics
+    model : object
+        The fitted detector, for the model registry
+    """
+    if algorithm not in MODEL_CLASSES:
+        raise ValueError(f"Unknown algorithm '{algorithm}'")
+
+    label_column = detect_label_column(df)
+    if label_column is not None:
+        labels = df[label_column]
+        df = df.drop(columns=[label_column])
+        if value_column == label_column:
+            value_column = None
+
+    model = MODEL_CLASSES[algorithm](cache_key=cache_key, **(params or {}))
+    logger.info(f"Using time_column: {time_column}, value_column: {value_column}")
+    anomalies, metrics = model.detect_anomalies(df, time_column=time_column, value_column=value_column)
+
+    if label_column is not None:
+        anomalies[GROUND_TRUTH_COLUMN] = labels.to_numpy()
+        metrics.update(label_metrics(labels, anomalies['is_anomaly']))
+        metrics['label_column'] = label_column
+    return anomalies, metrics, model
+
+def run_comparison(df, time_column=None, value_column=None, cache_key=None, params=None):
+    """
+    Run every detection algorithm on the same dataframe in parallel.
+
+    The dataframe is loaded once by the caller and each model is
+    fitted in its own process, so the wall-clock time approaches that of the
+    slowest model rather than the sum of all of them.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Input dataframe with time series data
+    time_column : str or None
+        Column name of the timestamps
+    value_column : str or None
+        Column name of the energy consumption values
+    cache_key : str or None
+        Content hash of the dataset, enables the feature cache
+    params : dict or None
+        Mapping of algorithm name to extra model constructor arguments
+
+    Returns:
+    --------
+    outputs : dict
+        Mapping of algorithm name to an (anomalies, metrics, model) tuple
+    """
+    with ProcessPoolExecutor(max_workers=min(len(MODEL_CLASSES), nested_pool_size())) as executor:
+        futures = {
+            algorithm: executor.submit(run_detection, df, algorithm, time_column, value_column, cache_key,
+                                       (params or {}).get(algorithm))
+            for algorithm in MODEL_CLASSES
+        }
+        return {algorithm: future.result() for algorithm, future in futures.items()}
+
+def save_result(anomalies, metrics, algorithm, dataset, user_id, job_id=None):
+    """
+    Write a detection result to disk and create its AnomalyResult record.
+
+    Must be called inside an application context. Results produced by a job
+    are linked to it through AnomalyResult.job_id.
+
+    Returns:
+    --------
+    result : AnomalyResult
+        The committed result record
+    """
+    from app import app, db
+    from models import AnomalyResult
+
+    # Save the per-row detector outputs (flags, scores and per-feature anomalies)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if job_id is not None:
+        result_name = f"{algorithm}_{timestamp}_job{job_id}"
+    else:
+        result_name = f"{algorithm}_{timestamp}"
+    result_dir = os.path.join(app.root_path, 'results', str(user_id))
+    os.makedirs(result_dir, exist_ok=True)
+
+    time_column = dataset.time_column or detect_time_column(anomalies.columns)
+    # Only the detector outputs are written; the dataset columns are joined in on read
+    result_path = write_result_store(anomalies, os.path.join(result_dir, result_name), dataset.file_path,
+                                     time_column=time_column)
+
+    # Aggregates for the dashboard and recommendations, so they never re-read the result
+    try:
+        summary = summarize_result(anomalies, time_column=time_column, value_column=dataset.value_column)
+    except Exception as e:
+        logger.warning(f"Could not summarize {algorithm} result: {str(e)}")
+        summary = None
+
+    # Log feature importance if available
+    if metrics.get('feature_importance'):
+        sorted_features = sorted(metrics['feature_importance'].items(), key=lambda x: x[1], reverse=True)
+        logger.info(f"Feature importance: {sorted_features}")
+
+    result = AnomalyResult(
+        algorithm=algorithm,
+        anomaly_count=int(anomalies['is_anomaly'].sum()),
+        result_path=result_path,
+        metrics=metrics,
+        summary=summary,
+        user_id=user_id,
+        dataset_id=dataset.id,
+        job_id=job_id
+    )
+
+    db.session.add(result)
+    db.session.commit()
+    return result
+
+def run_detection_job(job_id):
+    """
+    Execute a DetectionJob inside a worker process.
+
+    Loads the dataset, runs the selected model, stores the result and records
+    the job outcome. Errors are stored on the job instead of being raised.
+
+    Parameters:
+    -----------
+    job_id : int
+        Primary key of the DetectionJob to run
+    """
+    from app import app, db
+    from models import DetectionJob
+
+    with app.app_context():
+        job = db.session.get(DetectionJob, job_id)
+        if job is None:
+            logger.warning(f"Detection job {job_id} no longer exists")
+            return
+
+        _mark_job(job_id, JOB_RUNNING)
+
+        try:
+            dataset = job.dataset
+            logger.info(f"Running {job.algorithm} on dataset {dataset.filename} (ID: {dataset.id})")
+
+            if has_store(dataset.file_path):
+                df = read_frame(dataset.file_path)
+            else:
+                # Datasets uploaded before the columnar store existed are converted on first use
+                df = convert_csv(dataset.file_path, time_column=dataset.time_column)
+            # Features computed for this exact dataset content are reused across jobs
+            cache_key = content_hash(dataset.file_path)
+
+            params = job.params or {}
+            # Number of time partitions to detect in parallel (None runs unpartitioned)
+            partitions = params.get('partitions')
+
+            if job.algorithm == SWEEP:
+                # Only the ranked table and the best configuration's result are stored
+                sweep = run_sweep(df, params['algorithm'], params['grid'],
+                                  time_column=dataset.time_column,
+                                  value_column=dataset.value_column,
+                                  cache_key=cache_key)
+                job.output = sweep
+                db.session.commit()
+                if sweep['best_params'] is None:
+                    raise ValueError("Every sweep configuration failed")
+                # Refit on the same value column the configurations were ranked on
+                anomalies, metrics, model = run_detection(df, params['algorithm'],
+                                                          time_column=dataset.time_column,
+                                                          value_column=sweep['value_column'],
+                                                          cache_key=cache_key,
+                                                          params=sweep['best_params'])
+                metrics['params'] = sweep['best_params']
+                outputs = {params['algorithm']: (anomalies, metrics, model)}
+            elif dataset.group_column and job.algorithm == COMPARE:
+                # Groups already run in parallel, so the models run one after another
+                outputs = {algorithm: run_grouped(df, algorithm, dataset.group_column,
+                                                  time_column=dataset.time_column,
+                                                  value_column=dataset.value_column,
+                                                  cache_key=cache_key,
+                                                  params=params.get(algorithm))
+                           for algorithm in MODEL_CLASSES}
+            elif dataset.group_column:
+                # Each meter gets its own model; time partitions do not apply
+                outputs = {job.algorithm: run_grouped(df, job.algorithm, dataset.group_column,
+                                                      time_column=dataset.time_column,
+                                                      value_column=dataset.value_column,
+                                                      cache_key=cache_key,
+                                                      params=params.get(job.algorithm))}
+            elif job.algorithm == COMPARE and partitions:
+                # Each model already uses the whole pool across its partitions
+                outputs = {algorithm: run_partitioned(df, algorithm, partitions,
+                                                      time_column=dataset.time_column,
+                                                      value_column=dataset.value_column,
+                                                      params=params.get(algorithm))
+                           for algorithm in MODEL_CLASSES}
+            elif job.algorithm == COMPARE:
+                outputs = run_comparison(df, time_column=dataset.time_column,
+                                         value_column=dataset.value_column,
+                                         cache_key=cache_key, params=params)
+            elif partitions:
+                outputs = {job.algorithm: run_partitioned(df, job.algorithm, partitions,
+                                                          time_column=dataset.time_column,
+                                                          value_column=dataset.value_column,
+                                                          params=params.get(job.algorithm))}
+            else:
+                outputs = {job.algorithm: run_detection(df, job.algorithm,
+                                                        time_column=dataset.time_column,
+                                                        value_column=dataset.value_column,
+                                                        cache_key=cache_key,
+                                                        params=params.get(job.algorithm))}
+
+            result_ids = []
+            for algorithm, (anomalies, metrics, model) in outputs.items():
+                result = save_result(anomalies, metrics, algorithm, dataset, job.user_id, job_id=job_id)
+                result_ids.append(result.id)
+                try:
+                    save_model(model, algorithm, dataset, result, job.user_id)
+                except Exception as e:
+                    # The result is still usable without a stored model
+                    logger.error(f"Error saving fitted {algorithm} model: {str(e)}")
+                    db.session.rollback()
+
+            _mark_job(job_id, JOB_DONE)
+            logger.info(f"Detection job {job_id} finished with results {result_ids}")
+        except Exception as e:
+            logger.error(f"Error running detection job {job_id}: {str(e)}")
+            db.session.rollback()
+            _mark_job(job_id, JOB_FAILED, error=str(e))
@@ -0,0 +1,128 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import joblib
+
+logger = logging.getLogger(__name__)
+
+# Directory (relative to the app root) holding serialized fitted models
+MODEL_DIR = 'trained_models'
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cache_size():
+    return int(os.environ.get('MODEL_CACHE_SIZE', 8))
+
+def save_model(model, algorithm, dataset, result, user_id):
+    """
+    Serialize a fitted detector and create its TrainedModel record.
+
+    The model instance is stored as a whole with joblib, so the estimator,
+    scaler, threshold, cluster centers, cleaning statistics and feature
+    names are all restored together. Must be called inside an application
+    context.
+
+    Parameters:
+    -----------
+    model : object or None
+        Detector from ml_models after detect_anomalies has run
+    algorithm : str
+        Algorithm name the model was run as
+    dataset : Dataset
+        Dataset the model was fitted on
+    result : AnomalyResult or None
+        Detection result produced by the fit
+    user_id : int
+        Owner of the model
+
+    Returns:
+    --------
+    trained_model : TrainedModel or None
+        The committed record, or None if the model fell back to a method that
+        cannot score new data
+    """
+    from app import app, db
+    from models import TrainedModel
+
+    if model is None:
+        # Partitioned and grouped runs fit one model per partition or group and register none
+        return None
+    if not getattr(model, 'is_fitted', False):
+        logger.info(f"Not saving {algorithm} model: detection used a fallback method")
+        return None
+
+    model_dir = os.path.join(app.root_path, MODEL_DIR, str(user_id))
+    os.makedirs(model_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    suffix = f"_result{result.id}" if result is not None else ""
+    model_path = os.path.join(model_dir, f"{algorithm}_{timestamp}{suffix}.joblib")
+
+    # The feature cache key only applies to the training data
+    model.cache_key = None
+    tmp_path = f"{model_path}.tmp{os.getpid()}"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, model_path)
+
+    trained_model = TrainedModel(
+        algorithm=algorithm,
+        model_path=model_path,
+        feature_names=list(model.feature_names or []),
+        threshold=float(model.threshold) if getattr(model, 'threshold', None) is not None else None,
+        user_id=user_id,
+        dataset_id=dataset.id,
+        result_id=result.id if result is not None else None
+    )
+    db.session.add(trained_model)
+    db.session.commit()
+    return trained_model
+
+def load_model(trained_model):
+    """
+    Return the fitted detector of a TrainedModel record.
+
+    Models are loaded lazily and kept in a per-process LRU cache of
+    MODEL_CACHE_SIZE entries (default 8), so repeated scoring requests do not
+    deserialize the model again.
+
+    Parameters:
+    -----------
+    trained_model : TrainedModel
+        Registry record of the model
+
+    Returns:
+    --------
+    model : object
+        Detector with a score() method
+    """
+    path = trained_model.model_path
+    with _cache_lock:
+        model = _cache.get(path)
+        if model is not None:
+            _cache.move_to_end(path)
+            return model
+
+    # Deserialize outside the lock; a concurrent load of the same file is harmless
+    model = joblib.load(path)
+
+    with _cache_lock:
+        _cache[path] = model
+        _cache.move_to_end(path)
+        while len(_cache) > _cache_size():
+            _cache.popitem(last=False)
+    return model
+
+def input_columns(model):
+    """
+    Return the raw input columns a fitted detector needs to score new rows.
+    """
+    if getattr(model, 'feature_columns', None):
+        columns = list(model.feature_columns)
+    else:
+        columns = [model.value_column]
+    # Seasonal streaming detectors also need the reading times
+    if getattr(model, 'time_column', None):
+        columns.append(model.time_column)
+    return columns
@@ -0,0 +1,254 @@
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from ml_models.quantile_sketch import QuantileSketch
+from ml_models.isolation_forest import DEFAULT_FIT_SAMPLE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Rows each partition shares with the previous one; covers the largest rolling
+# window used for features (24, e.g. KMeansModel.window_size)
+PARTITION_OVERLAP = 24
+
+# Partitions smaller than this are merged, since per-process overhead dominates
+MIN_PARTITION_ROWS = 1000
+
+# Contiguous blocks the shared model's fit sample is drawn from
+FIT_BLOCKS = 16
+
+# Algorithms whose detection is window-local; the streaming detector carries
+# state over the whole history and always runs unpartitioned
+PARTITIONED_ALGORITHMS = ('isolation_forest', 'autoencoder', 'kmeans')
+
+def partition_bounds(n_rows, n_partitions):
+    """
+    Split n_rows consecutive rows into at most n_partitions equal ranges.
+
+    Returns:
+    --------
+    bounds : list of (int, int)
+        Half-open (start, end) row ranges covering every row once
+    """
+    n_partitions = max(1, min(int(n_partitions), n_rows // MIN_PARTITION_ROWS))
+    edges = np.linspace(0, n_rows, n_partitions + 1).round().astype(int)
+    return [(int(start), int(end)) for start, end in zip(edges[:-1], edges[1:])]
+
+def overlap_rows(model):
+    """
+    Context rows needed in front of a partition so its rolling features match
+    those of an unpartitioned run.
+    """
+    spec = getattr(model, 'feature_spec', None)
+    if spec is None:
+        return PARTITION_OVERLAP
+    return max(PARTITION_OVERLAP, spec.max_window - 1)
+
+def fit_sample(df, fit_rows):
+    """
+    Rows the shared model of a partitioned run is fitted on.
+
+    FIT_BLOCKS contiguous blocks spread evenly over the series, so every
+    period (e.g. a noisier second half) is represented and rolling features
+    are computed from consecutive readings within each block.
+
+    Returns:
+    --------
+    sample : pandas.DataFrame
+        The concatenated blocks, with a fresh index
+    """
+    if len(df) <= fit_rows:
+        return df.reset_index(drop=True)
+    block_rows = max(fit_rows // FIT_BLOCKS, MIN_PARTITION_ROWS)
+    n_blocks = max(1, fit_rows // block_rows)
+    starts = np.linspace(0, len(df) - block_rows, n_blocks).round().astype(int)
+    return pd.concat([df.iloc[start:start + block_rows] for start in starts], ignore_index=True)
+
+def _score_partition(df, context, model):
+    # Runs in a worker: score the partition plus its context rows with the
+    # shared model, then drop the context rows, which belong to the previous
+    # partition. Only mergeable summaries of the partition's rows are returned
+    # besides the scores, so no row is counted in two partitions.
+    scores = model.score(df).iloc[context:]
+    df = df.iloc[context:]
+    sketch = QuantileSketch.from_values(scores['anomaly_score'].to_numpy(dtype=np.float64))
+    feature_sketches = {feature: QuantileSketch.from_values(df[feature].values)
+                        for feature in getattr(model, 'feature_sketches', {}) if feature in df.columns}
+    cluster_stats = None
+    if 'cluster' in scores.columns:
+        # Sum and count of the distances per cluster, for the global mean cluster distances
+        n_clusters = len(model.cluster_centers)
+        clusters = scores['cluster'].to_numpy()
+        cluster_stats = (np.bincount(clusters, weights=scores['anomaly_score'].to_numpy(), minlength=n_clusters),
+                         np.bincount(clusters, minlength=n_clusters))
+    return scores, sketch, feature_sketches, cluster_stats
+
+def _merge(sketches):
+    merged = QuantileSketch()
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
+
+def _global_threshold(algorithm, model, parts):
+    # One threshold over the scores of every row, from the partitions' partial results
+    merged = _merge(part[1] for part in parts)
+    if algorithm == 'autoencoder':
+        return float(merged.percentile(model.threshold_percentile)), None
+    if algorithm == 'isolation_forest':
+        # IsolationForest places its offset at the contamination quantile of the scores
+        return float(merged.quantile(1 - model.contamination)), None
+
+    # K-Means flags distances above threshold_factor times the largest mean
+    # cluster distance, with the means taken over all rows
+    sums = np.sum([part[3][0] for part in parts], axis=0)
+    counts = np.sum([part[3][1] for part in parts], axis=0)
+    avg_distances = np.divide(sums, counts, out=np.zeros_like(sums), where=counts > 0)
+    if avg_distances.max() > 0:
+        threshold = float(model.threshold_factor * avg_distances.max())
+    else:
+        threshold = float(merged.percentile(95))
+    cluster_thresholds = None
+    if model.per_cluster_threshold:
+        # Empty or zero-spread clusters fall back to the global threshold
+        cluster_thresholds = np.where(avg_distances > 0, model.threshold_factor * avg_distances, threshold)
+    return threshold, cluster_thresholds
+
+def run_partitioned(df, algorithm, n_partitions, time_column=None, value_column=None, params=None,
+                    max_workers=None, fit_rows=None):
+    """
+    Run window-local detection on time partitions of a long series in parallel.
+
+    One model (cleaning statistics, scaler and estimator) is fitted on a
+    sample of contiguous blocks spread over the whole series (see fit_sample),
+    so the scores of all partitions are on the same scale. The rows (assumed
+    in time order) are then split into n_partitions consecutive windows, and
+    each window is scored in its own worker process together with the
+    overlap rows before it, so rolling features at the boundaries are
+    computed from full windows. The overlap rows are dropped again and the
+    partial results are stitched back in the original order.
+
+    Every row is flagged against one global threshold computed as in an
+    unpartitioned run but over all rows: from the merged quantile sketches
+    of the scores for Isolation Forest and the AutoEncoder, and from the
+    merged per-cluster distance sums for K-Means.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Input dataframe with time series data, in time order
+    algorithm : str
+        One of the keys of utils.job_queue.MODEL_CLASSES
+    n_partitions : int
+        Number of time windows
+    time_column : str or None
+        Column name of the timestamps
+    value_column : str or None
+        Column name of the energy consumption values
+    params : dict or None
+        Extra model constructor arguments
+    max_workers : int or None
+        Pool size, defaults to utils.job_queue.nested_pool_size()
+    fit_rows : int or None
+        Rows the shared model is fitted on, defaults to PARTITION_FIT_ROWS
+        or DEFAULT_FIT_SAMPLE_SIZE. Series this short run unpartitioned.
+
+    Returns:
+    --------
+    anomalies : pandas.DataFrame
+        Stitched dataframe with the original data and anomaly predictions
+    metrics : dict
+        Metrics over all rows, with per-partition details under 'partitions'
+    model : None
+        The flags use thresholds merged over all rows rather than those of
+        the fitted model, so it is not registered for scoring
+    """
+    from utils.job_queue import run_detection, nested_pool_size
+    from utils.evaluation import GROUND_TRUTH_COLUMN, label_metrics
+    from ml_models.features import detect_label_column
+
+    if fit_rows is None:
+        fit_rows = int(os.environ.get('PARTITION_FIT_ROWS', DEFAULT_FIT_SAMPLE_SIZE))
+    bounds = partition_bounds(len(df), n_partitions)
+    if algorithm not in PARTITIONED_ALGORITHMS or len(bounds) < 2 or len(df) <= fit_rows:
+        logger.info(f"Running {algorithm} unpartitioned on {len(df)} rows")
+        return run_detection(df, algorithm, time_column=time_column, value_column=value_column, params=params)
+
+    label_column = detect_label_column(df)
+    labels = None
+    if label_column is not None:
+        labels = df[label_column]
+        df = df.drop(columns=[label_column])
+        if value_column == label_column:
+            value_column = None
+
+    # Fit once; the fit's own flags are discarded, only the model is kept
+    sample = fit_sample(df, fit_rows)
+    _, fit_metrics, model = run_detection(sample, algorithm, time_column=time_column,
+                                          value_column=value_column, params=params)
+    if not getattr(model, 'is_fitted', False):
+        raise ValueError(f"{algorithm} could not be fitted on the partition sample: "
+                         f"{fit_metrics.get('note', 'unknown error')}")
+
+    overlap = overlap_rows(model)
+    if max_workers is None:
+        max_workers = nested_pool_size()
+
+    with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(bounds)))) as executor:
+        futures = []
+        for start, end in bounds:
+            context = min(overlap, start)
+            futures.append(executor.submit(_score_partition, df.iloc[start - context:end], context, model))
+        parts = [future.result() for future in futures]
+
+    scores = pd.concat([part[0] for part in parts])
+    threshold, cluster_thresholds = _global_threshold(algorithm, model, parts)
+    anomaly_scores = scores['anomaly_score'].to_numpy()
+    if cluster_thresholds is not None:
+        flags = (anomaly_scores > cluster_thresholds[scores['cluster'].to_numpy()]).astype(int)
+    else:
+        flags = (anomaly_scores > threshold).astype(int)
+
+    anomalies = df.copy()
+    anomalies['is_anomaly'] = flags
+    anomalies['anomaly_score'] = anomaly_scores
+    if 'cluster' in scores.columns:
+        anomalies['cluster'] = scores['cluster'].to_numpy()
+
+    if algorithm == 'isolation_forest':
+        # Per-feature flags against thresholds merged over all partitions
+        for feature in model.feature_sketches:
+            merged = _merge(part[2][feature] for part in parts if feature in part[2])
+            anomalies[f'{feature}_anomaly'] = np.where(anomalies[feature].to_numpy() > merged.percentile(95), 1, 0)
+
+    partitions = []
+    for start, end in bounds:
+        info = {
+            'start_row': start,
+            'end_row': end,
+            'anomaly_count': int(flags[start:end].sum())
+        }
+        if time_column in df.columns:
+            info['start_time'] = str(df[time_column].iloc[start])
+            info['end_time'] = str(df[time_column].iloc[end - 1])
+        partitions.append(info)
+
+    metrics = {
+        'anomaly_count': int(flags.sum()),
+        'anomaly_ratio': float(flags.mean()) if len(flags) else 0.0,
+        'total_points': len(anomalies),
+        'threshold': threshold,
+        'fit_rows': len(sample),
+        'partition_count': len(bounds),
+        'partition_overlap': overlap,
+        'partitions': partitions
+    }
+    if cluster_thresholds is not None:
+        metrics['cluster_thresholds'] = [float(t) for t in cluster_thresholds]
+    if labels is not None:
+        anomalies[GROUND_TRUTH_COLUMN] = labels.to_numpy()
+        metrics.update(label_metrics(labels, flags))
+        metrics['label_column'] = label_column
+
+    logger.info(f"Scored {len(bounds)} {algorithm} partitions with global threshold {threshold}")
+    return anomalies, metrics, None
@@ -0,0 +1,170 @@
+import os
+import gzip
+import json
+import fcntl
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache', 'responses')
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+DEFAULT_MEMORY_BYTES = 64 * 1024 ** 2
+
+# Payloads smaller than this are stored and sent uncompressed
+GZIP_MIN_BYTES = 1024
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+class ResponseCache:
+    def __init__(self, directory=None, max_bytes=None, memory_bytes=None):
+        """
+        Two-level cache of serialized API responses with byte-bounded LRU eviction.
+
+        Entries are kept gzip-compressed (small ones as is) in an in-process
+        LRU in front of a directory of files shared by all web processes. As
+        with the feature cache, files are written to a temporary name and
+        atomically renamed, and eviction runs under a file lock.
+
+        Parameters:
+        -----------
+        directory : str or None
+            Cache directory, defaults to RESPONSE_CACHE_DIR or cache/responses
+        max_bytes : int or None
+            Disk byte budget, defaults to RESPONSE_CACHE_BYTES or 256 MiB
+        memory_bytes : int or None
+            In-process byte budget, defaults to RESPONSE_MEMORY_BYTES or 64 MiB
+        """
+        self.directory = directory or os.environ.get('RESPONSE_CACHE_DIR', DEFAULT_CACHE_DIR)
+        self.max_bytes = int(max_bytes if max_bytes is not None
+                             else os.environ.get('RESPONSE_CACHE_BYTES', DEFAULT_MAX_BYTES))
+        self.memory_bytes = int(memory_bytes if memory_bytes is not None
+                                else os.environ.get('RESPONSE_MEMORY_BYTES', DEFAULT_MEMORY_BYTES))
+        self._memory = OrderedDict()
+        self._memory_total = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts, args=None):
+        """
+        Build a cache key (also used as the ETag) from identifying parts and
+        the request's query parameters, independent of their order.
+
+        Parameters:
+        -----------
+        parts : str or int
+            Identity of the cached resource, e.g. result id and creation date
+        args : werkzeug MultiDict or None
+            Query parameters that select what the response contains
+        """
+        payload = json.dumps({
+            'parts': [str(part) for part in parts],
+            'args': sorted(args.items(multi=True)) if args is not None else []
+        })
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.bin')
+
+    def _remember(self, key, body):
+        # Add an entry to the in-process LRU and drop the oldest beyond its budget
+        if len(body) > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_total -= len(self._memory.pop(key))
+            self._memory[key] = body
+            self._memory_total += len(body)
+            while self._memory_total > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_total -= len(evicted)
+
+    def get(self, key):
+        """
+        Return the stored body for a key, or None on a miss.
+        """
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                return body
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+            # Mark as recently used for LRU eviction
+            os.utime(path)
+        except OSError:
+            return None
+        self._remember(key, body)
+        return body
+
+    def put(self, key, data):
+        """
+        Store a serialized response under a key, compressing large payloads.
+
+        Returns:
+        --------
+        body : bytes
+            Stored body, gzip-compressed when data has at least GZIP_MIN_BYTES
+        """
+        body = gzip.compress(data, compresslevel=6) if len(data) >= GZIP_MIN_BYTES else data
+        self._remember(key, body)
+        if len(body) > self.max_bytes:
+            return body
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f'{self._path(key)}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, self._path(key))
+            self.evict()
+        except OSError as e:
+            logger.warning(f"Could not write response cache entry: {str(e)}")
+        return body
+
+    def evict(self):
+        """
+        Delete least recently used files until the directory fits its budget.
+        """
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.bin'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+def is_compressed(body):
+    """
+    Whether a stored body is gzip-compressed (JSON never starts with the gzip magic).
+    """
+    return body[:2] == GZIP_MAGIC
+
+_default_cache = None
+
+def get_response_cache():
+    """
+    Return the process-wide ResponseCache configured from the environment.
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
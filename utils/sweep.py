@@ -0,0 +1,288 @@
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Constructor arguments that can be swept, with the type values are coerced to
+SWEEP_PARAMS = {
+    'isolation_forest': {'contamination': float, 'n_estimators': int, 'random_state': int,
+                         'fit_sample_size': int},
+    'autoencoder': {'threshold_percentile': float, 'n_components': int},
+    'kmeans': {'n_clusters': int, 'window_size': int, 'threshold_factor': float, 'random_state': int,
+               'per_cluster_threshold': bool},
+    'streaming': {'alpha': float, 'z_threshold': float, 'warmup': int, 'season': str},
+    'ensemble': {'combine': str, 'contamination': float, 'n_estimators': int, 'n_components': int,
+                 'n_clusters': int, 'window_size': int, 'random_state': int}
+}
+
+# Arguments that change the computed features; configs that agree on them share
+# one feature matrix through the feature cache
+FEATURE_PARAMS = {
+    'isolation_forest': (),
+    'autoencoder': (),
+    'kmeans': ('window_size',),
+    'streaming': (),
+    'ensemble': ('window_size',)
+}
+
+# Upper bound on the configurations of one sweep
+MAX_SWEEP_CONFIGS = 200
+
+_frame = None
+
+def _coerce(value, kind):
+    if kind is bool and isinstance(value, str):
+        if value.lower() not in ('true', 'false', '1', '0'):
+            raise ValueError(f"Invalid boolean '{value}'")
+        return value.lower() in ('true', '1')
+    return kind(value)
+
+def expand_grid(algorithm, grid):
+    """
+    Expand a parameter grid into the list of configurations to fit.
+
+    Parameters:
+    -----------
+    algorithm : str
+        Key of SWEEP_PARAMS
+    grid : dict
+        Mapping of constructor argument to a list of values (or a single value)
+
+    Returns:
+    --------
+    configs : list of dict
+        Every combination of the grid values, coerced to the argument types
+    """
+    if algorithm not in SWEEP_PARAMS:
+        raise ValueError(f"Algorithm '{algorithm}' cannot be swept")
+    unknown = [name for name in grid if name not in SWEEP_PARAMS[algorithm]]
+    if unknown:
+        raise ValueError(f"Unknown parameters for {algorithm}: {unknown}")
+
+    names = sorted(grid)
+    values = []
+    for name in names:
+        options = grid[name] if isinstance(grid[name], (list, tuple)) else [grid[name]]
+        if not options:
+            raise ValueError(f"No values given for '{name}'")
+        values.append([_coerce(value, SWEEP_PARAMS[algorithm][name]) for value in options])
+
+    n_configs = 1
+    for options in values:
+        n_configs *= len(options)
+    if n_configs > MAX_SWEEP_CONFIGS:
+        raise ValueError(f"Grid has {n_configs} configurations, the limit is {MAX_SWEEP_CONFIGS}")
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def frame_key(df):
+    """
+    Content hash of a dataframe, used as feature cache key when the data does
+    not come from a dataset store with a recorded hash.
+    """
+    digest = hashlib.sha256(','.join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def _init_sweep_worker(df):
+    # Each worker receives the dataframe once instead of once per configuration
+    global _frame
+    _frame = df
+
+def _run_config(algorithm, params, time_column, value_column, cache_key):
+    from utils.job_queue import run_detection
+    from utils.evaluation import is_fallback
+
+    start = time.perf_counter()
+    anomalies, metrics, _ = run_detection(_frame, algorithm, time_column=time_column,
+                                          value_column=value_column, cache_key=cache_key, params=params)
+    seconds = time.perf_counter() - start
+    if is_fallback(metrics):
+        # The emergency outlier rule says nothing about this configuration
+        raise RuntimeError(metrics['note'])
+
+    entry = {
+        'params': params,
+        'seconds': round(seconds, 4),
+        'anomaly_count': int(anomalies['is_anomaly'].sum()),
+        'anomaly_ratio': float(anomalies['is_anomaly'].mean()) if len(anomalies) else 0.0,
+        'threshold': metrics.get('threshold')
+    }
+    for key in ('precision', 'recall', 'f1_score', 'metrics_source'):
+        if key in metrics:
+            entry[key] = metrics[key]
+    return entry
+
+def rank_results(entries):
+    """
+    Order sweep results best first.
+
+    Configurations are ranked by F1 against the ground-truth labels when the
+    data has them, otherwise by the models' own F1 estimate when every
+    configuration reports one, and by runtime if neither is available.
+
+    Returns:
+    --------
+    ranked : list of dict
+        Entries with a 'rank' field, failed configurations last
+    ranked_by : str
+        Description of the ranking
+    """
+    succeeded = [entry for entry in entries if 'error' not in entry]
+    failed = [entry for entry in entries if 'error' in entry]
+
+    if succeeded and all(entry.get('metrics_source') == 'ground_truth' for entry in succeeded):
+        ranked_by = 'f1_score (ground truth)'
+        succeeded.sort(key=lambda entry: (-entry['f1_score'], entry['seconds']))
+    elif succeeded and all('f1_score' in entry for entry in succeeded):
+        ranked_by = 'f1_score (synthetic labels)'
+        succeeded.sort(key=lambda entry: (-entry['f1_score'], entry['seconds']))
+    else:
+        ranked_by = 'seconds'
+        succeeded.sort(key=lambda entry: entry['seconds'])
+
+    ranked = succeeded + failed
+    for rank, entry in enumerate(ranked, start=1):
+        entry['rank'] = rank
+    return ranked, ranked_by
+
+def run_sweep(df, algorithm, grid, time_column=None, value_column=None, cache_key=None, max_workers=None):
+    """
+    Fit one detector for every configuration of a parameter grid.
+
+    Features are computed once per distinct feature configuration: the first
+    configuration of each group runs before the others and writes its
+    features to the shared feature cache, and the remaining configurations
+    load them from there while being fitted in parallel across a process
+    pool. A ground-truth label column, if present, is used for scoring.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Input dataframe with time series data
+    algorithm : str
+        Key of SWEEP_PARAMS
+    grid : dict
+        Mapping of constructor argument to the list of values to try
+    time_column : str or None
+        Column name of the timestamps
+    value_column : str or None
+        Column name of the energy consumption values; None uses
+        ml_models.features.default_value_column for every configuration
+    cache_key : str or None
+        Content hash of the data; computed from the dataframe if None
+    max_workers : int or None
+        Pool size, defaults to utils.job_queue.nested_pool_size()
+
+    Returns:
+    --------
+    sweep : dict
+        'results' ranked best first with per-configuration timing, anomaly
+        counts and accuracy, plus 'best_params', the 'value_column' used and
+        a summary of the run
+    """
+    from ml_models.features import default_value_column
+    from utils.job_queue import nested_pool_size
+
+    configs = expand_grid(algorithm, grid)
+    if value_column is None:
+        value_column = default_value_column(df)
+    if cache_key is None:
+        cache_key = frame_key(df)
+    if max_workers is None:
+        max_workers = nested_pool_size()
+
+    groups = {}
+    for params in configs:
+        feature_key = tuple(params.get(name) for name in FEATURE_PARAMS[algorithm])
+        groups.setdefault(feature_key, []).append(params)
+    leaders = [group[0] for group in groups.values()]
+    followers = [params for group in groups.values() for params in group[1:]]
+
+    start = time.perf_counter()
+    entries = []
+    with ProcessPoolExecutor(max_workers=max(1, min(max_workers, len(configs))),
+                             initializer=_init_sweep_worker, initargs=(df,)) as executor:
+        # Leaders fill the feature cache before the rest of their group starts
+        for wave in (leaders, followers):
+            futures = [(params, executor.submit(_run_config, algorithm, params, time_column, value_column,
+                                                cache_key))
+                       for params in wave]
+            for params, future in futures:
+                try:
+                    entries.append(future.result())
+                except Exception as e:
+                    logger.error(f"Sweep configuration {params} failed: {str(e)}")
+                    entries.append({'params': params, 'error': str(e) or e.__class__.__name__})
+
+    ranked, ranked_by = rank_results(entries)
+    best = ranked[0] if ranked and 'error' not in ranked[0] else None
+    return {
+        'algorithm': algorithm,
+        'grid': grid,
+        'configs': len(configs),
+        'feature_groups': len(groups),
+        'ranked_by': ranked_by,
+        'value_column': value_column,
+        'seconds': round(time.perf_counter() - start, 4),
+        'best_params': best['params'] if best else None,
+        'results': ranked
+    }
+
+def parse_grid_args(items):
+    """
+    Parse 'name=value1,value2' command-line items into a grid.
+    """
+    grid = {}
+    for item in items:
+        name, sep, values = item.partition('=')
+        if not sep or not values:
+            raise ValueError(f"Expected name=value1,value2 but got '{item}'")
+        grid[name.strip()] = [value.strip() for value in values.split(',')]
+    return grid
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Sweep detector parameters on one dataset.')
+    parser.add_argument('path', help='CSV file or columnar store')
+    parser.add_argument('--algorithm', required=True, choices=sorted(SWEEP_PARAMS), help='Detector to tune')
+    parser.add_argument('--grid', nargs='+', required=True, help='Values to try, e.g. n_clusters=3,5,8')
+    parser.add_argument('--time-column', help='Timestamp column (auto-detected if omitted)')
+    parser.add_argument('--value-column', help='Value column (auto-detected if omitted)')
+    parser.add_argument('--workers', type=int, help='Worker processes')
+    parser.add_argument('--output', default='sweep_results.json', help='Where to write the ranked table')
+    args = parser.parse_args(argv)
+
+    from utils.dataset_store import read_frame, detect_time_column, content_hash
+
+    df = read_frame(args.path)
+    try:
+        grid = parse_grid_args(args.grid)
+        sweep = run_sweep(df, args.algorithm, grid, time_column=args.time_column or detect_time_column(df.columns),
+                          value_column=args.value_column, cache_key=content_hash(args.path),
+                          max_workers=args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+
+    with open(args.output, 'w') as f:
+        json.dump(sweep, f, indent=2)
+
+    print(f"{sweep['configs']} configurations, {sweep['feature_groups']} feature group(s), "
+          f"{sweep['seconds']:.2f}s, ranked by {sweep['ranked_by']}")
+    for entry in sweep['results']:
+        if 'error' in entry:
+            print(f"{entry['rank']:>4}  {json.dumps(entry['params']):<50} FAILED {entry['error']}")
+            continue
+        f1 = f"F1 {entry['f1_score']:.3f}" if 'f1_score' in entry else ''
+        print(f"{entry['rank']:>4}  {json.dumps(entry['params']):<50} {entry['seconds']:8.3f}s "
+              f"{entry['anomaly_count']:>8} anomalies  {f1}")
+    print(f"Results written to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
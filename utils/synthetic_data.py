@@ -0,0 +1,256 @@
+import os
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from ml_models.features import CHUNK_ROWS
+from utils.dataset_store import write_store_chunks
+
+logger = logging.getLogger(__name__)
+
+ANOMALY_TYPES = ('spike', 'dip', 'level_shift')
+
+# Length range (in readings of one meter) of injected level shifts
+LEVEL_SHIFT_STEPS = (5, 15)
+
+# Expected labelled readings per injected anomaly, used to turn the requested
+# anomaly percentage into an anomaly start probability
+MEAN_ANOMALY_STEPS = (1 + 1 + sum(LEVEL_SHIFT_STEPS) / 2) / len(ANOMALY_TYPES)
+
+class SyntheticEnergyData:
+    def __init__(self, n_rows, n_meters=1, anomaly_percentage=5, seed=42,
+                 start='2023-01-01', freq='h', chunk_rows=CHUNK_ROWS):
+        """
+        Vectorized, chunked generator of synthetic energy meter readings.
+
+        Readings have the layout of the bundled sample data (timestamp,
+        consumption, temperature, humidity, occupancy, is_anomaly) plus a
+        meter_id column when there is more than one meter, ordered by time
+        with all meters of one timestamp next to each other. Temperature
+        follows a yearly and daily cycle, humidity falls as temperature rises,
+        occupancy follows a business-hours profile, and consumption is a
+        per-meter base load driven by all three. Spikes, dips and level
+        shifts are injected into consumption and labelled in is_anomaly and
+        anomaly_type.
+
+        Every chunk is generated from its own seeded random stream and level
+        shifts carry over chunk boundaries, so the same seed and chunk_rows
+        always produce the same data without the full table in memory.
+
+        Parameters:
+        -----------
+        n_rows : int
+            Total number of readings
+        n_meters : int, default=1
+            Number of meters reading at every timestamp
+        anomaly_percentage : float, default=5
+            Approximate percentage of readings labelled as anomalies
+        seed : int, default=42
+            Random seed
+        start : str, default='2023-01-01'
+            First timestamp
+        freq : str, default='h'
+            Interval between readings of one meter
+        chunk_rows : int, default=CHUNK_ROWS
+            Readings per generated chunk (rounded down to whole timestamps)
+        """
+        if n_rows < 1 or n_meters < 1:
+            raise ValueError("n_rows and n_meters must be positive")
+
+        self.n_rows = int(n_rows)
+        self.n_meters = int(n_meters)
+        self.anomaly_percentage = anomaly_percentage
+        self.seed = seed
+        self.start = pd.Timestamp(start)
+        self.freq = pd.Timedelta(pd.tseries.frequencies.to_offset(freq))
+        self.chunk_steps = max(1, int(chunk_rows) // self.n_meters)
+
+        # Per-meter characteristics come from a stream of their own
+        rng = np.random.default_rng([seed, 0])
+        self.base_load = rng.uniform(80, 160, self.n_meters)
+        self.daily_amplitude = rng.uniform(0.1, 0.3, self.n_meters) * self.base_load
+        self.max_occupancy = rng.integers(20, 120, self.n_meters)
+        self.temperature_offset = rng.normal(0, 1.5, self.n_meters)
+        self.cooling_factor = rng.uniform(1.0, 3.0, self.n_meters)
+        self.heating_factor = rng.uniform(0.5, 2.0, self.n_meters)
+        self.noise_scale = 0.03 * self.base_load
+
+    @property
+    def columns(self):
+        columns = ['timestamp']
+        if self.n_meters > 1:
+            columns.append('meter_id')
+        return columns + ['consumption', 'temperature', 'humidity', 'occupancy', 'is_anomaly', 'anomaly_type']
+
+    def _inject_anomalies(self, rng, consumption, carry):
+        # Offsets of level shifts are spread with a difference array over the
+        # chunk plus the longest shift, so shifts can run into the next chunk
+        steps, meters = consumption.shape
+        max_steps = LEVEL_SHIFT_STEPS[1]
+        start_probability = self.anomaly_percentage / 100 / MEAN_ANOMALY_STEPS
+        starts = np.argwhere(rng.random((steps, meters)) < start_probability)
+        types = rng.integers(len(ANOMALY_TYPES), size=len(starts))
+        magnitudes = rng.uniform(0.3, 0.8, len(starts)) * self.base_load[starts[:, 1]]
+
+        offsets = np.zeros((steps + max_steps + 1, meters))
+        lengths = np.where(types == 2, rng.integers(LEVEL_SHIFT_STEPS[0], max_steps + 1, len(starts)), 1)
+        signs = np.where(types == 0, 1.0, np.where(types == 1, -1.0, rng.choice([-1.0, 1.0], len(starts))))
+        # Level shifts are milder than single-reading spikes and dips
+        magnitudes = np.where(types == 2, 0.5 * magnitudes, magnitudes) * signs
+        np.add.at(offsets, (starts[:, 0], starts[:, 1]), magnitudes)
+        np.add.at(offsets, (starts[:, 0] + lengths, starts[:, 1]), -magnitudes)
+
+        counts = np.zeros_like(offsets, dtype=np.int64)
+        np.add.at(counts, (starts[:, 0], starts[:, 1]), 1)
+        np.add.at(counts, (starts[:, 0] + lengths, starts[:, 1]), -1)
+
+        type_codes = np.zeros((steps + max_steps, meters), dtype=np.int8)
+        for code in range(len(ANOMALY_TYPES)):
+            marks = np.zeros((steps + max_steps + 1, meters), dtype=np.int64)
+            chosen = starts[types == code]
+            np.add.at(marks, (chosen[:, 0], chosen[:, 1]), 1)
+            np.add.at(marks, (chosen[:, 0] + lengths[types == code], chosen[:, 1]), -1)
+            type_codes[np.cumsum(marks, axis=0)[:-1] > 0] = code + 1
+
+        shift = np.cumsum(offsets, axis=0)[:-1]
+        active = np.cumsum(counts, axis=0)[:-1]
+        shift[:max_steps] += carry['shift']
+        active[:max_steps] += carry['active']
+        carried_types = carry['types'] > 0
+        type_codes[:max_steps][carried_types & (type_codes[:max_steps] == 0)] = carry['types'][
+            carried_types & (type_codes[:max_steps] == 0)]
+
+        next_carry = {
+            'shift': shift[steps:steps + max_steps].copy(),
+            'active': active[steps:steps + max_steps].copy(),
+            'types': type_codes[steps:steps + max_steps].copy()
+        }
+
+        consumption = np.maximum(consumption + shift[:steps], 0.0)
+        labels = (active[:steps] > 0).astype(np.int8)
+        return consumption, labels, type_codes[:steps], next_carry
+
+    def iter_chunks(self):
+        """
+        Yield the readings as consecutive dataframes.
+
+        Yields:
+        -------
+        chunk : pandas.DataFrame
+            Readings of up to chunk_rows rows in the order of columns
+        """
+        total_steps = -(-self.n_rows // self.n_meters)
+        max_steps = LEVEL_SHIFT_STEPS[1]
+        carry = {
+            'shift': np.zeros((max_steps, self.n_meters)),
+            'active': np.zeros((max_steps, self.n_meters), dtype=np.int64),
+            'types': np.zeros((max_steps, self.n_meters), dtype=np.int8)
+        }
+        type_names = np.array([''] + list(ANOMALY_TYPES))
+        meter_ids = np.array([f"M{idx:05d}" for idx in range(self.n_meters)])
+
+        for chunk_index, first_step in enumerate(range(0, total_steps, self.chunk_steps)):
+            rng = np.random.default_rng([self.seed, chunk_index + 1])
+            steps = min(self.chunk_steps, total_steps - first_step)
+            timestamps = pd.date_range(self.start + first_step * self.freq, periods=steps, freq=self.freq)
+            hours = np.asarray(timestamps.hour + timestamps.minute / 60, dtype=np.float64)[:, None]
+            day_of_year = np.asarray(timestamps.dayofyear, dtype=np.float64)[:, None]
+            weekday = np.asarray(timestamps.dayofweek < 5)[:, None]
+
+            # Weather shared by all meters, with a small per-meter offset
+            temperature = (15 + 10 * np.sin(2 * np.pi * (day_of_year - 100) / 365)
+                           + 5 * np.sin(2 * np.pi * (hours - 9) / 24)
+                           + self.temperature_offset + rng.normal(0, 1.0, (steps, self.n_meters)))
+            humidity = np.clip(60 - 1.2 * (temperature - 15) + rng.normal(0, 5, (steps, self.n_meters)), 10, 100)
+
+            business_hours = np.clip(np.sin(np.pi * (hours - 7) / 12), 0, None) * np.where(weekday, 1.0, 0.2)
+            occupancy = rng.poisson(self.max_occupancy * business_hours + 1).astype(np.int32)
+
+            consumption = (self.base_load
+                           + self.daily_amplitude * np.sin(2 * np.pi * (hours - 6) / 24)
+                           + self.cooling_factor * np.maximum(temperature - 22, 0)
+                           + self.heating_factor * np.maximum(16 - temperature, 0)
+                           + 0.5 * occupancy
+                           + rng.normal(0, 1, (steps, self.n_meters)) * self.noise_scale)
+            consumption, labels, type_codes, carry = self._inject_anomalies(rng, consumption, carry)
+
+            # Flatten time-major and drop readings past n_rows in the last step
+            n = min(steps * self.n_meters, self.n_rows - first_step * self.n_meters)
+            data = {'timestamp': np.repeat(timestamps.to_numpy(), self.n_meters)[:n]}
+            if self.n_meters > 1:
+                data['meter_id'] = np.tile(meter_ids, steps)[:n]
+            data['consumption'] = consumption.ravel()[:n]
+            data['temperature'] = temperature.ravel()[:n]
+            data['humidity'] = humidity.ravel()[:n]
+            data['occupancy'] = occupancy.ravel()[:n]
+            data['is_anomaly'] = labels.ravel()[:n]
+            data['anomaly_type'] = type_names[type_codes.ravel()[:n]]
+            yield pd.DataFrame(data, index=pd.RangeIndex(first_step * self.n_meters,
+                                                         first_step * self.n_meters + n))
+
+    def to_frame(self):
+        """
+        Generate all readings into one dataframe (small datasets only).
+        """
+        return pd.concat(self.iter_chunks())
+
+    def write_csv(self, path):
+        """
+        Stream the readings into a CSV file, one chunk at a time.
+
+        Returns:
+        --------
+        str
+            Path of the written file
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'w', newline='') as f:
+            for idx, chunk in enumerate(self.iter_chunks()):
+                chunk.to_csv(f, index=False, header=idx == 0, date_format='%Y-%m-%d %H:%M:%S')
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote {self.n_rows} synthetic readings to {path}")
+        return path
+
+    def write_store(self, path):
+        """
+        Stream the readings into a columnar store (see utils.dataset_store).
+
+        Returns:
+        --------
+        str
+            Path of the store directory
+        """
+        # Text columns are sized for their longest possible value up front
+        dtypes = {'meter_id': f"<U{len(f'M{self.n_meters - 1:05d}')}",
+                  'anomaly_type': f"<U{max(len(name) for name in ANOMALY_TYPES)}"}
+        target = write_store_chunks(self.iter_chunks(), path, self.n_rows, time_column='timestamp',
+                                    dtypes=dtypes)
+        logger.info(f"Wrote {self.n_rows} synthetic readings to {target}")
+        return target
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic energy meter data.')
+    parser.add_argument('path', help='Output CSV path (the columnar store is written next to it with --store)')
+    parser.add_argument('--rows', type=int, default=100000, help='Total number of readings')
+    parser.add_argument('--meters', type=int, default=1, help='Number of meters')
+    parser.add_argument('--anomaly-percentage', type=float, default=5, help='Approximate anomaly percentage')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.add_argument('--start', default='2023-01-01', help='First timestamp')
+    parser.add_argument('--freq', default='h', help='Interval between readings of one meter')
+    parser.add_argument('--store', action='store_true', help='Also write the columnar store')
+    parser.add_argument('--store-only', action='store_true', help='Only write the columnar store')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    generator = SyntheticEnergyData(args.rows, n_meters=args.meters, anomaly_percentage=args.anomaly_percentage,
+                                    seed=args.seed, start=args.start, freq=args.freq)
+    if not args.store_only:
+        generator.write_csv(args.path)
+    if args.store or args.store_only:
+        generator.write_store(args.path)
+
+if __name__ == '__main__':
+    main()
@@ -1,131 +1,248 @@
+import os
+import time
+import logging
+import threading
 import pandas as pd
 import numpy as np
 import json
 from datetime import datetime, timedelta
+from utils.dataset_store import read_frame, detect_time_column
 
-def generate_overview_charts(datasets, results):
+logger = logging.getLogger(__name__)
+
+# Per-user dashboard overviews: user_id -> (expiry on time.monotonic(), overview_data)
+_overview_cache = {}
+_overview_lock = threading.Lock()
+
+DOW_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+# Number of highest-scoring anomalies and of score histogram bins kept in a result summary
+TOP_ANOMALIES = 10
+SCORE_BINS = 20
+
+def _anomaly_counts(values, flags, size, offset=0):
+    # Anomalies per calendar bucket (hour, weekday or month); rows without a time count nowhere
+    values = np.asarray(values, dtype=np.float64)[flags]
+    values = values[np.isfinite(values)].astype(np.int64) - offset
+    values = values[(values >= 0) & (values < size)]
+    return np.bincount(values, minlength=size).tolist()
+
+def summarize_result(anomalies, time_column=None, value_column=None):
+    """
+    Compute the aggregates the dashboard, insights and recommendations show
+    for a detection result, so they never have to re-read the result file.
+    
+    Parameters:
+    -----------
+    anomalies : pandas.DataFrame
+        Detection output with 'is_anomaly' and optionally 'anomaly_score'
+    time_column : str or None
+        Column name of the timestamps; detected from the column names if None
+    value_column : str or None
+        Column name of the energy consumption values
+        
+    Returns:
+    --------
+    summary : dict
+        Anomaly counts by hour, weekday and month (None without timestamps),
+        anomaly score histogram, count of high-severity anomalies and the
+        TOP_ANOMALIES highest-scoring anomalies
+    """
+    flags = anomalies['is_anomaly'].to_numpy() == 1
+    summary = {
+        'total_points': len(anomalies),
+        'anomaly_count': int(flags.sum()),
+        'anomalies_by_hour': None,
+        'anomalies_by_dow': None,
+        'anomalies_by_month': None,
+        'score_histogram': None,
+        'high_severity_count': 0,
+        'top_anomalies': []
+    }
+    
+    time_column = time_column or detect_time_column(anomalies.columns)
+    times = None
+    if time_column and time_column in anomalies.columns:
+        times = pd.DatetimeIndex(pd.to_datetime(anomalies[time_column], errors='coerce'))
+    
+    # Calendar columns added during preprocessing take precedence, as in the charts
+    for key, column, attribute, size, offset in (('anomalies_by_hour', 'hour', 'hour', 24, 0),
+                                                 ('anomalies_by_dow', 'day_of_week', 'dayofweek', 7, 0),
+                                                 ('anomalies_by_month', 'month', 'month', 12, 1)):
+        if column in anomalies.columns:
+            values = pd.to_numeric(anomalies[column], errors='coerce').to_numpy()
+        elif times is not None:
+            values = getattr(times, attribute).to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            continue
+        summary[key] = _anomaly_counts(values, flags, size, offset)
+    
+    if 'anomaly_score' in anomalies.columns:
+        scores = pd.to_numeric(anomalies['anomaly_score'], errors='coerce').to_numpy(dtype=np.float64)
+        finite = np.isfinite(scores)
+        if finite.any():
+            counts, edges = np.histogram(scores[finite], bins=SCORE_BINS)
+            summary['score_histogram'] = {
+                'edges': edges.tolist(),
+                'counts': counts.tolist(),
+                'anomalies': np.histogram(scores[finite & flags], bins=edges)[0].tolist()
+            }
+        
+        # Anomalies scoring above the upper quartile of the anomaly scores
+        anomaly_scores = scores[flags & finite]
+        if len(anomaly_scores):
+            summary['high_severity_count'] = int(np.sum(anomaly_scores > np.quantile(anomaly_scores, 0.75)))
+        
+        positions = np.flatnonzero(flags & finite)
+        top = positions[np.argsort(-scores[positions], kind='stable')[:TOP_ANOMALIES]]
+        for position in top:
+            entry = {'row': int(position), 'score': float(scores[position])}
+            if times is not None:
+                entry['timestamp'] = str(anomalies[time_column].iloc[position])
+            if value_column and value_column in anomalies.columns:
+                value = anomalies[value_column].iloc[position]
+                entry['value'] = float(value) if pd.notna(value) else None
+            summary['top_anomalies'].append(entry)
+    
+    return summary
+
+def get_result_summary(result):
+    """
+    Return the stored summary of a result. Results saved before summaries were
+    stored are summarized from their result file.
+    """
+    if result.summary:
+        return result.summary
+    
+    dataset = result.dataset
+    result_df = read_frame(result.result_path, columns=[
+        dataset.time_column, dataset.value_column, 'is_anomaly', 'anomaly_score', 'hour', 'day_of_week', 'month'
+    ])
+    return summarize_result(result_df, time_column=dataset.time_column, value_column=dataset.value_column)
+
+def _overview_ttl():
+    return float(os.environ.get('DASHBOARD_CACHE_SECONDS', 30))
+
+def invalidate_overview(user_id):
+    """
+    Drop the cached dashboard overview of a user, e.g. after an upload.
+    """
+    with _overview_lock:
+        _overview_cache.pop(user_id, None)
+
+def generate_overview_charts(user_id):
     """
     Generate overview data for dashboard charts.
     
+    Counts are aggregated by the database (GROUP BY and a window function for
+    the latest result of each algorithm), so only a handful of rows are
+    loaded however many datasets and results the user has. The overview is
+    kept per user for DASHBOARD_CACHE_SECONDS seconds (default 30).
+    
     Parameters:
     -----------
-    datasets : list
-        List of Dataset objects
-    results : list
-        List of AnomalyResult objects
+    user_id : int
+        ID of the user whose datasets and results are summarized
         
     Returns:
     --------
     overview_data : dict
         Dictionary with chart data for the dashboard
     """
-    overview_data = {}
+    with _overview_lock:
+        cached = _overview_cache.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
     
-    # Data summary
-    overview_data['dataset_count'] = len(datasets)
-    overview_data['result_count'] = len(results)
+    from sqlalchemy import func
+    from sqlalchemy.orm import defer
+    from app import db
+    from models import Dataset, AnomalyResult
+    
+    overview_data = {}
     
     # Datasets over time
-    if datasets:
-        dataset_dates = [ds.upload_date for ds in datasets]
-        dataset_counts = pd.Series(dataset_dates).dt.date.value_counts().sort_index()
-        
-        overview_data['datasets_over_time'] = {
-            'labels': [str(date) for date in dataset_counts.index],
-            'values': dataset_counts.values.tolist()
-        }
-    else:
-        overview_data['datasets_over_time'] = {
-            'labels': [],
-            'values': []
-        }
+    upload_day = func.date(Dataset.upload_date)
+    dataset_counts = db.session.query(upload_day, func.count(Dataset.id)).filter(
+        Dataset.user_id == user_id
+    ).group_by(upload_day).order_by(upload_day).all()
+    
+    overview_data['datasets_over_time'] = {
+        'labels': [str(day) for day, _ in dataset_counts],
+        'values': [count for _, count in dataset_counts]
+    }
     
     # Results by algorithm
-    if results:
-        algorithm_counts = pd.Series([r.algorithm for r in results]).value_counts()
-        
-        overview_data['results_by_algorithm'] = {
-            'labels': algorithm_counts.index.tolist(),
-            'values': algorithm_counts.values.tolist()
-        }
-    else:
-        overview_data['results_by_algorithm'] = {
-            'labels': [],
-            'values': []
-        }
+    algorithm_counts = db.session.query(AnomalyResult.algorithm, func.count(AnomalyResult.id)).filter(
+        AnomalyResult.user_id == user_id
+    ).group_by(AnomalyResult.algorithm).order_by(func.count(AnomalyResult.id).desc()).all()
+    
+    overview_data['results_by_algorithm'] = {
+        'labels': [algorithm for algorithm, _ in algorithm_counts],
+        'values': [count for _, count in algorithm_counts]
+    }
+    
+    # Data summary
+    overview_data['dataset_count'] = sum(overview_data['datasets_over_time']['values'])
+    overview_data['result_count'] = sum(overview_data['results_by_algorithm']['values'])
+    
+    # Latest result of each algorithm; their metrics and summaries are deferred and
+    # only loaded for the ones actually shown
+    recency = func.row_number().over(partition_by=AnomalyResult.algorithm,
+                                     order_by=(AnomalyResult.creation_date.desc(), AnomalyResult.id.desc()))
+    ranked = db.session.query(AnomalyResult.id, recency.label('recency')).filter(
+        AnomalyResult.user_id == user_id
+    ).subquery()
+    latest_by_algorithm = {
+        result.algorithm: result
+        for result in AnomalyResult.query.options(defer(AnomalyResult.metrics), defer(AnomalyResult.summary)).join(
+            ranked, AnomalyResult.id == ranked.c.id
+        ).filter(ranked.c.recency == 1)
+    }
     
     # Anomaly distribution by hour (using latest result if available)
-    if results:
-        latest_result = max(results, key=lambda r: r.creation_date)
+    overview_data['anomalies_by_hour'] = {
+        'labels': list(range(24)),
+        'values': [0] * 24
+    }
+    if latest_by_algorithm:
+        latest_result = max(latest_by_algorithm.values(), key=lambda r: (r.creation_date, r.id))
         
         try:
-            # Load result data
-            result_df = pd.read_csv(latest_result.result_path)
-            
-            # Get dataset for time column
-            dataset = latest_result.dataset
-            
-            # Convert time column to datetime
-            if not pd.api.types.is_datetime64_any_dtype(result_df[dataset.time_column]):
-                result_df[dataset.time_column] = pd.to_datetime(result_df[dataset.time_column])
-            
-            # Group anomalies by hour
-            result_df['hour'] = result_df[dataset.time_column].dt.hour
-            anomalies_by_hour = result_df[result_df['is_anomaly'] == 1]['hour'].value_counts().sort_index()
-            
-            # Generate all hours (0-23) to ensure complete data
-            all_hours = pd.Series(range(24), name='hour')
-            anomalies_by_hour = anomalies_by_hour.reindex(all_hours, fill_value=0)
-            
-            overview_data['anomalies_by_hour'] = {
-                'labels': list(range(24)),
-                'values': anomalies_by_hour.values.tolist()
-            }
+            # Hourly breakdown stored with the result at detection time
+            anomalies_by_hour = get_result_summary(latest_result)['anomalies_by_hour']
+            if anomalies_by_hour:
+                overview_data['anomalies_by_hour']['values'] = anomalies_by_hour
         except Exception as e:
-            # Fallback if there's an error
-            overview_data['anomalies_by_hour'] = {
-                'labels': list(range(24)),
-                'values': [0] * 24
-            }
-    else:
-        overview_data['anomalies_by_hour'] = {
-            'labels': list(range(24)),
-            'values': [0] * 24
-        }
+            logger.warning(f"Could not load the summary of result {latest_result.id}: {str(e)}")
     
     # Generate model performance data if metrics are available
-    if results:
-        metrics_data = {
-            'algorithms': [],
-            'precision': [],
-            'recall': [],
-            'f1_score': []
-        }
-        
-        for algorithm in ['isolation_forest', 'autoencoder', 'kmeans']:
-            # Filter results by algorithm
-            algo_results = [r for r in results if r.algorithm == algorithm]
-            
-            if algo_results:
-                # Get the latest result for this algorithm
-                latest = max(algo_results, key=lambda r: r.creation_date)
-                
-                # Add metrics if available
-                if latest.metrics:
-                    metrics = latest.metrics
-                    metrics_data['algorithms'].append(algorithm)
-                    metrics_data['precision'].append(metrics.get('precision', 0))
-                    metrics_data['recall'].append(metrics.get('recall', 0))
-                    metrics_data['f1_score'].append(metrics.get('f1_score', 0))
+    metrics_data = {
+        'algorithms': [],
+        'precision': [],
+        'recall': [],
+        'f1_score': []
+    }
+    
+    for algorithm in ['isolation_forest', 'autoencoder', 'kmeans']:
+        latest = latest_by_algorithm.get(algorithm)
         
-        overview_data['model_performance'] = metrics_data
-    else:
-        overview_data['model_performance'] = {
-            'algorithms': [],
-            'precision': [],
-            'recall': [],
-            'f1_score': []
-        }
+        # Add metrics if available
+        if latest is not None and latest.metrics:
+            metrics = latest.metrics
+            metrics_data['algorithms'].append(algorithm)
+            metrics_data['precision'].append(metrics.get('precision', 0))
+            metrics_data['recall'].append(metrics.get('recall', 0))
+            metrics_data['f1_score'].append(metrics.get('f1_score', 0))
+    
+    overview_data['model_performance'] = metrics_data
+    
+    with _overview_lock:
+        _overview_cache[user_id] = (time.monotonic() + _overview_ttl(), overview_data)
+        # Expired entries of other users are dropped as new ones are added
+        now = time.monotonic()
+        for expired in [key for key, (expires, _) in _overview_cache.items() if expires <= now]:
+            del _overview_cache[expired]
     
     return overview_data
 
@@ -149,7 +266,9 @@ def generate_result_visualizations(result, dataset):
     
     try:
         # Load result data
-        result_df = pd.read_csv(result.result_path)
+        result_df = read_frame(result.result_path, columns=[
+            dataset.time_column, dataset.value_column, 'is_anomaly', 'anomaly_score'
+        ])
         
         # Convert time column to datetime
         if not pd.api.types.is_datetime64_any_dtype(result_df[dataset.time_column]):
@@ -164,36 +283,22 @@ def generate_result_visualizations(result, dataset):
         }
         visualization_data['time_series'] = time_series
         
-        # Anomaly distribution by time
-        if 'hour' not in result_df.columns:
-            result_df['hour'] = result_df[dataset.time_column].dt.hour
-            
-        if 'day_of_week' not in result_df.columns:
-            result_df['day_of_week'] = result_df[dataset.time_column].dt.dayofweek
-            
-        if 'month' not in result_df.columns:
-            result_df['month'] = result_df[dataset.time_column].dt.month
-        
-        # Anomalies by hour
-        anomalies_by_hour = result_df[result_df['is_anomaly'] == 1]['hour'].value_counts().sort_index()
-        all_hours = pd.Series(range(24), name='hour')
-        anomalies_by_hour = anomalies_by_hour.reindex(all_hours, fill_value=0)
-        
+        # Anomaly distribution by time, from the stored summary
+        summary = get_result_summary(result)
         visualization_data['anomalies_by_hour'] = {
             'labels': list(range(24)),
-            'values': anomalies_by_hour.values.tolist()
+            'values': summary['anomalies_by_hour'] or [0] * 24
         }
-        
-        # Anomalies by day of week
-        dow_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-        anomalies_by_dow = result_df[result_df['is_anomaly'] == 1]['day_of_week'].value_counts().sort_index()
-        all_dows = pd.Series(range(7), name='day_of_week')
-        anomalies_by_dow = anomalies_by_dow.reindex(all_dows, fill_value=0)
-        
         visualization_data['anomalies_by_dow'] = {
-            'labels': dow_names,
-            'values': anomalies_by_dow.values.tolist()
+            'labels': DOW_NAMES,
+            'values': summary['anomalies_by_dow'] or [0] * 7
+        }
+        visualization_data['anomalies_by_month'] = {
+            'labels': list(range(1, 13)),
+            'values': summary['anomalies_by_month'] or [0] * 12
         }
+        visualization_data['score_histogram'] = summary['score_histogram']
+        visualization_data['top_anomalies'] = summary['top_anomalies']
         
         # Algorithm metrics
         if result.metrics:
@@ -227,25 +332,15 @@ def generate_recommendations(results):
     try:
         # Get the latest result
         latest_result = max(results, key=lambda r: r.creation_date)
-        result_df = pd.read_csv(latest_result.result_path)
-        dataset = latest_result.dataset
-        
-        # Ensure datetime conversion
-        if not pd.api.types.is_datetime64_any_dtype(result_df[dataset.time_column]):
-            result_df[dataset.time_column] = pd.to_datetime(result_df[dataset.time_column])
+        summary = get_result_summary(latest_result)
         
-        # Add hour if not present
-        if 'hour' not in result_df.columns:
-            result_df['hour'] = result_df[dataset.time_column].dt.hour
-            
-        # Filter anomalies
-        anomalies = result_df[result_df['is_anomaly'] == 1]
-        
-        if len(anomalies) > 0:
+        if summary['anomaly_count'] > 0:
             # Check for patterns in anomalies
             
-            # 1. Check for time-based patterns
-            hour_counts = anomalies['hour'].value_counts()
+            # 1. Check for time-based patterns: hours with more anomalies than
+            # the average hour that has any
+            hour_counts = pd.Series(summary['anomalies_by_hour'] or [], dtype=float)
+            hour_counts = hour_counts[hour_counts > 0]
             peak_hours = hour_counts[hour_counts > hour_counts.mean()].index.tolist()
             
             if peak_hours:
@@ -258,19 +353,16 @@ def generate_recommendations(results):
                 })
             
             # 2. Check for intensity-based patterns
-            if 'anomaly_score' in anomalies.columns:
-                high_score_anomalies = anomalies[anomalies['anomaly_score'] > anomalies['anomaly_score'].quantile(0.75)]
-                
-                if len(high_score_anomalies) > 0:
-                    recommendations.append({
-                        'title': 'High Severity Anomalies Detected',
-                        'description': f'Found {len(high_score_anomalies)} high-severity anomalies that significantly '
-                                       f'deviate from normal patterns. Prioritize investigation of these incidents.',
-                        'type': 'intensity'
-                    })
+            if summary['high_severity_count'] > 0:
+                recommendations.append({
+                    'title': 'High Severity Anomalies Detected',
+                    'description': f'Found {summary["high_severity_count"]} high-severity anomalies that significantly '
+                                   f'deviate from normal patterns. Prioritize investigation of these incidents.',
+                    'type': 'intensity'
+                })
             
             # 3. General recommendations based on anomaly count
-            anomaly_percentage = (len(anomalies) / len(result_df)) * 100
+            anomaly_percentage = (summary['anomaly_count'] / summary['total_points']) * 100
             
             if anomaly_percentage > 10:
                 recommendations.append({